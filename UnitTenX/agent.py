@@ -5,10 +5,16 @@ from langgraph.graph import StateGraph, END
 from langgraph.errors import GraphRecursionError
 from langchain_core.runnables.graph import CurveStyle, MermaidDrawMethod, NodeStyles
 from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import AIMessage
 import os
 import textwrap
 from typing import List, Tuple
 from utils.utils import fix_relative_paths
+from utils.batch import BATCH, BATCH_DIR, get_custom_id, load_results, load_state, save_state
+from utils.blobs import get_blob
+from utils.model import content_to_text
+from utils.routing import load_routing
+from utils.timing import timed
 from utils.nodes import *
 from utils.state import *
 import yaml
@@ -30,9 +36,32 @@ def parse_args(arg_list: list[str] | None):
     print('Set UNITTENX_TIMEOUT=<time-in-sec> to set maximum timeout for test execution.')
     print('Set ESBMC_UNWIND=<value> to set maximum unrolling parameter.')
     print('Set ESBMC_TIMEOUT=<time>[s|m|h] to set maximum timeout parameter.')
+    print('Set ESBMC_JOBS=<n> to set how many ESBMC passes of a target run at the same time.')
+    print('Set ESBMC_CACHE=0 to disable the ESBMC result cache in UNIT_TENX_CACHE (default .cache).')
+    print('Set ESBMC_MAX_CEX=<n> and ESBMC_MAX_OUTPUT=<bytes> to stop an ESBMC pass early (0 is no limit).')
+    print('Set ESBMC_SPLIT_PROPERTIES=1 to check each property class in its own ESBMC job')
+    print('    (ESBMC_PROPERTY_TIMEOUT=<time>[s|m|h] sets their timeout).')
+    print('Set ESBMC_PORTFOLIO=default,low-unwind,high-unwind,k-induction,incremental-bmc')
+    print('    (or a subset) to race ESBMC configurations and remember the winner per function.')
+    print('Set ESBMC_TARGETED=0 to stop asking ESBMC for inputs reaching uncovered lines.')
     print('Set ESBMC_FLAGS="<flags>" to set additional flags to esbmc.')
     print('Set AGENT_REMOTE_VERSION=<version-number> if --ssh is used to')
     print('    use the right remote toolset.')
+    print('Set UNITTENX_USE_RATE_LIMITER=1 to share a rate limiter among all agents')
+    print('    (UNITTENX_RPM and UNITTENX_TPM override requests/tokens per minute).')
+    print('Set UNITTENX_ROUTING=<yaml-file> (or --routing) to pick a model per node.')
+    print('Set UNITTENX_BATCH=prepare|resume (or --batch) to submit symbolic prompts')
+    print('    as a batch, and UNITTENX_BATCH_DIR=<dir> to share the batch among targets.')
+    print('Set UNITTENX_RECORD=<session-file> to record model responses, and use')
+    print('    --model_name=replay:<session-file> to replay them offline.')
+    print('Set UNITTENX_TIMING=<file> to append the wall time of each node to file.')
+    print('Set UNITTENX_SANDBOX_MEMORY=<size>[K|M|G], UNITTENX_SANDBOX_CPU_TIME=<sec>,')
+    print('    UNITTENX_SANDBOX_NPROC=<n> and UNITTENX_SANDBOX_TIMEOUT=<sec> to limit ESBMC and test')
+    print('    runs, UNITTENX_SANDBOX_CGROUP=<delegated cgroup v2 dir> to enforce them with cgroups,')
+    print('    and UNITTENX_MEMORY_BUDGET=<size>[K|M|G] to share memory among all runs in the host.')
+    print('Set UNITTENX_AST_CACHE=0 to disable the preprocessed source and AST cache.')
+    print('Set UNITTENX_BLOB_DIR=<dir> to keep large state fields (source, tests, logs)')
+    print('    in <dir> instead of UNIT_TENX_CACHE/blobs.')
 
     model_name = os.getenv('MODEL_NAME', 'openai')
 
@@ -54,11 +83,20 @@ def parse_args(arg_list: list[str] | None):
     parser.add_argument('--ssh', default="")
     parser.add_argument('--draw', default="")
     parser.add_argument('--max_number_of_iterations', default=3, type=int)
+    parser.add_argument('--routing', default=os.getenv('UNITTENX_ROUTING', ''))
+    parser.add_argument('--batch', choices=["", "prepare", "resume"], default=BATCH)
+    parser.add_argument('--batch_dir', default=BATCH_DIR)
 
     args = parser.parse_args(arg_list)
 
     args.I = fix_relative_paths(args.I)
 
+    if args.routing:
+        args.routing = fix_relative_paths(args.routing)
+
+    if args.batch_dir:
+        args.batch_dir = fix_relative_paths(args.batch_dir)
+
     args.cflags = (
         args.cflags + 
         ' '.join(['-D' + inc for inc in args.D]) +
@@ -89,7 +127,10 @@ def run(
         model_name="openai",
         with_messages=False,
         ssh="",
-        draw=""):
+        draw="",
+        routing="",
+        batch="",
+        batch_dir=""):
 
     '''
         Runs the langgraph agent for unit test generation.
@@ -105,10 +146,17 @@ def run(
         :param language: language to generate and analyze tests.
         :param target_type: function or class (type of target).
         :param target_name: name of target.
-        :param model_name: model name (openai or anthropic).
+        :param model_name: model name (openai or anthropic), or comma separated
+            list of backends in order of preference (e.g. anthropic,openai).
         :param with_messages: make sure we capture messages.
         :param ssh: remote connection to machine for coverage extraction.
         :param draw: just draw the graph and quits.
+        :param routing: yaml file mapping graph nodes to models.
+        :param batch: '' to run interactively, 'prepare' to stop after the
+            symbolic engine writing its prompt as a batch request, or 'resume'
+            to continue from the batch result.
+        :param batch_dir: directory with batch requests, results and states.
+            If none, use project/batch.
 
         :return: initial state dictionary.
     '''
@@ -143,16 +191,29 @@ def run(
     workflow = StateGraph(AgentState)
 
     # Define the two nodes we will cycle between
-    # implied_functions -> symbolic -> (unit-test -> coverage -> reflection)*
-    workflow.add_node("implied_functions", implied_functions)
-    workflow.add_node("symbolic", symbolic)
-    workflow.add_node("unit_test", unit_test)
-    workflow.add_node("coverage", coverage)
-    workflow.add_node("reflection", reflection)
+    # implied_functions -> symbolic ->
+    #     (unit-test -> coverage -> targeted_symbolic -> reflection)*
+    workflow.add_node("implied_functions", timed("implied_functions", implied_functions))
+    workflow.add_node("symbolic", timed("symbolic", symbolic))
+    workflow.add_node("unit_test", timed("unit_test", unit_test))
+    workflow.add_node("coverage", timed("coverage", coverage))
+    workflow.add_node("targeted_symbolic", timed("targeted_symbolic", targeted_symbolic))
+    workflow.add_node("reflection", timed("reflection", reflection))
 
     # Set the entrypoint as `agent`
     # This means that this node is the first one called
-    workflow.set_entry_point("implied_functions")
+    if batch == "resume":
+        # we continue from the saved state with the batch result
+        # as the symbolic test.
+        workflow.set_conditional_entry_point(
+            has_symbolic_test,
+            {
+                "continue": "coverage",
+                "skip": "unit_test"
+            }
+        )
+    else:
+        workflow.set_entry_point("implied_functions")
 
     # We now add a conditional edge
     workflow.add_conditional_edges(
@@ -175,23 +236,41 @@ def run(
 
     workflow.add_edge("implied_functions", "symbolic")
     workflow.add_edge("unit_test", "coverage")
-    workflow.add_edge("coverage", "reflection")
+    workflow.add_edge("coverage", "targeted_symbolic")
+    workflow.add_edge("targeted_symbolic", "reflection")
 
     checkpointer = MemorySaver()
 
-    graph = workflow.compile(checkpointer=checkpointer)
+    if batch == "prepare":
+        graph = workflow.compile(
+            checkpointer=checkpointer, interrupt_after=["symbolic"])
+    else:
+        graph = workflow.compile(checkpointer=checkpointer)
 
     if draw:
         with open(draw, "wb") as fp:
             fp.write(graph.get_graph().draw_png())
             exit()
 
-
-    config = { "configurable": {"thread_id": "1", "model_name": model_name, "recursion_limit": 100} }
+    if not batch_dir:
+        batch_dir = os.path.join(project, "batch")
+    custom_id = get_custom_id(work, target_name)
+
+    config = {
+        "configurable": {
+            "thread_id": "1",
+            "model_name": model_name,
+            "routing": load_routing(routing),
+            "batch": batch,
+            "batch_dir": batch_dir,
+            "recursion_limit": 100
+        }
+    }
 
     state =  {
         "number_of_iterations": 1,
         "max_number_of_iterations": max_number_of_iterations,
+        "failed_compilations": 0,
         "depth": depth,
         "source_files": sources,
         "language": language,
@@ -205,12 +284,29 @@ def run(
         "work": work,
         "missing_coverage": "",
         "coverage_output": "",
+        "targeted_test_cases": "",
+        "targeted_lines": [],
         "review": [],
         "with_messages": with_messages,
         "ssh": ssh
 
     }
 
+    if batch == "resume":
+        state = load_state(batch_dir, custom_id)
+        results = load_results(batch_dir)
+        if results.get(custom_id, None):
+            state["test"] = remove_backticks(results[custom_id])
+            state["messages"].append(AIMessage(content=results[custom_id]))
+        elif state.get("symbolic_test_cases", ""):
+            print(f'... no batch result for {custom_id}, generating unit test instead')
+
+    if batch == "prepare":
+        graph.invoke(state, config)
+        filename = save_state(batch_dir, custom_id, graph.get_state(config).values)
+        print(f'... state of {target_name} saved to {filename}')
+        return
+
     try:
         final_state = graph.invoke(state, config)
     except GraphRecursionError:
@@ -250,7 +346,7 @@ def run(
     messages = final_state['messages']
     for i in range(0, len(messages), 2):
         with open(f'{work}/logs/test_{target_name}.p{i // 2}', 'w') as fp:
-            fp.write(messages[i].content)
+            fp.write(content_to_text(get_blob(messages[i].content)))
 
 
 def main(arg_list: list[str] | None=None):
@@ -272,6 +368,9 @@ def main(arg_list: list[str] | None=None):
         with_messages=args.with_messages,
         ssh=args.ssh,
         draw=args.draw,
+        routing=args.routing,
+        batch=args.batch,
+        batch_dir=args.batch_dir,
     )
 
 
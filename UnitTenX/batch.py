@@ -0,0 +1,172 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+from fire import Fire
+import json
+import os
+
+from utils.batch import collect
+from utils.model import GetModel
+
+# Offline batch mode for the symbolic test prompts:
+#
+#   UNITTENX_BATCH=prepare UNITTENX_BATCH_DIR=<dir> make -f <work>/Makefile all
+#   python batch.py collect <dir>
+#   python batch.py submit <dir>/batch_anthropic_0.jsonl    (or serve)
+#   python batch.py retrieve <dir>/batch_anthropic_0.jsonl
+#   UNITTENX_BATCH=resume UNITTENX_BATCH_DIR=<dir> make -f <work>/Makefile all
+
+
+def get_result_filename(batch_file):
+    batch_dir = os.path.dirname(os.path.abspath(batch_file))
+    os.makedirs(os.path.join(batch_dir, 'results'), exist_ok=True)
+    return os.path.join(batch_dir, 'results', os.path.basename(batch_file))
+
+
+def submit(batch_file):
+    '''
+        Submits batch file to the provider.
+
+        :param batch_file: batch_<format>_<n>.jsonl file created by collect.
+
+        :return: batch id.
+    '''
+
+    with open(batch_file, 'r') as fp:
+        requests = [json.loads(line) for line in fp if line.strip()]
+
+    if 'params' in requests[0]:
+        import anthropic
+        client = anthropic.Anthropic()
+        batch = client.messages.batches.create(requests=requests)
+    else:
+        import openai
+        client = openai.OpenAI()
+        with open(batch_file, 'rb') as fp:
+            input_file = client.files.create(file=fp, purpose='batch')
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h')
+
+    print(f'... submitted {len(requests)} requests from {batch_file} as {batch.id}')
+    with open(batch_file + '.id', 'w') as fp:
+        fp.write(batch.id)
+
+    return batch.id
+
+
+def retrieve(batch_file):
+    '''
+        Downloads results of a submitted batch if it is done.
+
+        :param batch_file: batch file passed to submit.
+
+        :return: result file name or '' if batch is still running.
+    '''
+
+    with open(batch_file + '.id', 'r') as fp:
+        batch_id = fp.read().strip()
+
+    result_file = get_result_filename(batch_file)
+
+    if batch_id.startswith('msgbatch'):
+        import anthropic
+        client = anthropic.Anthropic()
+        batch = client.messages.batches.retrieve(batch_id)
+        if batch.processing_status != 'ended':
+            print(f'... {batch_id} is {batch.processing_status}')
+            return ''
+        with open(result_file, 'w') as fp:
+            for entry in client.messages.batches.results(batch_id):
+                fp.write(entry.model_dump_json() + '\n')
+    else:
+        import openai
+        client = openai.OpenAI()
+        batch = client.batches.retrieve(batch_id)
+        if batch.status != 'completed':
+            print(f'... {batch_id} is {batch.status}')
+            return ''
+        with open(result_file, 'w') as fp:
+            fp.write(client.files.content(batch.output_file_id).text)
+
+    print(f'... results of {batch_id} written to {result_file}')
+    return result_file
+
+
+def serve(batch_file, model_name=''):
+    '''
+        Local stand-in for the provider batch API. Executes all requests
+        of batch file through the regular model interface and writes the
+        results in the provider format.
+
+        :param batch_file: batch file created by collect.
+        :param model_name: model to use instead of the one in the requests
+            (for example, ollama:mistral-nemo).
+
+        :return: result file name.
+    '''
+
+    result_file = get_result_filename(batch_file)
+
+    with open(batch_file, 'r') as fp, open(result_file, 'w') as fo:
+        for line in fp:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            is_anthropic = 'params' in request
+            params = request['params'] if is_anthropic else request['body']
+            provider = 'anthropic' if is_anthropic else 'openai'
+            model = GetModel(
+                model_name or f'{provider}:{params["model"]}',
+                temperature=params.get('temperature', 0),
+                max_tokens=params['max_tokens'])
+
+            print(f'... serving {request["custom_id"]}')
+            try:
+                text = model.invoke(params['messages']).content
+                error = None
+            except (Exception, SystemExit) as e:
+                # GetModel.invoke exits (fatal_error) when all retries fail,
+                # but the other requests should still be served.
+                text = ''
+                error = str(e) or f'request failed on {model.model_name}'
+
+            if is_anthropic:
+                if error:
+                    result = {'type': 'errored', 'error': {'message': error}}
+                else:
+                    result = {
+                        'type': 'succeeded',
+                        'message': {
+                            'role': 'assistant',
+                            'content': [{'type': 'text', 'text': text}]
+                        }
+                    }
+                entry = {'custom_id': request['custom_id'], 'result': result}
+            else:
+                entry = {
+                    'custom_id': request['custom_id'],
+                    'response': None if error else {
+                        'status_code': 200,
+                        'body': {
+                            'choices': [{
+                                'index': 0,
+                                'message': {'role': 'assistant', 'content': text}
+                            }]
+                        }
+                    },
+                    'error': {'message': error} if error else None
+                }
+            fo.write(json.dumps(entry) + '\n')
+
+    print(f'... results written to {result_file}')
+    return result_file
+
+
+if __name__ == '__main__':
+    Fire({
+        'collect': collect,
+        'submit': submit,
+        'retrieve': retrieve,
+        'serve': serve
+    })
@@ -0,0 +1,103 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+from fire import Fire
+from fnmatch import fnmatch
+import json
+import os
+import subprocess
+import time
+
+from utils.timing import load_timings, summarize_timings
+
+# Runs the agent over all targets of a work directory created by
+# auto_mockup.py, and reports the wall time of each graph node.
+#
+# First record a session with the real model:
+#
+#   python benchmark.py <work> --session=<session-file> --record
+#
+# and then benchmark offline as many times as needed:
+#
+#   python benchmark.py <work> --session=<session-file>
+
+
+def get_targets(work):
+    '''
+        Reads targets from the Makefile created by auto_mockup.py.
+
+        :param work: work directory.
+
+        :return: list of targets.
+    '''
+
+    targets = []
+    with open(os.path.join(work, 'Makefile'), 'r') as fp:
+        for line in fp:
+            line = line.rstrip()
+            if line.endswith(':') and not line.startswith('\t') and line != 'all:':
+                targets.append(line[:-1])
+    return targets
+
+
+def main(work, session, targets='*', record=False, output=''):
+    '''
+        Benchmarks the agent over the targets of work.
+
+        :param work: work directory created by auto_mockup.py.
+        :param session: session file with the model responses.
+        :param targets: comma separated list of target patterns.
+        :param record: record session with the model in MODEL_NAME instead
+            of replaying it.
+        :param output: json file where the results are written.
+    '''
+
+    work = os.path.abspath(work)
+    session = os.path.abspath(session)
+    patterns = targets.split(',') if isinstance(targets, str) else list(targets)
+    targets = [
+        t for t in get_targets(work) if any(fnmatch(t, p) for p in patterns)]
+
+    timing_file = os.path.join(work, 'logs', 'timing.jsonl')
+    os.makedirs(os.path.dirname(timing_file), exist_ok=True)
+    if os.path.exists(timing_file):
+        os.remove(timing_file)
+
+    env = dict(os.environ, UNITTENX_TIMING=timing_file)
+    cmd = ['make', '-f', os.path.join(work, 'Makefile')]
+    if record:
+        if os.path.exists(session):
+            os.remove(session)
+        env['UNITTENX_RECORD'] = session
+    else:
+        cmd.append(f'MODEL_NAME=replay:{session}')
+
+    wall_times = {}
+    for target in targets:
+        print(f'... running {target}')
+        start_time = time.time()
+        result = subprocess.run(
+            cmd + [target], cwd=work, env=env, capture_output=True, text=True)
+        wall_times[target] = time.time() - start_time
+        if result.returncode:
+            print(f'    {target} failed')
+            print(result.stdout[-2000:])
+            print(result.stderr[-2000:])
+
+    summary = summarize_timings(load_timings(timing_file)) if os.path.exists(timing_file) else {}
+
+    print()
+    print(f'{"node":20s} {"calls":>6s} {"total":>10s} {"mean":>10s} {"max":>10s}')
+    for node, entry in summary.items():
+        print(
+            f'{node:20s} {entry["calls"]:6d} {entry["total"]:10.2f} '
+            f'{entry["mean"]:10.2f} {entry["max"]:10.2f}')
+    print()
+    print(f'{len(targets)} targets in {sum(wall_times.values()):.2f}s')
+
+    if output:
+        with open(output, 'w') as fp:
+            json.dump({'nodes': summary, 'targets': wall_times}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    Fire(main)
@@ -1,15 +1,19 @@
 # Copyright 2025 Claudionor N. Coelho Jr
 
 from argparse import ArgumentParser
+from copy import deepcopy
 import glob
 import hashlib
+import json
 import os
-from pycparser import parse_file, c_ast
+from pycparser import c_ast
 import pycparser_fake_libc
 import re
 import subprocess
 from utils.utils import fix_relative_paths
 from utils.utils import create_cpp_args
+from utils import ast_cache
+from utils.ast_cache import parse, preprocess
 import yaml
 try:
     from yaml import CLoader as Loader
@@ -120,6 +124,18 @@ def get_global_variables(ast):
     return global_vars
 
 
+def get_cpp_args(cflags=""):
+    '''
+        Preprocessor arguments used to scan a file.
+
+        :param cflags: Flags for compilation including -I and -D.
+
+        :return: list of arguments.
+    '''
+
+    return create_cpp_args(cflags) + ['-E'] + ['-I' + pycparser_fake_libc.directory]
+
+
 def get_functions(filename, cflags=""):
 
     '''
@@ -224,25 +240,24 @@ def get_functions(filename, cflags=""):
         def get_file_signature(self):
             return self.file_signature
 
-    cpp_args = create_cpp_args(cflags) + ['-E'] + ['-I' + pycparser_fake_libc.directory]
+    cpp_args = get_cpp_args(cflags)
 
     # run first cpp to check if there are any errors as we are in exploratory mode
     cmd = 'clang ' + ' ' + ' '.join(cpp_args) + ' ' + filename
     print(f'... processing {filename}')
-    data = subprocess.run(cmd, capture_output=True, shell=True, text=True)
+    try:
+        text, errors = preprocess(filename, cpp_args)
+    except subprocess.CalledProcessError as e:
+        text, errors = e.stdout, e.stderr or f'clang returned {e.returncode}'
 
-    if data.stderr:
+    if errors:
         print(cmd)
-        print(data.stderr)
+        print(errors)
         raise ValueError('Compilation error')
 
-    # Parse the C file
+    # Parse the C file (the AST is shared with other callers)
     try:
-        ast = parse_file(
-            filename,
-            use_cpp=True,
-            cpp_path='clang',
-            cpp_args=cpp_args)
+        ast = parse(filename, cpp_args)
     except Exception as e:
         print(e)
         print(cmd)
@@ -278,7 +293,7 @@ def get_functions(filename, cflags=""):
         possible_name = code[first_line-1].strip().split('(')
         pattern = r'//.*?$|/\*.*?\*/'
         possible_name[0] = re.sub(pattern, '', possible_name[0], flags=re.MULTILINE | re.DOTALL)
-        if len(possible_name) > 1 and data.stdout.find(possible_name[0]) < 0:
+        if len(possible_name) > 1 and text.find(possible_name[0]) < 0:
             # let's leave it as name is a macro
             continue
         open_brackets = ''.join(code[first_line:last_line]).count('{')
@@ -297,6 +312,44 @@ def get_functions(filename, cflags=""):
     return file_signature
 
 
+def get_cached_functions(filename, cflags=""):
+    '''
+        Same as get_functions, but the signature of a file is reused (in
+        memory and in $UNIT_TENX_CACHE/ast) until the file or one of its
+        headers changes.
+
+        :param filename: Source file.
+        :param cflags: Flags for compilation including -I and -D.
+
+        :return: module created (callers may change it).
+    '''
+
+    if not ast_cache.AST_CACHE:
+        return get_functions(filename, cflags)
+
+    cpp_args = get_cpp_args(cflags)
+    key = hashlib.sha256(json.dumps(
+        ['scan', ast_cache.get_cache_key(filename, 'clang', cpp_args)]).encode('utf-8')).hexdigest()
+
+    entry = ast_cache.load_entry(key)
+    if entry:
+        return deepcopy(entry['signature'])
+
+    file_signature = get_functions(filename, cflags)
+
+    # get_functions preprocessed the file, so this is a cache hit.
+    dependencies = ast_cache.get_entry(filename, 'clang', cpp_args)['dependencies']
+    ast_cache.save_entry(key, {
+        'text': '',
+        'errors': '',
+        'dependencies': dependencies,
+        'ast': None,
+        'signature': deepcopy(file_signature)
+    })
+
+    return file_signature
+
+
 def scan_project(project_list, cflags, use_cache, save_to_cache, stop_on_error):
     '''
         Test routine for get_symbolic_test.
@@ -339,7 +392,7 @@ def scan_project(project_list, cflags, use_cache, save_to_cache, stop_on_error):
 
     for filename in files:
         try:
-            functions_signature = get_functions(
+            functions_signature = get_cached_functions(
                 filename=filename,
                 cflags=cflags
             )
@@ -0,0 +1,44 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import os
+import sys
+
+sys.path.append("..")
+
+from pycparser import c_ast
+
+import utils.ast_cache
+from utils.ast_cache import *
+
+
+def get_functions(ast):
+    return [n.decl.name for n in ast.ext if isinstance(n, c_ast.FuncDef)]
+
+
+def test_parse(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNIT_TENX_CACHE", str(tmp_path / "cache"))
+
+    header = tmp_path / "fact.h"
+    header.write_text("typedef int value_t;\n")
+    filename = tmp_path / "fact.c"
+    filename.write_text(
+        '#include "fact.h"\n'
+        'value_t fact(value_t n) { return n <= 1 ? 1 : n * fact(n - 1); }\n')
+
+    cpp_args = ["-E", "-I" + str(tmp_path)]
+    ast = parse(str(filename), cpp_args, cpp_path="cpp")
+    assert get_functions(ast) == ["fact"]
+    assert parse(str(filename), cpp_args, cpp_path="cpp") is ast
+
+    text, errors = preprocess(str(filename), cpp_args, cpp_path="cpp")
+    assert "value_t fact" in text and not errors
+
+    # another process reads the AST from disk.
+    utils.ast_cache.entries.clear()
+    ast = parse(str(filename), cpp_args, cpp_path="cpp")
+    assert get_functions(ast) == ["fact"]
+
+    # changing an included file invalidates the entry.
+    header.write_text("typedef long value_t;\nint unused(void) { return 0; }\n")
+    ast = parse(str(filename), cpp_args, cpp_path="cpp")
+    assert get_functions(ast) == ["unused", "fact"]
@@ -0,0 +1,139 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import json
+import os
+import sys
+
+sys.path.append("..")
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.batch import *
+
+
+def test_get_custom_id():
+    assert get_custom_id("/work/test/test_i_file_fct", "fct") == "test_i_file_fct"
+    assert get_custom_id("/work/test/test_i_file.c++/", "fct") == "test_i_file_c__"
+
+    custom_id = get_custom_id("/work/" + "a" * 100, "fct")
+    assert len(custom_id) == 64
+    assert custom_id != get_custom_id("/work/" + "a" * 99 + "b", "fct")
+
+
+def test_make_request():
+    messages = [{"role": "user", "content": "hello"}]
+
+    request = make_request(
+        "id_1",
+        {"model_name": "anthropic", "temperature": 0, "max_tokens": 100},
+        messages)
+    assert request == {
+        "custom_id": "id_1",
+        "params": {
+            "model": "claude-3-5-sonnet-20241022",
+            "max_tokens": 100,
+            "temperature": 0,
+            "messages": messages
+        }
+    }
+
+    request = make_request(
+        "id_2",
+        {"model_name": "openai:gpt-4o-mini,anthropic", "temperature": 0, "max_tokens": None},
+        messages)
+    assert request["url"] == "/v1/chat/completions"
+    assert request["body"]["model"] == "gpt-4o-mini"
+    assert request["body"]["max_tokens"] == MAX_TOKENS
+
+
+def test_collect(tmp_path):
+    batch_dir = str(tmp_path)
+    messages = [{"role": "user", "content": "hello"}]
+    write_request(batch_dir, "id_1", {"model_name": "anthropic"}, messages)
+    write_request(batch_dir, "id_2", {"model_name": "anthropic"}, messages)
+    write_request(batch_dir, "id_3", {"model_name": "openai"}, messages)
+
+    batch_files = collect(batch_dir)
+
+    assert [os.path.basename(f) for f in batch_files] == [
+        "batch_anthropic_0.jsonl", "batch_openai_0.jsonl"]
+    with open(batch_files[0], "r") as fp:
+        assert [json.loads(line)["custom_id"] for line in fp] == ["id_1", "id_2"]
+
+
+def test_load_results(tmp_path):
+    batch_dir = str(tmp_path)
+    os.makedirs(os.path.join(batch_dir, "results"))
+    entries = [
+        {
+            "custom_id": "id_1",
+            "result": {
+                "type": "succeeded",
+                "message": {"content": [{"type": "text", "text": "test 1"}]}
+            }
+        },
+        {
+            "custom_id": "id_2",
+            "result": {"type": "errored", "error": {"message": "overloaded"}}
+        },
+        {
+            "custom_id": "id_3",
+            "response": {
+                "status_code": 200,
+                "body": {"choices": [{"message": {"content": "test 3"}}]}
+            },
+            "error": None
+        },
+    ]
+    with open(os.path.join(batch_dir, "results", "batch_0.jsonl"), "w") as fp:
+        for entry in entries:
+            fp.write(json.dumps(entry) + "\n")
+
+    assert load_results(batch_dir) == {
+        "id_1": "test 1", "id_2": None, "id_3": "test 3"}
+
+
+def test_save_state(tmp_path):
+    batch_dir = str(tmp_path)
+    state = {
+        "name": "fct",
+        "test": "",
+        "messages": [HumanMessage(content="prompt")]
+    }
+    save_state(batch_dir, "id_1", state)
+
+    new_state = load_state(batch_dir, "id_1")
+    assert new_state["name"] == "fct"
+    assert new_state["messages"][0].content == "prompt"
+    new_state["messages"].append(AIMessage(content="test"))
+    assert len(state["messages"]) == 1
+
+
+def test_serve(tmp_path, monkeypatch):
+    import batch
+
+    class FakeGetModel:
+        def __init__(self, model_name, **kwargs):
+            self.model_name = model_name
+
+        def invoke(self, messages):
+            if messages[0]["content"] == "fail":
+                # as fatal_error does when all retries fail.
+                exit()
+            return AIMessage(content="test " + messages[0]["content"])
+
+    monkeypatch.setattr(batch, "GetModel", FakeGetModel)
+
+    batch_dir = str(tmp_path)
+    for custom_id, model_name in [("id_1", "anthropic"), ("id_2", "openai")]:
+        for content in ["fail", "1"]:
+            write_request(
+                batch_dir, f"{custom_id}_{content}", {"model_name": model_name},
+                [{"role": "user", "content": content}])
+
+    for batch_file in collect(batch_dir):
+        batch.serve(batch_file)
+
+    assert load_results(batch_dir) == {
+        "id_1_fail": None, "id_1_1": "test 1",
+        "id_2_fail": None, "id_2_1": "test 1"}
@@ -0,0 +1,76 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import os
+import sys
+
+sys.path.append("..")
+
+from langchain_core.messages import AIMessage
+
+from utils.blobs import *
+
+
+def test_blob_store(tmp_path):
+    store = BlobStore(str(tmp_path), cache_size=1)
+
+    assert store.put("small") == "small"
+    assert store.put("") == ""
+
+    text_1 = "int f() { return 1; }\n" * 100
+    text_2 = "int g() { return 2; }\n" * 100
+    ref_1 = store.put(text_1)
+    ref_2 = store.put(text_2)
+    assert is_blob_ref(ref_1) and is_blob_ref(ref_2)
+    assert ref_1 == store.put(text_1)
+    assert store.put(ref_1) == ref_1
+
+    # text_1 was evicted from memory, so it comes from disk.
+    assert len(store.blobs) == 1
+    assert store.get(ref_1) == text_1
+    assert store.get(ref_2) == text_2
+    assert store.get("small") == "small"
+
+    # another process sees the same blobs.
+    assert BlobStore(str(tmp_path)).get(ref_2) == text_2
+
+
+def test_blob_store_default(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNIT_TENX_CACHE", str(tmp_path))
+    store = BlobStore(cache_size=4)
+    assert store.blob_dir == str(tmp_path / "blobs")
+
+    # memory stays bounded without UNITTENX_BLOB_DIR.
+    texts = [f"int f{i}() {{ return {i}; }}\n" * 100 for i in range(10)]
+    refs = [store.put(text) for text in texts]
+    assert len(store.blobs) == 4
+    assert [store.get(ref) for ref in refs] == texts
+    assert len(store.blobs) == 4
+
+    try:
+        store.get(BLOB_PREFIX + "0" * 64)
+        assert False
+    except KeyError as err:
+        assert "not found" in str(err)
+
+
+def test_resolve_state(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNIT_TENX_CACHE", str(tmp_path))
+    get_blob_store.cache_clear()
+    text = "x" * 1000
+    messages = put_messages([
+        {"role": "user", "content": text},
+        AIMessage(content=text, id="1"),
+    ])
+    assert messages[0] == {"role": "user", "content": put_blob(text)}
+    assert messages[1].content == put_blob(text)
+    assert messages[1].id == "1"
+
+    state = resolve_state({
+        "test": put_blob(text),
+        "source_code": "small",
+        "messages": messages,
+    })
+    assert state["test"] == text
+    assert state["source_code"] == "small"
+    assert state["messages"][0]["content"] == text
+    assert state["messages"][1].content == text
@@ -39,3 +39,31 @@ def test_cpp_flatten_with_error():
     except ValueError:
         pass
 
+
+def test_cpp_flatten_cache(tmp_path, monkeypatch):
+    import utils.ast_cache
+    monkeypatch.setenv("UNIT_TENX_CACHE", str(tmp_path / "cache"))
+
+    include = tmp_path / "include"
+    include.mkdir()
+    header = include / "value.h"
+    header.write_text("typedef int value_t;\n")
+    filename = tmp_path / "value.c"
+    filename.write_text('#include "value.h"\nvalue_t get(void) { return 1; }\n')
+
+    args = dict(cflags=f"-I{include} -DX", includes=[str(include)], cpp_path="cpp")
+    source = cpp_flatten(str(filename), **args)
+    assert "typedef int value_t;" in source and "value_t get" in source
+
+    # another process reads the flattened file from disk.
+    utils.ast_cache.entries.clear()
+    with monkeypatch.context() as m:
+        m.setattr(utils.cpp_flatten, "subprocess", None)
+        assert cpp_flatten(str(filename), **args) == source
+
+    # changing a header invalidates the entry.
+    header.write_text("typedef long value_t;\n")
+    assert "typedef long value_t;" in cpp_flatten(str(filename), **args)
+
+    # includes are part of the key.
+    assert "typedef" not in cpp_flatten(str(filename), cflags=f"-I{include} -DX", cpp_path="cpp")
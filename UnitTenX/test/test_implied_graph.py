@@ -145,3 +145,82 @@ def test_main_python_error():
 
     assert len(files) == 0
 
+
+
+def test_get_mockup_db(tmp_path, monkeypatch):
+    import scan_c_project
+    import utils.ast_cache
+    import utils.implied_graph
+    from utils.implied_graph import get_mockup_db
+
+    monkeypatch.setenv("UNIT_TENX_CACHE", str(tmp_path / "cache"))
+
+    filename = str(tmp_path / "run.c")
+    with open(filename, "w") as fp:
+        fp.write(
+            "int counter;\n"
+            "int inc(int a)\n"
+            "{\n"
+            "  return a + 1;\n"
+            "}\n"
+            "int run(int a)\n"
+            "{\n"
+            "  counter = inc(a);\n"
+            "  return counter;\n"
+            "}\n")
+
+    db = get_mockup_db(filename, "-DRUN")
+    assert db["functions"] == {"inc": [filename], "run": [filename]}
+    assert db["files"][filename]["run"]["functions"] == ["inc"]
+    assert db["files"][filename]["run"]["globals"] == ["counter"]
+
+    # a mockup that changed is scanned again.
+    with open(filename, "a") as fp:
+        fp.write(
+            "int dec(int a)\n"
+            "{\n"
+            "  return a - 1;\n"
+            "}\n")
+    db = get_mockup_db(filename, "-DRUN")
+    assert db["functions"] == {"inc": [filename], "run": [filename], "dec": [filename]}
+
+    # a mockup that did not change is not scanned again, even by
+    # another process.
+    utils.implied_graph.mockup_dbs.clear()
+    utils.ast_cache.entries.clear()
+    get_functions = scan_c_project.get_functions
+    monkeypatch.setattr(scan_c_project, "get_functions", None)
+    assert get_mockup_db(filename, "-DRUN") == db
+
+    # failed scans are not cached.
+    utils.implied_graph.mockup_dbs.clear()
+    monkeypatch.setattr(utils.ast_cache, "AST_CACHE", 0)
+    assert get_mockup_db(filename, "-DRUN") is None
+    monkeypatch.setattr(scan_c_project, "get_functions", get_functions)
+    assert get_mockup_db(filename, "-DRUN") == db
+
+
+def test_traverser():
+    from utils.implied_graph import Traverser
+
+    # main -> a -> b -> c, and main -> b.
+    yaml_config = {
+        "files": {
+            "f.c": {
+                "__globals": [],
+                "main": {"functions": ["a", "b", "printf"]},
+                "a": {"functions": ["b"]},
+                "b": {"functions": ["c"]},
+                "c": {"functions": []},
+            }
+        },
+        "functions": {name: ["f.c"] for name in ["main", "a", "b", "c"]}
+    }
+
+    traverser = Traverser(target_file="f.c", yaml_config=yaml_config)
+    assert traverser.traverse("main", 0) == {"main"}
+    assert traverser.traverse("main", 1) == {"main", "a", "b"}
+    # c is reached through the shortest path main -> b -> c.
+    assert traverser.traverse("main", 2) == {"main", "a", "b", "c"}
+    assert traverser.traverse("a", 1) == {"a", "b"}
+    assert traverser.traverse("c", 2) == {"c"}
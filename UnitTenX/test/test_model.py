@@ -0,0 +1,240 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import sys
+import time
+
+sys.path.append("..")
+
+from utils.model import *
+
+
+class FakeChunk:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+class FakeRateLimiter:
+    def __init__(self):
+        self.acquired = []
+        self.usage = []
+
+    def acquire(self, tokens=0):
+        self.acquired.append(tokens)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        self.usage.append((estimated_tokens, actual_tokens))
+
+    def on_rate_limit(self, retry_after=None):
+        return 0.0
+
+
+class FakeModel:
+    def __init__(self, content, latency=0.0, error=None, usage=None):
+        self.content = content
+        self.latency = latency
+        self.error = error
+        self.usage = usage
+        self.calls = 0
+        self.chunks_sent = 0
+
+    def stream(self, messages):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        for c in self.content:
+            time.sleep(self.latency)
+            self.chunks_sent += 1
+            yield FakeChunk(c)
+        if self.usage:
+            yield FakeChunk("", usage_metadata={"total_tokens": self.usage})
+
+    def invoke(self, messages):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.error:
+            raise self.error
+        if self.usage:
+            return AIMessage(
+                content=self.content,
+                usage_metadata={
+                    "input_tokens": 0, "output_tokens": self.usage,
+                    "total_tokens": self.usage})
+        return self.content
+
+
+class FakeGetModel(GetModel):
+    def __init__(self, models, **kwargs):
+        super().__init__(','.join(models.keys()), **kwargs)
+        self.models = models
+
+    def get_backend_model(self, backend):
+        return self.models[backend]
+
+
+def test_backend_stats():
+    stats = BackendStats("test")
+    assert stats.p95() is None
+    for i in range(100):
+        stats.record_success(i / 100)
+    assert stats.p95() == 0.95
+    for i in range(CIRCUIT_BREAKER_FAILURES):
+        assert stats.is_available()
+        stats.record_failure()
+    assert not stats.is_available()
+
+
+def test_failover():
+    models = {
+        "ollama:failover-primary": FakeModel("", error=ValueError("down")),
+        "ollama:failover-secondary": FakeModel("secondary"),
+    }
+    model = FakeGetModel(models, timeout=10)
+    assert model.invoke([]) == "secondary"
+    assert models["ollama:failover-primary"].calls == 1
+
+
+def test_hedging():
+    models = {
+        "ollama:hedge-primary": FakeModel("primary", latency=1.8),
+        "ollama:hedge-secondary": FakeModel("secondary"),
+    }
+    model = FakeGetModel(models, timeout=2)
+    start_time = time.time()
+    # hedge after timeout / 2 as we do not have latency samples.
+    assert model.invoke([]) == "secondary"
+    assert time.time() - start_time < 1.5
+
+
+
+def test_hedging_records_winner(monkeypatch):
+    import utils.model
+
+    records = []
+    monkeypatch.setattr(utils.model, "RECORD", "session.jsonl")
+    monkeypatch.setattr(
+        utils.model, "record_response",
+        lambda session, backend, messages, response: records.append((backend, response)))
+    models = {
+        "ollama:hedge-record-primary": FakeModel("primary", latency=0.6, usage=1),
+        "ollama:hedge-record-secondary": FakeModel("secondary", usage=1),
+    }
+    model = FakeGetModel(models, timeout=1)
+    assert model.invoke([]).content == "secondary"
+
+    # the primary finishes later, but its response is discarded.
+    time.sleep(0.5)
+    assert models["ollama:hedge-record-primary"].calls == 1
+    assert records == [("ollama:hedge-record-secondary", "secondary")]
+    assert len(get_backend_stats("ollama:hedge-record-primary").latencies) == 0
+    assert len(get_backend_stats("ollama:hedge-record-secondary").latencies) == 1
+
+
+def test_circuit_breaker():
+    models = {
+        "ollama:breaker-primary": FakeModel("", error=ValueError("down")),
+        "ollama:breaker-secondary": FakeModel("secondary"),
+    }
+    model = FakeGetModel(models, timeout=10)
+    for i in range(CIRCUIT_BREAKER_FAILURES + 2):
+        assert model.invoke([]) == "secondary"
+    assert models["ollama:breaker-primary"].calls == CIRCUIT_BREAKER_FAILURES
+
+
+def test_stream_early_stop():
+    models = {
+        "ollama:stream-primary": FakeModel(
+            "<test-code>a</test-code><explanation>long explanation", latency=0.01),
+    }
+    model = FakeGetModel(models, timeout=10)
+    response = model.stream([], should_stop=lambda text: text.endswith("</test-code>"))
+    assert response.content == "<test-code>a</test-code>"
+    assert models["ollama:stream-primary"].chunks_sent < len(models["ollama:stream-primary"].content)
+
+
+def test_stream_fallback():
+    models = {
+        "ollama:stream-fail-primary": FakeModel("", error=ValueError("down")),
+        "ollama:stream-fail-secondary": FakeModel("secondary"),
+    }
+    model = FakeGetModel(models, timeout=10)
+    # streaming failed on primary, so we invoke with failover.
+    assert model.stream([]) == "secondary"
+
+
+def test_invoke_records_usage(monkeypatch):
+    import utils.model
+
+    rate_limiter = FakeRateLimiter()
+    monkeypatch.setattr(utils.model, "get_rate_limiter", lambda backend: rate_limiter)
+    models = {"ollama:usage-invoke": FakeModel("invoke", usage=42)}
+    model = FakeGetModel(models, timeout=10)
+    assert model.invoke([]).content == "invoke"
+    assert rate_limiter.usage == [(rate_limiter.acquired[0], 42)]
+
+
+def test_stream_records_usage(monkeypatch):
+    import utils.model
+
+    rate_limiter = FakeRateLimiter()
+    monkeypatch.setattr(utils.model, "get_rate_limiter", lambda backend: rate_limiter)
+
+    # the provider reports usage in the last chunk.
+    models = {"ollama:usage-stream": FakeModel("stream", usage=42)}
+    model = FakeGetModel(models, timeout=10)
+    assert model.stream([]).content == "stream"
+    assert rate_limiter.usage == [(rate_limiter.acquired[0], 42)]
+
+    # the stream stopped early, so usage is estimated from the text.
+    rate_limiter.usage.clear()
+    models = {"ollama:usage-stream-stop": FakeModel("x" * 400 + "</test-code>" + "y" * 400, usage=42)}
+    model = FakeGetModel(models, timeout=10)
+    response = model.stream([], should_stop=lambda text: text.endswith("</test-code>"))
+    assert rate_limiter.usage == [(rate_limiter.acquired[1], num_tokens_from_chars(response.content))]
+
+
+def test_failover_records_usage(monkeypatch):
+    import requests
+    import utils.model
+
+    # each backend is charged on its own rate limiter.
+    rate_limiters = {}
+    monkeypatch.setattr(
+        utils.model, "get_rate_limiter",
+        lambda backend: rate_limiters.setdefault(backend, FakeRateLimiter()))
+    models = {
+        "ollama:usage-failover-primary": FakeModel("", error=ValueError("down")),
+        "ollama:usage-failover-secondary": FakeModel("secondary", usage=42),
+    }
+    model = FakeGetModel(models, timeout=10)
+    assert model.invoke([]).content == "secondary"
+    assert len(rate_limiters["ollama:usage-failover-primary"].acquired) == 1
+    assert rate_limiters["ollama:usage-failover-primary"].usage == []
+    secondary = rate_limiters["ollama:usage-failover-secondary"]
+    assert secondary.usage == [(secondary.acquired[0], 42)]
+
+    # the secondary is rate limited, so the retry waits on its rate limiter
+    # instead of backing off.
+    class FakeRateLimitedModel(FakeModel):
+        def invoke(self, messages):
+            if not self.calls:
+                self.calls += 1
+                raise requests.exceptions.HTTPError(response=response)
+            return super().invoke(messages)
+
+    response = requests.Response()
+    response.status_code = 429
+    rate_limiters.clear()
+    monkeypatch.setattr(
+        utils.model, "get_rate_limiter",
+        lambda backend: rate_limiters.setdefault(backend, FakeRateLimiter())
+        if backend.endswith("secondary") else None)
+    models = {
+        "ollama:usage-retry-primary": FakeModel("", error=ValueError("down")),
+        "ollama:usage-retry-secondary": FakeRateLimitedModel("secondary"),
+    }
+    model = FakeGetModel(models, timeout=10)
+    start_time = time.time()
+    assert model.invoke([]) == "secondary"
+    assert time.time() - start_time < 1.5
+    assert len(rate_limiters["ollama:usage-retry-secondary"].acquired) == 2
@@ -37,6 +37,7 @@ master_storage = StateStorage()
 
 def count_number_of_tests(test: str, language="c++") -> int:
 
+    test = get_blob(test)
     if language == "c++":
         return test.count('test_') // 2
     else:
@@ -93,6 +94,25 @@ def test_get_model():
     assert _get_model("mistral-nemo")
 
 
+def test_streaming_test_code(tmp_path):
+    filename = str(tmp_path / "test_run.cc")
+    stream = StreamingTestCode(filename, max_explanation=0)
+
+    text = "<plan-of-action>\n- test\n</plan-of-action>\nWait\n<test-code>\nint main() {"
+    assert not stream(text)
+    text += " return 0; }\n</test-"
+    assert not stream(text)
+    text += "code>\n<explanation>"
+    assert stream(text)
+
+    assert open(filename).read() == "\nint main() { return 0; }\n"
+    assert "int main() { return 0; }" in get_unit_test(text)["test program"]
+
+    stream = StreamingTestCode(filename, max_explanation=20)
+    assert not stream("<test-code>\nint a;\n</test-code>\n<explanation>")
+    assert stream("<test-code>\nint a;\n</test-code>\n<explanation>\nthis test is long")
+
+
 def test_should_continue():
     state = AgentState()
 
@@ -0,0 +1,81 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import sys
+
+sys.path.append("..")
+
+from utils.prompt_assembler import *
+
+SOURCE = '''# 1 "byte.h"
+typedef struct foo {
+  int a; char b;
+} foo_t;
+extern unsigned int byte_chr(char *, unsigned int, int);
+# 3 "byte_chr.c"
+unsigned int byte_chr(s,n,c)
+char *s;
+register unsigned int n;
+int c;
+{
+  register char ch = '{';
+  if (n) helper(s);
+  return n;
+}
+void helper(char *s) { char *t = "}"; other(); }
+int other(void) { return 0; }
+int unused(void) { return 1; }
+'''
+
+
+def test_split_chunks():
+    chunks = split_chunks(SOURCE)
+
+    assert ''.join(c['text'] for c in chunks) == SOURCE.rstrip()
+    assert [(c['kind'], c['name']) for c in chunks] == [
+        ('type', ''),
+        ('declaration', ''),
+        ('function', 'byte_chr'),
+        ('function', 'helper'),
+        ('function', 'other'),
+        ('function', 'unused'),
+    ]
+
+
+def test_get_call_distances():
+    distances = get_call_distances(split_chunks(SOURCE), 'byte_chr')
+
+    assert distances == {'byte_chr': 0, 'helper': 1, 'other': 2}
+
+
+def test_assemble_source():
+    assert assemble_source(SOURCE, 'byte_chr', {}, 10000) == SOURCE
+
+    source = assemble_source(SOURCE, 'byte_chr', {}, 55)
+    assert 'unsigned int byte_chr(s,n,c)' in source
+    assert 'void helper' in source
+    assert 'int other' not in source
+    assert 'including functions other, unused' in source
+
+    # the type definition does not fit, so we stop there, even if the
+    # smaller unused function would fit.
+    source = assemble_source(SOURCE, 'byte_chr', {}, 70)
+    assert 'int other' in source
+    assert 'typedef struct foo' not in source
+    assert 'int unused' not in source
+
+    # the target is always there.
+    source = assemble_source(SOURCE, 'byte_chr', {}, 1)
+    assert 'unsigned int byte_chr(s,n,c)' in source
+    assert 'void helper' not in source
+
+
+def test_get_token_budget():
+    assert get_token_budget('anthropic') == SOURCE_TOKEN_BUDGET['anthropic']
+    assert get_token_budget('anthropic,ollama:llama3') == MODEL_TOKEN_BUDGET['llama3']
+    # budgets are per model, and fall back to the provider.
+    assert get_token_budget('openai') == MODEL_TOKEN_BUDGET['gpt-4o']
+    assert get_token_budget('openai:gpt-4') == MODEL_TOKEN_BUDGET['gpt-4']
+    assert get_token_budget('llama3') == MODEL_TOKEN_BUDGET['llama3']
+    assert get_token_budget('openai:o9') == SOURCE_TOKEN_BUDGET['openai']
+    assert get_token_budget('ollama:mistral') == SOURCE_TOKEN_BUDGET['ollama']
+    assert get_token_budget('mistral') == SOURCE_TOKEN_BUDGET['ollama']
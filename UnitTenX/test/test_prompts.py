@@ -48,3 +48,38 @@ def test_reflection_prompt():
         unit_test="no unit tests",
         reviews="no reviews"
     )
+
+
+def test_anthropic_prompts_stable_prefix():
+    from utils import prompts_anthropic
+
+    prompt_args = dict(
+        target_type="function",
+        name="main",
+        language="C++",
+        test_language="C++",
+        test_interface="plain",
+        source_code="no source code",
+        missing_coverage="no missing coverage",
+        coverage_output="",
+        additional_requirements="no additional requirements",
+        with_messages="not with messages",
+        unit_test="no current unit test",
+        function_names="- main\n- function1\n",
+        review="no reviews",
+        reviews="no reviews",
+        test_cases="",
+        targeted_test_cases="no targeted test cases"
+    )
+
+    # source code must be in the cached prefix, and what changes every
+    # iteration must be at the end.
+    assert "no source code" in prompts_anthropic.unit_test_source_prompt.format(**prompt_args)
+    assert "no missing coverage" in prompts_anthropic.unit_test_iteration_prompt.format(**prompt_args)
+    assert "no current unit test" in prompts_anthropic.unit_test_iteration_prompt.format(**prompt_args)
+    assert "no targeted test cases" in prompts_anthropic.unit_test_iteration_prompt.format(**prompt_args)
+    prompts_anthropic.unit_test_prompt.format(**prompt_args)
+
+    assert "no source code" in prompts_anthropic.reflection_source_prompt.format(**prompt_args)
+    assert "no current unit test" in prompts_anthropic.reflection_iteration_prompt.format(**prompt_args)
+    prompts_anthropic.reflection_prompt.format(**prompt_args)
@@ -0,0 +1,92 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import sys
+
+sys.path.append("..")
+
+from utils.rate_limiter import *
+
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class FakeError(Exception):
+    def __init__(self, headers):
+        self.response = FakeResponse(headers)
+
+
+def test_get_provider():
+    assert get_provider("anthropic") == "anthropic"
+    assert get_provider("openai") == "openai"
+    assert get_provider("ollama:mistral-nemo") == "ollama"
+    assert get_provider("mistral-nemo") == "ollama"
+
+
+def test_get_retry_after():
+    assert get_retry_after(FakeError({"retry-after": "7"})) == 7.0
+    assert get_retry_after(FakeError({})) is None
+    assert get_retry_after(Exception()) is None
+
+
+def test_acquire_is_shared(tmp_path):
+    db_path = str(tmp_path / "rate_limiter.db")
+    limiter_1 = SharedRateLimiter(
+        "anthropic", requests_per_minute=2, tokens_per_minute=1000, db_path=db_path)
+    limiter_2 = SharedRateLimiter(
+        "anthropic", requests_per_minute=2, tokens_per_minute=1000, db_path=db_path)
+
+    assert limiter_1.try_acquire(100) == 0
+    assert limiter_2.try_acquire(100) == 0
+    # both processes consumed the same bucket.
+    assert limiter_1.try_acquire(100) > 0
+
+
+def test_token_budget(tmp_path):
+    db_path = str(tmp_path / "rate_limiter.db")
+    limiter = SharedRateLimiter(
+        "openai", requests_per_minute=100, tokens_per_minute=1000, db_path=db_path)
+
+    assert limiter.try_acquire(900) == 0
+    assert limiter.try_acquire(900) > 0
+
+    # model used less tokens than we estimated.
+    limiter.record_usage(900, 100)
+    assert limiter.try_acquire(900) == 0
+
+
+def test_on_rate_limit(tmp_path):
+    db_path = str(tmp_path / "rate_limiter.db")
+    limiter = SharedRateLimiter(
+        "anthropic", requests_per_minute=100, tokens_per_minute=1000, db_path=db_path)
+
+    wait_time = limiter.on_rate_limit(retry_after=5)
+    assert 4 < wait_time <= 5
+    assert limiter.get_rate() == RATE_DECREASE
+    assert limiter.try_acquire(0) > 4
+
+    limiter.record_usage(0, 0)
+    assert limiter.get_rate() == RATE_DECREASE + RATE_INCREASE
+
+
+def test_locked_database(tmp_path):
+    import sqlite3
+
+    db_path = str(tmp_path / "rate_limiter.db")
+    limiter = SharedRateLimiter("anthropic", db_path=db_path)
+    limiter._connect = lambda: sqlite3.connect(db_path, timeout=0.1, isolation_level=None)
+
+    other = sqlite3.connect(db_path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        # the original error is raised, not the one of ROLLBACK.
+        limiter.try_acquire(100)
+        assert False
+    except sqlite3.OperationalError as e:
+        assert "locked" in str(e)
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+
+    assert limiter.try_acquire(100) == 0
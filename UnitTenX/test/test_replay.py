@@ -0,0 +1,50 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import sys
+
+sys.path.append("..")
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from utils.model import GetModel
+from utils.replay import *
+
+
+def test_get_messages_key():
+    key = get_messages_key([{"role": "user", "content": "hello world"}])
+
+    assert key == get_messages_key([HumanMessage(content="hello world")])
+    assert key == get_messages_key([{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "hello ", "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": "world"}
+        ]
+    }])
+    assert key != get_messages_key([{"role": "user", "content": "hello"}])
+
+
+def test_replay(tmp_path):
+    session = str(tmp_path / "session.jsonl")
+    messages = [{"role": "user", "content": "prompt"}]
+    record_response(session, "anthropic", messages, "first")
+    record_response(session, "anthropic", messages, "second")
+
+    model = ReplayModel(session)
+    assert model.invoke(messages).content == "first"
+    assert model.invoke(messages).content == "second"
+    assert model.invoke(messages).content == "second"
+
+    with pytest.raises(KeyError):
+        model.invoke([{"role": "user", "content": "other prompt"}])
+
+
+def test_replay_get_model(tmp_path):
+    session = str(tmp_path / "session.jsonl")
+    messages = [{"role": "user", "content": "prompt"}]
+    response = "<test-code>" + "x" * 1000 + "</test-code>"
+    record_response(session, "openai", messages, response)
+
+    model = GetModel(f"replay:{session}")
+    assert model.stream(messages).content == response
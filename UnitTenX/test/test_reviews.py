@@ -0,0 +1,50 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import sys
+
+sys.path.append("..")
+
+import yaml
+
+from utils.reviews import *
+
+
+def make_review(items, rating=5):
+    return {"review": items, "summary": "summary", "rating": rating}
+
+
+def test_get_lines():
+    missing_coverage = yaml.safe_dump([
+        "mockup.c:fct: could not reach lines: 10,12",
+        "mockup.c:other: could not reach lines: 20",
+    ])
+    assert get_missing_lines(missing_coverage) == {10, 12, 20}
+    assert get_item_lines("Cover lines 12, 14 and 20-22.") == {12, 14, 20, 21, 22}
+    assert get_item_lines("Add assertions for the return value.") == set()
+
+
+def test_compact_reviews():
+    assert compact_reviews([]) == ''
+
+    reviews = [
+        make_review(["Cover line 7.", "Check NULL pointers.", "Test empty strings."]),
+        make_review(["Cover line 12.", "check null pointers", "Test empty strings."]),
+        make_review(["Use a smaller buffer."]),
+        make_review(["Test empty strings."]),
+    ]
+    missing_coverage = "- 'mockup.c:fct: could not reach lines: 12'\n"
+
+    compacted = yaml.safe_load(compact_reviews(reviews, missing_coverage, max_reviews=2))
+
+    assert compacted[0]["review"] == ["Test empty strings."]
+    assert compacted[1]["review"] == ["Use a smaller buffer."]
+    # line 7 is covered, and repeated items appear once.
+    assert compacted[2] == {
+        "open items from earlier reviews": ["Cover line 12.", "check null pointers"]
+    }
+
+    # prompt size does not grow with the number of reviews.
+    many_reviews = reviews + [make_review(["Cover line 12."])] * 50
+    assert len(compact_reviews(many_reviews, missing_coverage)) < 1000
+    assert compact_reviews(many_reviews, missing_coverage) == compact_reviews(
+        many_reviews, missing_coverage)
@@ -0,0 +1,72 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import sys
+
+sys.path.append("..")
+
+from utils.routing import load_routing, get_route
+
+
+ROUTING = {
+    "nodes": {
+        "reflection": {
+            "model_name": "openai:gpt-4o-mini",
+            "max_tokens": 1024
+        },
+        "unit_test": {
+            "model_name": "anthropic",
+        }
+    },
+    "escalation": {
+        "unit_test": [
+            "anthropic:claude-3-7-sonnet-20250219",
+            { "model_name": "openai:o3-mini", "max_tokens": 16384 }
+        ]
+    }
+}
+
+
+def test_get_route_default():
+    route = get_route({}, "unit_test", "openai")
+    assert route == { "model_name": "openai", "temperature": 0, "max_tokens": None }
+
+    route = get_route(ROUTING, "symbolic", "openai")
+    assert route["model_name"] == "openai"
+
+
+def test_get_route_node():
+    route = get_route(ROUTING, "reflection", "openai")
+    assert route["model_name"] == "openai:gpt-4o-mini"
+    assert route["max_tokens"] == 1024
+
+    # reflection does not escalate.
+    route = get_route(ROUTING, "reflection", "openai", failed_compilations=3)
+    assert route["model_name"] == "openai:gpt-4o-mini"
+
+
+def test_get_route_escalation():
+    route = get_route(ROUTING, "unit_test", "openai")
+    assert route["model_name"] == "anthropic"
+
+    route = get_route(ROUTING, "unit_test", "openai", failed_compilations=1)
+    assert route["model_name"] == "anthropic:claude-3-7-sonnet-20250219"
+    assert route["max_tokens"] is None
+
+    route = get_route(ROUTING, "unit_test", "openai", failed_compilations=5)
+    assert route["model_name"] == "openai:o3-mini"
+    assert route["max_tokens"] == 16384
+
+
+def test_load_routing(tmp_path):
+    filename = tmp_path / "routing.yaml"
+    filename.write_text("nodes:\n  reflection:\n    model_name: openai:gpt-4o-mini\n")
+    assert load_routing(str(filename))["nodes"]["reflection"]["model_name"] == "openai:gpt-4o-mini"
+    assert load_routing("") == {}
+
+    filename = tmp_path / "bad_routing.yaml"
+    filename.write_text("node:\n  reflection: openai\n")
+    try:
+        load_routing(str(filename))
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,113 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import sys
+import time
+
+sys.path.append("..")
+
+from utils.sandbox import *
+
+
+def test_parse_size():
+    assert parse_size("0") == 0
+    assert parse_size("") == 0
+    assert parse_size("1024") == 1024
+    assert parse_size("512M") == 512 << 20
+    assert parse_size("4g") == 4 << 30
+    assert parse_size("1.5GB") == 3 << 29
+
+
+def test_run_sandboxed():
+    data = run_sandboxed(
+        f'{sys.executable} -c "x = bytearray(64 << 20); print(len(x))"', text=True)
+    assert data.returncode == 0
+    assert data.stdout.strip() == str(64 << 20)
+    assert data.peak_rss >= 64 << 20
+    assert not data.timed_out
+
+    data = run_sandboxed("cat", input="hello", text=True)
+    assert data.stdout == "hello"
+
+
+def test_run_sandboxed_limits():
+    data = run_sandboxed(
+        f'{sys.executable} -c "x = bytearray(512 << 20)"', text=True,
+        memory=256 << 20)
+    assert data.returncode != 0
+    assert "MemoryError" in data.stderr
+
+    # background processes are killed with the command.
+    start_time = time.time()
+    data = run_sandboxed("sleep 10 & sleep 10", text=True, timeout=0.5)
+    assert data.timed_out
+    assert "error:" in data.stderr
+    assert time.time() - start_time < 5
+
+
+def test_memory_scheduler(tmp_path):
+    db_path = str(tmp_path / "sandbox.db")
+    scheduler_1 = MemoryScheduler(1000, db_path=db_path, default_estimate=400)
+    scheduler_2 = MemoryScheduler(1000, db_path=db_path, default_estimate=400)
+
+    rid_1 = scheduler_1.try_acquire("esbmc")
+    rid_2 = scheduler_2.try_acquire("esbmc")
+    assert rid_1 is not None and rid_2 is not None
+    assert scheduler_2.try_acquire("esbmc") is None
+    # the memory limit bounds the estimate.
+    rid_3 = scheduler_2.try_acquire("esbmc", limit=200)
+    assert rid_3 is not None
+
+    # estimates learn the peak memory, and decay slowly.
+    scheduler_1.release(rid_1, "esbmc", peak_rss=900)
+    scheduler_1.release(rid_2, "esbmc", peak_rss=100)
+    assert scheduler_2.get_estimate("esbmc") == 810
+    assert scheduler_2.try_acquire("esbmc") is None
+    scheduler_2.release(rid_3, "esbmc")
+
+    # a tool larger than the budget runs alone.
+    scheduler_1.release(scheduler_1.try_acquire("make run"), "make run", peak_rss=2000)
+    rid = scheduler_1.try_acquire("make run")
+    assert rid is not None
+    assert scheduler_2.try_acquire("esbmc") is None
+
+
+def test_memory_scheduler_locked_database(tmp_path):
+    import sqlite3
+
+    db_path = str(tmp_path / "sandbox.db")
+    scheduler = MemoryScheduler(1000, db_path=db_path, default_estimate=400)
+    scheduler._connect = lambda: sqlite3.connect(db_path, timeout=0.1, isolation_level=None)
+
+    other = sqlite3.connect(db_path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        # the original error is raised, not the one of ROLLBACK.
+        scheduler.try_acquire("esbmc")
+        assert False
+    except sqlite3.OperationalError as e:
+        assert "locked" in str(e)
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+
+    assert scheduler.try_acquire("esbmc") is not None
+
+
+def test_get_sandbox_command(monkeypatch):
+    assert get_sandbox_command("make run") == "make run"
+
+    monkeypatch.setattr("utils.sandbox.PRLIMIT", "prlimit")
+    assert get_sandbox_command("make run", memory=1 << 20, nproc=10) == (
+        "exec prlimit --as=1048576 --nproc=10 -- /bin/sh -c 'make run'")
+    assert get_sandbox_command("make run", cgroup="/cg/a") == (
+        "echo $$ > /cg/a/cgroup.procs || exit 126; make run")
+
+    # without prlimit, the shell sets the limits.
+    monkeypatch.setattr("utils.sandbox.PRLIMIT", "")
+    assert get_sandbox_command("make run", memory=1 << 20, cpu_time=5) == (
+        "ulimit -v 1024 && ulimit -t 5 || exit 126; make run")
+    data = run_sandboxed(
+        f'{sys.executable} -c "x = bytearray(512 << 20)"', text=True,
+        memory=256 << 20)
+    assert data.returncode != 0
+    assert "MemoryError" in data.stderr
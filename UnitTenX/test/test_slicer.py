@@ -0,0 +1,60 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import sys
+
+sys.path.append("..")
+
+from utils.slicer import *
+
+SOURCE = '''# 1 "/work/mockup.c"
+int keep(int a)
+{
+  return a;
+}
+unsigned int byte_chr(s,n,c)
+char *s;
+register unsigned int n;
+int c;
+{
+  return n;
+}
+int after(void) { return 1; }
+int last(void) { return after(); }'''
+
+DB = {
+    '__globals': [],
+    'keep': {'coord': [1, 4]},
+    'byte_chr': {'coord': [5, 11]},
+    'after': {'coord': [12, 12]},
+    'last': {'coord': [13, 13]},
+}
+
+
+def test_knr_to_prototype():
+    assert knr_to_prototype(
+        'unsigned int byte_chr(s,n,c) char *s; register unsigned int n; int c;'
+    ) == 'unsigned int byte_chr(char *s, unsigned int n, int c)'
+    assert knr_to_prototype(
+        'int f(a,b,c,d) char *a, b[10]; struct foo *c;'
+    ) == 'int f(char *a, char b[10], struct foo *c, int d)'
+    assert knr_to_prototype('int f(int a)') == 'int f(int a)'
+
+
+def test_slice_source():
+    source = slice_source(SOURCE, '/work/mockup.c', DB, {'keep', 'last'})
+
+    assert source.split('\n') == [
+        '# 1 "/work/mockup.c"',
+        'int keep(int a)',
+        '{',
+        '  return a;',
+        '}',
+        'unsigned int byte_chr(char *s, unsigned int n, int c);',
+        '# 12 "/work/mockup.c"',
+        'int after(void);',
+        '# 13 "/work/mockup.c"',
+        'int last(void) { return after(); }',
+    ]
+
+    # functions of other files are not touched.
+    assert slice_source(SOURCE, '/work/other.c', DB, {'keep'}) == SOURCE
@@ -1,6 +1,8 @@
 # Copyright 2025 Claudionor N. Coelho Jr
 
+import os
 import sys
+import yaml
 
 sys.path.append("..")
 
@@ -72,3 +74,331 @@ def test_in_obj_list():
     obj_list = [ [ 2 ], [ 4 ], [ 1 ] ]
 
     assert in_obj_list(obj, obj_list)
+
+
+def test_run_esbmc(tmp_path):
+    data = run_esbmc("pwd 1>&2", str(tmp_path))
+    assert data.stderr.strip() == str(tmp_path)
+
+
+def test_get_timeout_seconds():
+    assert get_timeout_seconds("10s") == 10
+    assert get_timeout_seconds("2m") == 120
+    assert get_timeout_seconds("1h") == 3600
+    assert get_timeout_seconds("30") == 30
+
+
+def test_esbmc_cache(tmp_path, monkeypatch):
+    import utils.symbolic
+
+    monkeypatch.setenv("UNIT_TENX_CACHE", str(tmp_path))
+    monkeypatch.setattr(utils.symbolic, "ESBMC_VERSION", "ESBMC version 7.6")
+
+    filename = tmp_path / "mockup.c"
+    filename.write_text("int run(int a) { return a; }\n")
+
+    key = get_esbmc_cache_key(str(filename), "run", "-DX", 20, "")
+    assert key == get_esbmc_cache_key(str(filename), "run", "-DX", 20, "")
+    assert key != get_esbmc_cache_key(str(filename), "run", "-DX", 10, "")
+    assert load_esbmc_cache(key, 10) is None
+
+    entry = {
+        "timeout": 10,
+        "timed_out": True,
+        "cex_list": [{"params": {"a": "1"}, "inputs": {}, "locals": {}}],
+        "logs": ["esbmc mockup.c"]
+    }
+    save_esbmc_cache(key, entry)
+    assert load_esbmc_cache(key, 10) == entry
+    # timed out results are retried with a bigger budget.
+    assert load_esbmc_cache(key, 20) is None
+
+    entry["timed_out"] = False
+    save_esbmc_cache(key, entry)
+    assert load_esbmc_cache(key, 20) == entry
+
+    # another version of esbmc does not see the results.
+    monkeypatch.setattr(utils.symbolic, "ESBMC_VERSION", "ESBMC version 7.7")
+    assert get_esbmc_cache_key(str(filename), "run", "-DX", 20, "") != key
+
+
+def test_get_file_interfaces(tmp_path, monkeypatch):
+    import utils.ast_cache
+    import utils.symbolic
+
+    # clang may not be installed, and any preprocessor works here.
+    monkeypatch.setenv("UNIT_TENX_CACHE", str(tmp_path))
+    monkeypatch.setattr(
+        utils.symbolic, "parse",
+        lambda filename, cpp_args: utils.ast_cache.parse(filename, cpp_args, cpp_path="cpp"))
+
+    filename = tmp_path / "counter.c"
+    filename.write_text(
+        "int count;\n"
+        "int *last = &count;\n"
+        "void inc(int n) {\n"
+        "    int i;\n"
+        "    count += n;\n"
+        "}\n"
+        "int get(void) { return count; }\n")
+
+    interfaces = get_file_interfaces(str(filename), "-DCOUNTER")
+    assert sorted(interfaces) == ["__globals", "get", "inc"]
+    assert get_file_interfaces(str(filename), "-DCOUNTER") is interfaces
+
+    inc = get_function_interface(str(filename), "inc", "-DCOUNTER")
+    assert inc["params"] == ["n"]
+    assert inc["types"] == ["int"]
+    assert inc["locals"] == ["i"]
+    assert inc["return_type"] == "void"
+    assert inc["decl_lines"] == [3, 4]
+    assert inc["global_vars"] == ["count"]
+    assert inc["global_var_types"] == ["int"]
+
+    # count is used outside functions, so every function reports it.
+    assert get_function_interface(str(filename), "missing", "-DCOUNTER")["global_vars"] == ["count"]
+
+
+def test_get_obj_key():
+    objs = [
+        1, 1.0, "1", True, None, [1, 2], [2, 1], [[1]], {"a": 1, "b": [2]},
+        {"b": [2], "a": 1}, {"a": 1}, {"a": None}
+    ]
+    for o1 in objs:
+        for o2 in objs:
+            assert (get_obj_key(o1) == get_obj_key(o2)) == is_same(o1, o2)
+
+
+def test_cex_parser(tmp_path):
+    params = {"params": ["a"], "locals": ["i"]}
+    examples = (
+        "ESBMC version 7.6\n"
+        "x = 0\n"
+        "[Counterexample]\n"
+        "State 1 file fact.c line 3 function run\n"
+        "  a = 1 (00000001)\n"
+        "  g = 2\n"
+        "  g = 3\n"
+        "[Counterexample]\n"
+        "  a = 1 (00000001)\n"
+        "  g = 2\n"
+        "  g = 3\n"
+        "[Counterexample]\n"
+        "  i = 4\n"
+        "  goto_symex::guard = 1\n"
+        "[Counterexample]\n"
+        "Violated property\n"
+    )
+
+    cex_list = parse_examples(examples, params)
+    assert cex_list == [
+        {"params": {"a": "1"}, "inputs": {"g": ["2", "3"]}, "locals": {"i": None}},
+        {"params": {"a": None}, "inputs": {}, "locals": {"i": "4"}},
+    ]
+
+    # esbmc output is parsed while it runs, with the same result.
+    (tmp_path / "examples.txt").write_text(examples)
+    parser = CexParser(params)
+    data = run_esbmc("cat examples.txt 1>&2", str(tmp_path), parser)
+    assert data.stderr == examples
+    assert parser.cex_list == cex_list
+
+    # repeated counter-examples are dropped when merging.
+    assert not parser.add(cex_list[0])
+
+
+def test_run_esbmc_early_stop(tmp_path):
+    params = {"params": ["a"], "locals": []}
+    script = tmp_path / "esbmc.sh"
+    script.write_text(
+        "i=0\n"
+        "while true; do\n"
+        "  i=$((i+1))\n"
+        "  echo '[Counterexample]' 1>&2\n"
+        "  echo \"  a = $i\" 1>&2\n"
+        "done\n")
+
+    parser = CexParser(params)
+    data = run_esbmc("sh esbmc.sh", str(tmp_path), parser, max_cex=3)
+    assert [cex["params"]["a"] for cex in parser.cex_list] == ["1", "2", "3"]
+
+    parser = CexParser(params)
+    data = run_esbmc("sh esbmc.sh", str(tmp_path), parser, max_output=1000)
+    assert 1000 <= len(data.stderr) < 1100
+    assert parser.cex_list
+
+
+def test_run_portfolio(tmp_path, monkeypatch):
+    import time
+
+    monkeypatch.setenv("UNIT_TENX_CACHE", str(tmp_path))
+    # all configurations run at the same time.
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    params = {"params": ["a"], "locals": []}
+    cmds = {
+        "none": "echo 'VERIFICATION SUCCESSFUL' 1>&2",
+        "slow": "sleep 30; printf '[Counterexample]\\n  a = 2\\n' 1>&2",
+        "fast": "sleep 0.5; printf '[Counterexample]\\n  a = 1\\n' 1>&2",
+    }
+
+    start_time = time.time()
+    config, data, parser = run_portfolio(cmds, str(tmp_path), params, "fact.c:run:coverage")
+    assert time.time() - start_time < 10
+    assert config == "fast"
+    assert parser.cex_list[0]["params"]["a"] == "1"
+    assert load_portfolio_winner("fact.c:run:coverage") == "fast"
+
+    # next time, the winner runs alone.
+    cmds["slow"] = "exit 1"
+    config, data, parser = run_portfolio(cmds, str(tmp_path), params, "fact.c:run:coverage")
+    assert config == "fast"
+
+
+def test_process_group(monkeypatch):
+    import signal
+    import utils.sandbox
+    from utils.sandbox import Sandbox
+
+    killed = []
+
+    def kill_group(pid):
+        killed.append(pid)
+        os.killpg(pid, signal.SIGKILL)
+
+    monkeypatch.setattr(utils.sandbox, "kill_group", kill_group)
+    group = ProcessGroup()
+    done = Sandbox("true")
+    done.wait()
+    running = Sandbox("sleep 30")
+    group.add(done)
+    group.add(running)
+
+    # the process group of a reaped sandbox may belong to someone else.
+    killed.clear()
+    group.stop()
+    assert killed == [running.pid]
+    assert running.wait() == -signal.SIGKILL
+
+    # sandboxes added after stop are killed right away.
+    late = Sandbox("sleep 30")
+    group.add(late)
+    assert late.wait() == -signal.SIGKILL
+
+
+def test_get_symbolic_test_split_properties(tmp_path, monkeypatch):
+    import utils.ast_cache
+    import utils.symbolic
+
+    # fake esbmc: the memory leak check times out, the others find bugs.
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    esbmc = bin_dir / "esbmc"
+    esbmc.write_text(
+        "#!/bin/sh\n"
+        "for arg in \"$@\"; do\n"
+        "  case \"$arg\" in\n"
+        "    --condition-coverage) printf '[Counterexample]\\n  a = 1\\n' 1>&2;;\n"
+        "    --overflow-check) printf '[Counterexample]\\n  a = 2\\n' 1>&2;;\n"
+        "    --memory-leak-check) sleep 1; echo 'ERROR: Timed out' 1>&2; exit 1;;\n"
+        "    --ub-shift-check) printf '[Counterexample]\\n  a = 3\\n' 1>&2;;\n"
+        "  esac\n"
+        "done\n")
+    esbmc.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("UNIT_TENX_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setattr(utils.symbolic, "ESBMC_CACHE", 0)
+    monkeypatch.setattr(utils.symbolic, "ESBMC_SPLIT_PROPERTIES", 1)
+    monkeypatch.setattr(
+        utils.symbolic, "parse",
+        lambda filename, cpp_args: utils.ast_cache.parse(filename, cpp_args, cpp_path="cpp"))
+
+    filename = tmp_path / "run.c"
+    filename.write_text("int run(int a) { return a; }\n")
+
+    cex_list, logs = get_symbolic_test(
+        filename=str(filename), cflags="-DRUN", target="run",
+        project=str(tmp_path), work=str(tmp_path))
+
+    assert [cex["params"]["a"] for cex in cex_list] == ["1", "2", "3"]
+    assert len([log for log in logs if log.startswith("esbmc ")]) == 1 + len(ESBMC_PROPERTY_CHECKS)
+    assert not has_symbolic_failed("\n\n".join(logs))
+
+
+def test_get_uncovered_lines(tmp_path):
+    filename = str(tmp_path / "run.c")
+    missing_coverage = [
+        f"{filename}:run: could not reach lines: 3,5",
+        f"{filename}:helper: could not reach lines: 9",
+        f"{tmp_path / 'other.c'}:other: could not reach lines: 1,2",
+    ]
+    assert get_uncovered_lines(yaml.safe_dump(missing_coverage), filename) == [3, 5, 9]
+    assert get_uncovered_lines("", filename) == []
+
+
+def test_add_reachability_asserts():
+    source = (
+        "int run(int a) {\n"            # 1
+        "  if (a > 10)\n"               # 2
+        "    return 1;\n"               # 3
+        "  if (a < 0) {\n"              # 4
+        "    a = -a;\n"                 # 5
+        "  } else {\n"                  # 6
+        "    a = f(a,\n"                # 7
+        "          2);\n"               # 8
+        "  }\n"                         # 9
+        "  return a;\n"                 # 10
+        "}\n")
+    text, instrumented = add_reachability_asserts(source, [3, 5, 6, 8, 10, 40])
+
+    # the body of the if without braces and continuation lines are skipped.
+    assert instrumented == [5, 10]
+    lines = text.split("\n")
+    assert len(lines) == len(source.split("\n"))
+    assert lines[4] == '    __ESBMC_assert(0, "unittenx: reach line 5"); a = -a;'
+    assert lines[9] == '  __ESBMC_assert(0, "unittenx: reach line 10"); return a;'
+
+
+def test_get_targeted_symbolic_test(tmp_path, monkeypatch):
+    import utils.ast_cache
+    import utils.symbolic
+
+    # fake esbmc: finds an input only if line 3 has an assertion.
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    esbmc = bin_dir / "esbmc"
+    esbmc.write_text(
+        "#!/bin/sh\n"
+        "if grep -q 'reach line 3' \"$1\"; then\n"
+        "  printf '[Counterexample]\\n  a = 42\\n' 1>&2\n"
+        "fi\n")
+    esbmc.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setattr(utils.symbolic, "ESBMC_CACHE", 0)
+    monkeypatch.setattr(
+        utils.symbolic, "parse",
+        lambda filename, cpp_args: utils.ast_cache.parse(filename, cpp_args, cpp_path="cpp"))
+
+    filename = tmp_path / "run.c"
+    filename.write_text(
+        "int run(int a) {\n"
+        "  if (a == 42) {\n"
+        "    return 1;\n"
+        "  }\n"
+        "  return 0;\n"
+        "}\n")
+    work = tmp_path / "work"
+    work.mkdir()
+
+    cex_list, logs, instrumented = get_targeted_symbolic_test(
+        filename=str(filename), cflags="-DRUN", target="run",
+        lines=[3], work=str(work))
+
+    assert instrumented == [3]
+    assert [cex["params"]["a"] for cex in cex_list] == ["42"]
+    assert "--multi-property" in logs[0]
+    assert (work / "run.targeted.c").exists()
+
+    # nothing to reach.
+    assert get_targeted_symbolic_test(
+        filename=str(filename), cflags="-DRUN", target="run",
+        lines=[4], work=str(work)) == ([], [], [])
@@ -0,0 +1,25 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import sys
+
+sys.path.append("..")
+
+import utils.timing
+from utils.timing import *
+
+
+def test_timed(tmp_path, monkeypatch):
+    timing_file = str(tmp_path / "timing.jsonl")
+    monkeypatch.setattr(utils.timing, "TIMING", timing_file)
+
+    node = timed("coverage", lambda state, config: {"test": config["test"]})
+    assert node({"name": "fct"}, {"test": "ok"}) == {"test": "ok"}
+    node({"name": "fct"}, {"test": "ok"})
+
+    timings = load_timings(timing_file)
+    assert [(t["target"], t["node"]) for t in timings] == [("fct", "coverage")] * 2
+
+    summary = summarize_timings(timings + [
+        {"target": "fct", "node": "symbolic", "seconds": 3.0}])
+    assert summary["coverage"]["calls"] == 2
+    assert summary["symbolic"] == {"calls": 1, "total": 3.0, "max": 3.0, "mean": 3.0}
@@ -0,0 +1,227 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+
+import pycparser
+from pycparser import CParser
+
+# caches preprocessed sources and pycparser ASTs in memory and in
+# $UNIT_TENX_CACHE/ast (UNITTENX_AST_CACHE=0 disables it).
+AST_CACHE = int(os.getenv('UNITTENX_AST_CACHE', 1))
+
+# number of ASTs kept in memory.
+AST_CACHE_SIZE = int(os.getenv('UNITTENX_AST_CACHE_SIZE', 32))
+
+AST_CACHE_VERSION = 1
+
+# line marker emitted by the preprocessor: # <line> "<file>" <flags>
+MARKER_RE = re.compile(r'^#\s*\d+\s+"([^"<>]+)"', re.M)
+
+lock = threading.Lock()
+entries = OrderedDict()
+
+
+def get_cache_key(filename: str, cpp_path: str, cpp_args: list) -> str:
+    '''
+        Computes key of a preprocessed file. Included files are not part
+        of the key, as they are checked when the entry is loaded.
+
+        :param filename: source file.
+        :param cpp_path: preprocessor.
+        :param cpp_args: preprocessor arguments.
+
+        :return: key.
+    '''
+
+    with open(filename, 'rb') as fp:
+        source_hash = hashlib.sha256(fp.read()).hexdigest()
+
+    key = json.dumps([
+        AST_CACHE_VERSION, pycparser.__version__, os.path.abspath(filename),
+        source_hash, cpp_path, cpp_args])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def get_cache_filename(key: str) -> str:
+    cache_dir = os.environ.get('UNIT_TENX_CACHE', '.cache')
+    return os.path.join(cache_dir, 'ast', key + '.pickle')
+
+
+def get_dependencies(text: str) -> dict:
+    '''
+        Returns files read by the preprocessor with their modification
+        times and sizes.
+
+        :param text: preprocessed source.
+
+        :return: dictionary file -> [mtime, size].
+    '''
+
+    return stat_files(set(MARKER_RE.findall(text)))
+
+
+def stat_files(filenames) -> dict:
+    '''
+        Returns modification times and sizes of files.
+
+        :param filenames: files read by the preprocessor.
+
+        :return: dictionary file -> [mtime, size].
+    '''
+
+    dependencies = {}
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+            dependencies[filename] = [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            pass
+    return dependencies
+
+
+def is_valid(entry: dict) -> bool:
+    '''
+        Checks if none of the files read by the preprocessor changed.
+
+        :param entry: cache entry.
+
+        :return: True if entry can be used.
+    '''
+
+    for filename, (mtime, size) in entry['dependencies'].items():
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        if stat.st_mtime_ns != mtime or stat.st_size != size:
+            return False
+    return True
+
+
+def load_entry(key: str) -> dict | None:
+    with lock:
+        entry = entries.get(key, None)
+        if entry:
+            entries.move_to_end(key)
+    if entry and is_valid(entry):
+        return entry
+
+    try:
+        with open(get_cache_filename(key), 'rb') as fp:
+            entry = pickle.load(fp)
+    except Exception:
+        return None
+
+    if not is_valid(entry):
+        return None
+
+    save_entry(key, entry, to_disk=False)
+    return entry
+
+
+def save_entry(key: str, entry: dict, to_disk: bool = True):
+    with lock:
+        entries[key] = entry
+        entries.move_to_end(key)
+        while len(entries) > AST_CACHE_SIZE:
+            entries.popitem(last=False)
+
+    if not to_disk:
+        return
+
+    filename = get_cache_filename(key)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        with open(tmp_filename, 'wb') as fp:
+            pickle.dump(entry, fp)
+        os.replace(tmp_filename, filename)
+    except Exception:
+        # very deep ASTs may not be pickled, they are only cached in memory.
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def get_entry(filename: str, cpp_path: str, cpp_args: list) -> dict:
+    '''
+        Preprocesses filename, reusing earlier results.
+
+        :param filename: source file.
+        :param cpp_path: preprocessor.
+        :param cpp_args: preprocessor arguments.
+
+        :return: cache entry {text, errors, dependencies, ast}.
+    '''
+
+    key = get_cache_key(filename, cpp_path, cpp_args) if AST_CACHE else ''
+    entry = load_entry(key) if key else None
+    if entry:
+        return entry
+
+    # same command line as pycparser.preprocess_file.
+    try:
+        data = subprocess.run(
+            [cpp_path] + cpp_args + [filename], capture_output=True, text=True)
+    except OSError as e:
+        raise RuntimeError(
+            f"Unable to invoke '{cpp_path}'.  " +
+            "Make sure its path was passed correctly\n" +
+            f"Original error: {e}")
+
+    if data.returncode:
+        # failures are not cached, as they usually come from the environment.
+        raise subprocess.CalledProcessError(
+            data.returncode, [cpp_path] + cpp_args + [filename],
+            output=data.stdout, stderr=data.stderr)
+
+    entry = {
+        'text': data.stdout,
+        'errors': data.stderr,
+        'dependencies': get_dependencies(data.stdout),
+        'ast': None
+    }
+    if key:
+        save_entry(key, entry)
+    return entry
+
+
+def preprocess(filename: str, cpp_args: list, cpp_path: str = 'clang') -> tuple[str, str]:
+    '''
+        Preprocesses filename.
+
+        :param filename: source file.
+        :param cpp_args: preprocessor arguments.
+        :param cpp_path: preprocessor.
+
+        :return: preprocessed text and preprocessor messages.
+    '''
+
+    entry = get_entry(filename, cpp_path, cpp_args)
+    return entry['text'], entry['errors']
+
+
+def parse(filename: str, cpp_args: list, cpp_path: str = 'clang') -> pycparser.c_ast.FileAST:
+    '''
+        Replaces pycparser.parse_file(filename, use_cpp=True, ...). The AST
+        is shared among callers, so it must not be modified.
+
+        :param filename: source file.
+        :param cpp_args: preprocessor arguments.
+        :param cpp_path: preprocessor.
+
+        :return: AST.
+    '''
+
+    entry = get_entry(filename, cpp_path, cpp_args)
+    if entry['ast'] is None:
+        entry = dict(entry, ast=CParser().parse(entry['text'], filename))
+        if AST_CACHE:
+            save_entry(get_cache_key(filename, cpp_path, cpp_args), entry)
+    return entry['ast']
@@ -0,0 +1,239 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import glob
+import hashlib
+import json
+import os
+import re
+
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+from .blobs import resolve_state
+from .model import DEFAULT_MODELS, MAX_TOKENS, content_to_text
+
+# batch mode: '' (interactive), 'prepare' (run ESBMC and write the symbolic
+# prompt as a batch request) or 'resume' (continue from the batch result).
+BATCH = os.getenv('UNITTENX_BATCH', '')
+BATCH_DIR = os.getenv('UNITTENX_BATCH_DIR', '')
+
+# maximum number of requests per batch file (both providers accept more,
+# but smaller batches finish sooner and are easier to resubmit).
+MAX_BATCH_REQUESTS = int(os.getenv('UNITTENX_MAX_BATCH_REQUESTS', 10000))
+
+BATCH_FORMATS = ['anthropic', 'openai']
+
+
+def get_custom_id(work: str, name: str) -> str:
+    '''
+        Computes the id of a target in the batch. Both providers only
+        accept [a-zA-Z0-9_-]{1,64}.
+
+        :param work: work directory of the target.
+        :param name: target name.
+
+        :return: custom id.
+    '''
+
+    custom_id = re.sub(r'[^a-zA-Z0-9_-]', '_', os.path.basename(work.rstrip('/')) or name)
+    if len(custom_id) > 64:
+        digest = hashlib.sha256(custom_id.encode('utf-8')).hexdigest()[:16]
+        custom_id = custom_id[:47] + '_' + digest
+    return custom_id
+
+
+def get_batch_format(model_name: str) -> str:
+    '''
+        Returns batch format for the model. Everything that is not Anthropic
+        uses the OpenAI format (also used by Azure and by the local server).
+
+        :param model_name: model name.
+
+        :return: 'anthropic' or 'openai'.
+    '''
+
+    return 'anthropic' if model_name.split(':')[0] == 'anthropic' else 'openai'
+
+
+def get_model_id(model_name: str) -> str:
+    '''
+        Returns model id expected by the provider.
+
+        :param model_name: model name (<provider> or <provider>:<model>).
+
+        :return: model id.
+    '''
+
+    provider, _, model = model_name.partition(':')
+    if model:
+        return model
+    return DEFAULT_MODELS.get(provider, provider)
+
+
+def make_request(custom_id: str, route: dict, messages: list) -> dict:
+    '''
+        Creates one batch request in the provider format.
+
+        :param custom_id: id of the target.
+        :param route: model_name, temperature and max_tokens of the node.
+        :param messages: list of messages with role and content.
+
+        :return: request dictionary.
+    '''
+
+    model_name = route['model_name'].split(',')[0].strip()
+    messages = [
+        {'role': m['role'], 'content': content_to_text(m['content'])}
+        for m in messages
+    ]
+    params = {
+        'model': get_model_id(model_name),
+        'max_tokens': route.get('max_tokens', None) or MAX_TOKENS,
+        'temperature': route.get('temperature', 0),
+        'messages': messages
+    }
+
+    if get_batch_format(model_name) == 'anthropic':
+        return {'custom_id': custom_id, 'params': params}
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': params
+    }
+
+
+def write_request(batch_dir: str, custom_id: str, route: dict, messages: list) -> str:
+    '''
+        Writes batch request of one target to batch_dir/requests.
+
+        :param batch_dir: batch directory.
+        :param custom_id: id of the target.
+        :param route: model_name, temperature and max_tokens of the node.
+        :param messages: list of messages with role and content.
+
+        :return: request file name.
+    '''
+
+    os.makedirs(os.path.join(batch_dir, 'requests'), exist_ok=True)
+    model_name = route['model_name'].split(',')[0].strip()
+    filename = os.path.join(batch_dir, 'requests', custom_id + '.json')
+    with open(filename, 'w') as fp:
+        json.dump({
+            'format': get_batch_format(model_name),
+            'model_name': model_name,
+            'request': make_request(custom_id, route, messages)
+        }, fp)
+    return filename
+
+
+def save_state(batch_dir: str, custom_id: str, state: dict) -> str:
+    '''
+        Saves agent state after the symbolic engine, so that we can
+        resume the target once the batch is done.
+
+        :param batch_dir: batch directory.
+        :param custom_id: id of the target.
+        :param state: agent state.
+
+        :return: state file name.
+    '''
+
+    os.makedirs(os.path.join(batch_dir, 'states'), exist_ok=True)
+    # blobs only live in this process, so we save their texts.
+    state = resolve_state(state)
+    state['messages'] = messages_to_dict(state.get('messages', []))
+    filename = os.path.join(batch_dir, 'states', custom_id + '.json')
+    with open(filename, 'w') as fp:
+        json.dump(state, fp)
+    return filename
+
+
+def load_state(batch_dir: str, custom_id: str) -> dict:
+    '''
+        Loads agent state saved by save_state.
+
+        :param batch_dir: batch directory.
+        :param custom_id: id of the target.
+
+        :return: agent state.
+    '''
+
+    filename = os.path.join(batch_dir, 'states', custom_id + '.json')
+    with open(filename, 'r') as fp:
+        state = json.load(fp)
+    state['messages'] = messages_from_dict(state['messages'])
+    return state
+
+
+def collect(batch_dir: str) -> list[str]:
+    '''
+        Gathers requests of all targets into provider batch files
+        batch_dir/batch_<format>_<n>.jsonl.
+
+        :param batch_dir: batch directory.
+
+        :return: list of batch file names.
+    '''
+
+    requests = {f: [] for f in BATCH_FORMATS}
+    for filename in sorted(glob.glob(os.path.join(batch_dir, 'requests', '*.json'))):
+        with open(filename, 'r') as fp:
+            entry = json.load(fp)
+        requests[entry['format']].append(entry['request'])
+
+    batch_files = []
+    for batch_format in BATCH_FORMATS:
+        entries = requests[batch_format]
+        for n, i in enumerate(range(0, len(entries), MAX_BATCH_REQUESTS)):
+            filename = os.path.join(batch_dir, f'batch_{batch_format}_{n}.jsonl')
+            with open(filename, 'w') as fp:
+                for entry in entries[i:i + MAX_BATCH_REQUESTS]:
+                    fp.write(json.dumps(entry) + '\n')
+            batch_files.append(filename)
+            print(f'... {filename}: {len(entries[i:i + MAX_BATCH_REQUESTS])} requests')
+    return batch_files
+
+
+def parse_result(entry: dict) -> tuple[str, str | None]:
+    '''
+        Extracts answer from one line of a batch result file, in
+        either Anthropic or OpenAI format.
+
+        :param entry: result entry.
+
+        :return: (custom id, text) where text is None if request failed.
+    '''
+
+    custom_id = entry['custom_id']
+    if 'result' in entry:
+        result = entry['result']
+        if result.get('type', '') != 'succeeded':
+            return custom_id, None
+        return custom_id, content_to_text(result['message']['content'])
+
+    response = entry.get('response', None) or {}
+    if entry.get('error', None) or response.get('status_code', 0) != 200:
+        return custom_id, None
+    return custom_id, response['body']['choices'][0]['message']['content']
+
+
+def load_results(batch_dir: str) -> dict:
+    '''
+        Reads all result files in batch_dir/results.
+
+        :param batch_dir: batch directory.
+
+        :return: dictionary custom id -> text (None if request failed).
+    '''
+
+    results = {}
+    for filename in sorted(glob.glob(os.path.join(batch_dir, 'results', '*.jsonl'))):
+        with open(filename, 'r') as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                custom_id, text = parse_result(json.loads(line))
+                # a resubmitted batch may succeed where the first one failed.
+                if text is not None or custom_id not in results:
+                    results[custom_id] = text
+    return results
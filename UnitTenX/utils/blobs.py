@@ -0,0 +1,174 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from langchain_core.messages import BaseMessage
+
+try:
+    from .model import content_to_text
+except:
+    from model import content_to_text
+
+# blobs are written to this directory (default $UNIT_TENX_CACHE/blobs), and
+# only the most recently used UNITTENX_BLOB_CACHE_SIZE blobs are kept in memory.
+BLOB_DIR = os.getenv('UNITTENX_BLOB_DIR', '')
+BLOB_CACHE_SIZE = int(os.getenv('UNITTENX_BLOB_CACHE_SIZE', 64))
+
+# texts smaller than this stay in the state.
+BLOB_MIN_SIZE = 256
+
+BLOB_PREFIX = 'blob:sha256:'
+
+# large string fields of AgentState that hold blob references.
+BLOB_FIELDS = ['source_code', 'test', 'coverage_output']
+
+
+def is_blob_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_PREFIX)
+
+
+class BlobStore:
+    '''
+        Content addressed store of large strings. The agent state only keeps
+        references (blob:sha256:<digest>), so checkpoints stay small and the
+        same text is stored once, no matter how many checkpoints refer to it.
+    '''
+
+    def __init__(self, blob_dir: str = '', cache_size: int = BLOB_CACHE_SIZE):
+        if not blob_dir:
+            blob_dir = os.path.join(os.environ.get('UNIT_TENX_CACHE', '.cache'), 'blobs')
+        # absolute, as nodes may change the working directory.
+        self.blob_dir = os.path.abspath(blob_dir)
+        self.cache_size = cache_size
+        self.blobs = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def get_filename(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def put(self, text: str) -> str:
+        '''
+            Stores text.
+
+            :param text: text to be stored.
+
+            :return: blob reference, or text if it is small.
+        '''
+
+        if not isinstance(text, str) or len(text) < BLOB_MIN_SIZE or is_blob_ref(text):
+            return text
+
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+        with self.lock:
+            if digest in self.blobs:
+                self.blobs.move_to_end(digest)
+                return BLOB_PREFIX + digest
+            self.blobs[digest] = text
+
+        filename = self.get_filename(digest)
+        if not os.path.exists(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # write and rename, so that readers never see partial blobs.
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=os.path.dirname(filename), delete=False) as fp:
+                fp.write(text)
+            os.replace(fp.name, filename)
+        with self.lock:
+            while len(self.blobs) > self.cache_size:
+                self.blobs.popitem(last=False)
+
+        return BLOB_PREFIX + digest
+
+    def get(self, ref: str) -> str:
+        '''
+            Fetches text.
+
+            :param ref: blob reference (or plain text).
+
+            :return: text.
+        '''
+
+        if not is_blob_ref(ref):
+            return ref
+
+        digest = ref[len(BLOB_PREFIX):]
+        with self.lock:
+            if digest in self.blobs:
+                self.blobs.move_to_end(digest)
+                return self.blobs[digest]
+
+        try:
+            with open(self.get_filename(digest), 'r') as fp:
+                text = fp.read()
+        except FileNotFoundError:
+            raise KeyError(f'blob {digest} not found in {self.blob_dir}')
+
+        with self.lock:
+            self.blobs[digest] = text
+            while len(self.blobs) > self.cache_size:
+                self.blobs.popitem(last=False)
+
+        return text
+
+
+@lru_cache(maxsize=None)
+def get_blob_store() -> BlobStore:
+    return BlobStore(BLOB_DIR)
+
+
+def put_blob(text: str) -> str:
+    return get_blob_store().put(text)
+
+
+def get_blob(ref: str) -> str:
+    return get_blob_store().get(ref)
+
+
+def put_messages(messages: list) -> list:
+    '''
+        Replaces message contents by blob references.
+
+        :param messages: list of messages (dictionaries or LangChain messages).
+
+        :return: list of messages with references.
+    '''
+
+    result = []
+    for message in messages:
+        if isinstance(message, BaseMessage):
+            result.append(message.model_copy(
+                update={'content': put_blob(content_to_text(message.content))}))
+        else:
+            result.append(dict(message, content=put_blob(content_to_text(message['content']))))
+    return result
+
+
+def resolve_state(state: dict) -> dict:
+    '''
+        Replaces blob references in state by their texts, so that the state
+        can be saved and loaded by another process.
+
+        :param state: agent state.
+
+        :return: new state without references.
+    '''
+
+    state = dict(state)
+    for field in BLOB_FIELDS:
+        if field in state:
+            state[field] = get_blob(state[field])
+    if 'messages' in state:
+        state['messages'] = [
+            message.model_copy(update={'content': get_blob(message.content)})
+            if isinstance(message, BaseMessage)
+            else dict(message, content=get_blob(message['content']))
+            for message in state['messages']
+        ]
+    return state
@@ -1,17 +1,47 @@
 # Copyright 2025 Claudionor N. Coelho Jr
 
 import argparse
+import hashlib
+import json
+import re
 import pycparser_fake_libc
-import numpy as np
+import shlex
 import subprocess
+import threading
 
 try:
     from .utils import *
 except:
     from utils import *
 
+try:
+    from . import ast_cache
+except:
+    import ast_cache
+
+# line marker emitted by the preprocessor: # <line> "<file>" <flags>
+MARKER_RE = re.compile(r'^#\s*\d+\s+"(.*)"')
+
+
+def get_cache_key(filename, cpp_path, cpp_args, includes):
+    '''
+        Computes key of a flattened file. Included files are not part of
+        the key, as they are checked when the entry is loaded.
+
+        :param filename: file to be read.
+        :param cpp_path: preprocessor.
+        :param cpp_args: preprocessor arguments.
+        :param includes: all include directories added to cflags.
+
+        :return: key.
+    '''
 
-def cpp_flatten(filename, cflags="", includes=[]):
+    key = json.dumps([
+        'cpp_flatten', ast_cache.get_cache_key(filename, cpp_path, cpp_args), includes])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def cpp_flatten(filename, cflags="", includes=[], cpp_path='clang'):
 
     '''
         Add all include files in source code (but only the ones in the
@@ -21,60 +51,100 @@ def cpp_flatten(filename, cflags="", includes=[]):
         :param filename: file to be read.
         :param cflags: all c/cxx flags to be used at compile time.
         :param includes: all include directories added to cflags.
+        :param cpp_path: preprocessor.
 
         :return: string contained file read for llm.
                  
     '''
 
-    cmd = f'clang -E {filename} '
+    cpp_args = ['-E', filename]
 
     if filename.endswith('.c'):
         # add fake pycparser lib to reduce amount of garbage in cpp
-        cmd += f'-I{pycparser_fake_libc.directory} '
+        cpp_args.append(f'-I{pycparser_fake_libc.directory}')
 
-    cmd += cflags
+    cpp_args += shlex.split(cflags)
 
-    all_paths = [filename] + includes
+    # the filtered output is cached together with the files read by the
+    # preprocessor, so that it is reused until one of them changes.
+    key = get_cache_key(filename, cpp_path, cpp_args, includes) if ast_cache.AST_CACHE else ''
+    entry = ast_cache.load_entry(key) if key else None
+    if entry:
+        return entry['text']
 
-    data = subprocess.run(cmd, capture_output=True, shell=True, text=True)
+    all_paths = [filename] + includes
 
-    if data.stderr:
-        print(data.stderr)
+    # user code is usually a small part of the output, so we filter the
+    # output while the preprocessor writes it, and only keep user blocks.
+    try:
+        process = subprocess.Popen(
+            [cpp_path] + cpp_args, text=True,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        print(e)
         raise ValueError
 
-    lines = data.stdout.split('\n')
+    stderr = []
+    stderr_thread = threading.Thread(
+        target=lambda: stderr.append(process.stderr.read()))
+    stderr_thread.start()
+
+    # directory -> True if its blocks are kept.
+    use_dir = {}
+    files = set()
 
     result = []
     block = []
     use_this = False
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if len(line) > 0 and line[0] == '#':
-            # check if pragma is '# <number> "<filename>" (<number> )*'
-            fields = line.split(' ')
-            file_pragma = fields[2]
-            if file_pragma[0] != '"':
-                i += 1
+    new_line = False
+    for line in process.stdout:
+        new_line = line.endswith('\n')
+        line = line.rstrip('\n')
+        # check if pragma is '# <number> "<filename>" (<number> )*'
+        match = MARKER_RE.match(line) if line.startswith('#') else None
+        if not match:
+            if use_this:
                 block.append(line)
-                continue
+            continue
 
-            dirpath, basename = os.path.split(file_pragma[1:-1])
+        file_pragma = match.group(1)
+        files.add(file_pragma)
+        dirpath = os.path.dirname(file_pragma)
 
-            if use_this:
-                result.append('\n'.join(block))
+        if use_this:
+            result.append('\n'.join(block))
+
+        block = [line]
+        if dirpath not in use_dir:
+            use_dir[dirpath] = any(dirpath in p for p in all_paths)
+        use_this = use_dir[dirpath]
 
-            block = [line]
-            use_this = np.any([dirpath in p for p in all_paths])
+    process.stdout.close()
+    process.wait()
+    stderr_thread.join()
+    process.stderr.close()
 
-        else:
-            block.append(line)
+    if stderr[0]:
+        print(stderr[0])
+        raise ValueError
 
-        i += 1
     if block and use_this:
+        if new_line:
+            # same as splitting the whole output by new lines.
+            block.append('')
         result.append('\n'.join(block))
 
-    return '\n'.join(result)
+    text = '\n'.join(result)
+
+    if key:
+        ast_cache.save_entry(key, {
+            'text': text,
+            'errors': '',
+            'dependencies': ast_cache.stat_files(files),
+            'ast': None
+        })
+
+    return text
 
 
 def parse_args(arg_list: list[str] | None):
@@ -16,3 +16,41 @@ def num_tokens_from_string(string: str, encoding_name: str="cl100k_base") -> int
     return num_tokens
 
 
+
+
+def num_tokens_from_chars(string: str, chars_per_token: int=4) -> int:
+    '''
+        Cheap estimate of number of tokens in string, used when we need to
+        count tokens of many small pieces of a prompt.
+
+        :param string: string to estimate tokens
+        :param chars_per_token: average number of characters per token.
+
+        :return: number of tokens estimated.
+    '''
+    return (len(string) + chars_per_token - 1) // chars_per_token
+
+
+def num_tokens_from_messages(messages, chars_per_token: int=4) -> int:
+    '''
+        Cheap estimate of number of tokens in a list of messages. We use this
+        estimate before every call to the model, so we do not want to pay
+        for a full tokenization of the prompt.
+
+        :param messages: list of messages (dict or LangChain messages).
+        :param chars_per_token: average number of characters per token.
+
+        :return: number of tokens estimated.
+    '''
+    num_chars = 0
+    for message in messages:
+        if isinstance(message, dict):
+            content = message.get('content', '')
+        else:
+            content = getattr(message, 'content', message)
+        if isinstance(content, list):
+            content = ''.join(
+                c.get('text', '') if isinstance(c, dict) else str(c)
+                for c in content)
+        num_chars += len(str(content))
+    return num_chars // chars_per_token
@@ -15,6 +15,11 @@ try:
 except:
     from utils import *
 
+try:
+    from .sandbox import run_sandboxed
+except:
+    from sandbox import run_sandboxed
+
 
 def generate_makefile(
         work:str, 
@@ -311,10 +316,11 @@ def execute_makefile(
             )
         else:
             try:
-                data = subprocess.run(
+                # the test binary may hang, fork or allocate without limits.
+                data = run_sandboxed(
                     cmd,
-                    capture_output=True,
-                    shell=True,
+                    kind=cmd,
+                    cwd=work,
                     text=True,
                     encoding='utf-8',
                     errors='ignore'
@@ -2,11 +2,14 @@
 
 import code2flow # placeholder to make sure we installed.
 import argparse
+from collections import OrderedDict
 import json
 import networkx as nx
 import os
 import subprocess
+import sys
 import tempfile
+import threading
 import yaml
 try:
     from yaml import CLoader as Loader
@@ -23,6 +26,17 @@ try:
 except:
     from utils import fix_relative_paths, fatal_error
 
+try:
+    from . import ast_cache
+except:
+    import ast_cache
+
+# number of mockup scans kept in memory.
+MOCKUP_DB_CACHE_SIZE = 8
+
+mockup_lock = threading.Lock()
+mockup_dbs = OrderedDict()
+
 NEG_FILTERS = [
         "std::", "boost::", "gxx", "llvm", "_GLOBAL__", "__cxx_", 
         "operator delete", "operator new", "malloc", "calloc", "free", 
@@ -157,46 +171,156 @@ def get_implied_graph_python(project, files, function="main", depth=2):
     return target_files
 
 class Traverser:
+    '''
+        Depth-bounded call closures of the functions of a file. The closures
+        of all functions are computed together, one level of the call graph
+        at a time, so that each target is an index lookup, and a function is
+        in the closure if its shortest call path is within the depth.
+    '''
+
     def __init__(self, target_file, yaml_config):
-        self.target_functions = {}
         self.target_file = target_file
         self.yaml_config = yaml_config
+        # depth -> {function: closure}
+        self.closures = {}
 
-    def __traverse(self, target, depth):
+    def build(self, depth):
         '''
-            Traverses the call graph recursively to add attention to the functions
-            within the depth.
+            Computes the closures of all functions in the file.
 
-            :param target: function name.
-            :param depth: if depth <= 0, do not recursively traverse.
-        '''
-        self.target_functions[target] = depth
+            :param depth: target depth for the traversal.
 
-        if depth <= 0:
-            return
+            :return: dictionary function -> set of function names.
+        '''
 
         files_dict = self.yaml_config['files'][self.target_file]
-        for name in files_dict[target]['functions']:
-            if name not in self.yaml_config['functions']: continue
-
-            if (
-                    name not in self.target_functions or
-                    self.target_functions[target] < depth
-            ):
-                self.__traverse(name, depth - 1)
+        functions = self.yaml_config['functions']
+        graph = {
+            name: [callee for callee in files_dict[name]['functions'] if callee in functions]
+            for name in files_dict
+            if not name.endswith('__globals')
+        }
+
+        # closure at depth d is the function and the closures at
+        # depth d-1 of its callees.
+        closures = {name: frozenset([name]) for name in graph}
+        for _ in range(max(depth, 0)):
+            closures = {
+                name: closures[name].union(
+                    *[closures.get(callee, frozenset([callee])) for callee in graph[name]])
+                for name in graph
+            }
+
+        self.closures[depth] = closures
+        return closures
 
     def traverse(self, target, depth):
         '''
-            Call __traverse recursively and return the function names in the call
-            graph.
+            Returns the function names in the call graph of target.
 
             :param target: function name.
             :param depth: target depth for the traversal
 
             :return: set of function names.
         '''
-        self.__traverse(target, depth)
-        return set(list(self.target_functions.keys()))
+
+        if depth not in self.closures:
+            self.build(depth)
+        return set(self.closures[depth].get(target, [target]))
+
+
+def get_traverser(filename, target_file, cflags=""):
+    '''
+        Returns the Traverser of target_file in the mockup db of filename,
+        so that targets of the same mockup share the closure index.
+
+        :param filename: mockup file.
+        :param target_file: file of the mockup db whose closures are used.
+        :param cflags: arguments to be passed to the compiler.
+
+        :return: Traverser.
+    '''
+
+    entry = get_mockup_entry(filename, cflags)
+    if entry is None:
+        return Traverser(target_file=target_file, yaml_config=None)
+    with mockup_lock:
+        if target_file not in entry['traversers']:
+            entry['traversers'][target_file] = Traverser(
+                target_file=target_file, yaml_config=entry['db'])
+        return entry['traversers'][target_file]
+
+
+def get_mockup_db(filename, cflags=""):
+    '''
+        Scans a mockup file as scan_c_project.py does. The result is cached,
+        so that all nodes of the agent share the same scan, and the scan of
+        a mockup that did not change is reused across runs.
+
+        :param filename: mockup file.
+        :param cflags: arguments to be passed to the compiler.
+
+        :return: project db (files and functions) of the mockup, or None
+            if the scan failed. Callers must not change it.
+    '''
+
+    entry = get_mockup_entry(filename, cflags)
+    return entry['db'] if entry else None
+
+
+def get_mockup_entry(filename, cflags=""):
+    '''
+        Returns the scan of a mockup file, scanning it again when the
+        mockup, its db.yaml or one of the scanned files changed (as
+        ast_cache does). Failed scans are not cached.
+
+        :param filename: mockup file.
+        :param cflags: arguments to be passed to the compiler.
+
+        :return: entry {db, dependencies, traversers} or None if the scan failed.
+    '''
+
+    key = (os.path.abspath(filename), cflags)
+    with mockup_lock:
+        entry = mockup_dbs.get(key, None)
+        if entry:
+            mockup_dbs.move_to_end(key)
+    if entry and ast_cache.is_valid(entry):
+        return entry
+
+    try:
+        from scan_c_project import scan_project
+    except ImportError:
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from scan_c_project import scan_project
+
+    # files are checked before the scan, so that changes made during the
+    # scan are seen next time.
+    dependencies = ast_cache.stat_files([
+        key[0], os.path.join(os.path.dirname(key[0]), 'db.yaml')])
+
+    try:
+        db = scan_project(
+            project_list=[filename],
+            cflags=cflags,
+            use_cache=False,
+            save_to_cache=False,
+            stop_on_error=False)
+    except Exception as e:
+        print(e)
+        return None
+
+    for name, stat in ast_cache.stat_files(
+            [os.path.abspath(name) for name in db['files']]).items():
+        dependencies.setdefault(name, stat)
+
+    entry = {'db': db, 'dependencies': dependencies, 'traversers': {}}
+    with mockup_lock:
+        mockup_dbs[key] = entry
+        mockup_dbs.move_to_end(key)
+        while len(mockup_dbs) > MOCKUP_DB_CACHE_SIZE:
+            mockup_dbs.popitem(last=False)
+    return entry
 
 
 def get_implied_graph_cc(project, files, function="main", depth=2, cflags=""):
@@ -223,25 +347,11 @@ def get_implied_graph_cc(project, files, function="main", depth=2, cflags=""):
     # we only accept if |files| == 1, which is the case for
     # auto-mockup.
     if os.path.isfile(os.path.join(project, 'db.yaml')) and len(files) == 1:
-        path = '/'.join(__file__.split('/')[:-2])
-        args = [
-            'python',
-            path + '/scan_c_project.py',
-            f"--cflags='{cflags}'",
-            '--dont-save-to-cache',
-            '<to-be-filled-in-the-loop>'
-        ]
         target_files = {}
         targets = {}
         for file in files:
-            args[-1] = file
-            cmd = ' '.join(args)
-            data = subprocess.run(cmd, capture_output=True, shell=True, text=True)
-            le = data.stdout.find('files:')
-            if le > 0:
-                yaml_text = data.stdout[le:]
-                yaml_config = yaml.safe_load(yaml_text)
-
+            yaml_config = get_mockup_db(file, cflags)
+            if yaml_config:
                 try:
                     target_fn = yaml_config['functions'][function][0]
                 except:
@@ -249,10 +359,8 @@ def get_implied_graph_cc(project, files, function="main", depth=2, cflags=""):
                     fatal_error(function)
                     # import pdb; pdb.set_trace()
 
-                target_set = Traverser(
-                    target_file=target_fn,
-                    yaml_config=yaml_config,
-                ).traverse(target=function, depth=depth)
+                target_set = get_traverser(
+                    file, target_fn, cflags).traverse(target=function, depth=depth)
 
                 target_files.update({
                     n: yaml_config['functions'][n][0]
@@ -1,136 +1,569 @@
 # Copyright 2025 Claudionor N. Coelho Jr
 
 import os
+import queue
+import threading
 import time
 import concurrent.futures
+from collections import deque
 from functools import lru_cache
 
 import anthropic
+import openai
 from boltons.iterutils import backoff
 from langchain_anthropic import ChatAnthropic
-from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_core.messages import AIMessage
 from langchain_ollama import ChatOllama
 from langchain_openai import ChatOpenAI
 from langchain_openai import AzureChatOpenAI
 from requests.exceptions import HTTPError
 
+from .estimate_tokens import num_tokens_from_chars, num_tokens_from_messages
+from .rate_limiter import SharedRateLimiter, get_provider, get_retry_after
+from .replay import RECORD, ReplayModel, record_response
 from .utils import fatal_error
 
 MAX_TOKENS = int(os.getenv('UNITTENX_MAX_TOKENS', 8192))
 USE_RATE_LIMITER = int(os.getenv('UNITTENX_USE_RATE_LIMITER', 0))
 
-@lru_cache(maxsize=4)
-def get_model(model_name:str, temperature:float=0):
-    if USE_RATE_LIMITER:
-        rate_limiter = InMemoryRateLimiter(
-            requests_per_second=1,  # <-- Super slow! We can only make a request once every 10 seconds!!
-            check_every_n_seconds=0.1,  # Wake up every 100 ms to check whether allowed to make a request,
-            max_bucket_size=10,  # Controls the maximum burst size.
-        )
-    else:
-        rate_limiter = None
+# we do not know how many tokens the model will output, so we reserve this
+# many tokens and correct the bucket once we get the response.
+OUTPUT_TOKENS_ESTIMATE = int(os.getenv('UNITTENX_OUTPUT_TOKENS_ESTIMATE', 1024))
+
+# hedging: we only trust the p95 latency of a backend after this many samples.
+# before that, we hedge after UNITTENX_HEDGE_DELAY seconds (or timeout / 2).
+HEDGE_MIN_SAMPLES = int(os.getenv('UNITTENX_HEDGE_MIN_SAMPLES', 5))
+HEDGE_DELAY = float(os.getenv('UNITTENX_HEDGE_DELAY', 0))
+
+# circuit breaker: after this many consecutive failures, a backend is not
+# used for UNITTENX_CIRCUIT_BREAKER_COOLDOWN seconds.
+CIRCUIT_BREAKER_FAILURES = int(os.getenv('UNITTENX_CIRCUIT_BREAKER_FAILURES', 3))
+CIRCUIT_BREAKER_COOLDOWN = float(os.getenv('UNITTENX_CIRCUIT_BREAKER_COOLDOWN', 300))
+
+# model used when only the provider is given in model_name.
+DEFAULT_MODELS = {
+    'azure': 'gpt-4o',
+    'openai': 'gpt-4o',
+    'anthropic': 'claude-3-5-sonnet-20241022',
+}
+
+@lru_cache(maxsize=16)
+def get_model(model_name:str, temperature:float=0, max_tokens:int|None=None):
+    '''
+        Returns LangChain model. model_name is either a provider (openai,
+        anthropic, azure), or <provider>:<model> to pick a specific model
+        of the provider, or a model served by ollama. replay:<session file>
+        serves the responses recorded with UNITTENX_RECORD=<session file>.
+
+        :param model_name: model name.
+        :param temperature: model temperature.
+        :param max_tokens: maximum number of output tokens.
+
+        :return: LangChain model.
+    '''
+    if not max_tokens:
+        max_tokens = MAX_TOKENS
 
-    if model_name == "azure":
+    provider, _, model = model_name.partition(':')
+
+    if provider == "replay":
+        return ReplayModel(model)
+    elif provider == "azure":
+        deployment = model if model else DEFAULT_MODELS[provider]
         open_api_key = os.environ.get("AZURE_OPENAI_KEY", "")
         azure_endpoint = (
                 os.environ["AZURE_OPENAI_API_ENDPOINT"] +
-                "/openai/deployments/gpt-4o/chat/completions?"
+                f"/openai/deployments/{deployment}/chat/completions?"
                 "api-version=2024-02-15-preview"
         )
         return AzureChatOpenAI(
-            azure_deployment="gpt-4o",
+            azure_deployment=deployment,
             api_version=azure_endpoint,
             openai_api_key=open_api_key,
             temperature=temperature,
             max_retries=2,
-            max_tokens=MAX_TOKENS
+            max_tokens=max_tokens
         )
-    elif model_name == "openai":
+    elif provider == "openai":
         return ChatOpenAI(
             temperature=temperature,
-            model_name="gpt-4o",
-            max_tokens=MAX_TOKENS
+            model_name=model if model else DEFAULT_MODELS[provider],
+            max_tokens=max_tokens
         )
-    elif model_name == "anthropic":
+    elif provider == "anthropic":
         return ChatAnthropic(
             temperature=temperature,
-            model_name="claude-3-5-sonnet-20241022",
-            max_tokens=MAX_TOKENS,
-            rate_limiter=rate_limiter
+            model_name=model if model else DEFAULT_MODELS[provider],
+            max_tokens=max_tokens
         )
-    elif "ollama:" in model_name:
+    elif provider == "ollama" and model:
         return ChatOpenAI(
             base_url="http://localhost:11434/v1",
             temperature=temperature,
-            model_name=':'.join(model_name.split(':')[1:]),
+            model_name=model,
             api_key="ollama",
-            max_tokens=MAX_TOKENS,
-            rate_limiter=rate_limiter
+            max_tokens=max_tokens
         )
     else:
         return ChatOllama(
             temperature=temperature,
             model=model_name,
-            max_tokens=MAX_TOKENS
+            max_tokens=max_tokens
         )
 
+
+class BackendStats:
+    '''
+        Latency and failure tracking of one backend, shared by all
+        GetModel instances of this process.
+    '''
+
+    def __init__(self, name: str, max_samples: int=100):
+        self.name = name
+        self.latencies = deque(maxlen=max_samples)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def record_success(self, latency: float) -> None:
+        with self.lock:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= CIRCUIT_BREAKER_FAILURES:
+                print(f"... circuit breaker open for {self.name}")
+                self.open_until = time.time() + CIRCUIT_BREAKER_COOLDOWN
+
+    def is_available(self) -> bool:
+        '''
+            Returns False while the circuit breaker is open. Once the
+            cooldown expires, the backend gets one more chance (half-open).
+        '''
+        with self.lock:
+            return time.time() >= self.open_until
+
+    def p95(self) -> float | None:
+        '''
+            Returns 95th percentile of latencies or None if we do not
+            have enough samples.
+        '''
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+
+@lru_cache(maxsize=None)
+def get_backend_stats(backend: str) -> BackendStats:
+    return BackendStats(backend)
+
+
+@lru_cache(maxsize=8)
+def get_rate_limiter(model_name: str):
+    '''
+        Returns rate limiter shared by all processes for the provider of
+        model_name, or None if rate limiting is disabled.
+
+        :param model_name: model name (openai, anthropic, ...).
+
+        :return: SharedRateLimiter or None.
+    '''
+    if not USE_RATE_LIMITER or model_name.startswith('replay:'):
+        return None
+    return SharedRateLimiter(get_provider(model_name))
+
+
+def get_total_tokens(response):
+    '''
+        Returns input + output tokens reported by the provider.
+
+        :param response: LangChain message returned by the model.
+
+        :return: number of tokens or None if provider did not report it.
+    '''
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        return usage.get('total_tokens', None)
+    return None
+
+
+def content_to_text(content):
+    '''
+        Converts message content (string or list of content blocks) to text.
+
+        :param content: message content.
+
+        :return: text.
+    '''
+    if isinstance(content, list):
+        return ''.join(
+            c.get('text', '') if isinstance(c, dict) else str(c)
+            for c in content)
+    return content
+
+
+def format_messages(backend, messages):
+    '''
+        Prompt caching breakpoints (cache_control) are only understood by
+        Anthropic. Other providers cache prefixes automatically, so we just
+        join the content blocks back into a string for them.
+
+        :param backend: backend name.
+        :param messages: list of messages.
+
+        :return: list of messages for backend.
+    '''
+    if get_provider(backend) == 'anthropic' or not isinstance(messages, list):
+        return messages
+    result = []
+    for message in messages:
+        if isinstance(message, dict) and isinstance(message.get('content'), list):
+            message = dict(message, content=content_to_text(message['content']))
+        result.append(message)
+    return result
+
+
+def get_cache_usage(response):
+    '''
+        Returns prompt cache usage reported by the provider.
+
+        :param response: LangChain message returned by the model.
+
+        :return: (input tokens, cache read tokens, cache write tokens).
+    '''
+    usage = getattr(response, 'usage_metadata', None) or {}
+    details = usage.get('input_token_details', None) or {}
+    input_tokens = usage.get('input_tokens', 0)
+    cache_read = details.get('cache_read', None)
+    cache_write = details.get('cache_creation', None)
+    if cache_read is None and cache_write is None:
+        # older versions of langchain_anthropic only report it here.
+        metadata = getattr(response, 'response_metadata', None) or {}
+        raw_usage = metadata.get('usage', None) or {}
+        cache_read = raw_usage.get('cache_read_input_tokens', None)
+        cache_write = raw_usage.get('cache_creation_input_tokens', None)
+    return input_tokens, cache_read or 0, cache_write or 0
+
+
+def is_rate_limit_error(err):
+    '''
+        Checks if exception is a rate limit (429) or overloaded (529) error.
+
+        :param err: exception raised by the model.
+
+        :return: True if we should wait and retry.
+    '''
+    if isinstance(err, (anthropic.RateLimitError, openai.RateLimitError)):
+        return True
+    if isinstance(err, anthropic.APIStatusError):
+        return err.status_code in [429, 529]
+    if isinstance(err, HTTPError) and err.response is not None:
+        return err.response.status_code in [429, 529]
+    return False
+
+
 class GetModel():
+    '''
+        Invokes a model with retries, rate limiting and failover.
+
+        model_name may be an ordered, comma separated list of backends,
+        for example "anthropic,openai". The first available backend is
+        the primary. If it takes longer than its p95 latency, a hedged
+        duplicate request is sent to the next backend, and the first good
+        answer wins. If it fails, we fail over to the next backend.
+        Backends that keep failing are circuit broken for a while.
+    '''
+
     def __init__(
             self,
             model_name: str,
             temperature:float=0,
             max_retries:int=5,
             backoff_factor:int=2,
-            timeout:int=60):
+            timeout:int=60,
+            max_tokens:int|None=None):
         self.max_retries = max_retries
         self.backoff_factor = backoff_factor
         self.timeout = timeout
         self.model_name = model_name
-        self.model = get_model(model_name, temperature)
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.backends = [b.strip() for b in model_name.split(',') if b.strip()]
+        self.model = get_model(self.backends[0], temperature, max_tokens)
+
+    def get_backend_model(self, backend):
+        return get_model(backend, self.temperature, self.max_tokens)
+
+    def available_backends(self):
+        '''
+            Returns backends in order of preference, skipping the ones with
+            open circuit breakers. If all are broken, we try all of them anyway.
+        '''
+        backends = [
+            b for b in self.backends if get_backend_stats(b).is_available()]
+        return backends if backends else self.backends
+
+    def hedge_delay(self, backend):
+        '''
+            Time to wait for backend before sending a hedged request.
+        '''
+        p95 = get_backend_stats(backend).p95()
+        if p95 is not None:
+            return p95
+        if HEDGE_DELAY > 0:
+            return HEDGE_DELAY
+        return self.timeout / 2
+
+    def rate_limit_wait_time(self, backend, err, retries):
+        '''
+            Computes how long to wait after a 429/529. If we have a shared
+            rate limiter, all processes slow down, and we honor retry-after.
+
+            :param backend: backend that returned the error.
+            :param err: rate limit exception.
+            :param retries: number of retries so far.
+
+            :return: wait time in seconds.
+        '''
+        retry_after = get_retry_after(err)
+        rate_limiter = get_rate_limiter(backend)
+        if rate_limiter:
+            return rate_limiter.on_rate_limit(retry_after)
+        if retry_after is not None:
+            return retry_after
+        return self.backoff_factor ** retries
+
+    def call_backend(self, backend, *largs, **kwargs):
+        '''
+            Calls one backend, going through its rate limiter.
+
+            :param backend: backend name.
+
+            :return: model response and its latency.
+        '''
+        rate_limiter = get_rate_limiter(backend)
+        estimated_tokens = 0
+        if rate_limiter:
+            estimated_tokens = (
+                num_tokens_from_messages(largs[0]) + OUTPUT_TOKENS_ESTIMATE)
+            rate_limiter.acquire(estimated_tokens)
+        largs = (format_messages(backend, largs[0]),) + largs[1:]
+        start_time = time.time()
+        response = self.get_backend_model(backend).invoke(*largs, **kwargs)
+        latency = time.time() - start_time
+        input_tokens, cache_read, cache_write = get_cache_usage(response)
+        if cache_read or cache_write:
+            print(
+                f"... {backend}: input tokens: {input_tokens}, "
+                f"cache read tokens: {cache_read}, "
+                f"cache write tokens: {cache_write}")
+        if rate_limiter:
+            actual_tokens = get_total_tokens(response)
+            if actual_tokens is None:
+                actual_tokens = estimated_tokens
+            rate_limiter.record_usage(estimated_tokens, actual_tokens)
+        return response, latency
+
+    def hedged_invoke(self, *largs, **kwargs):
+        '''
+            Sends request to the primary backend, and hedges or fails over
+            to the next backends. The first good answer wins.
+
+            :return: model response.
+        '''
+        backends = self.available_backends()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(backends))
+        pending = {}
+        last_error = None
+        deadline = time.time() + self.timeout
+        next_backend = 0
+        hedge_time = 0.0
+
+        def start_next():
+            nonlocal next_backend, hedge_time
+            backend = backends[next_backend]
+            next_backend += 1
+            if next_backend > 1:
+                print(f"... sending request to {backend}")
+            future = executor.submit(self.call_backend, backend, *largs, **kwargs)
+            pending[future] = backend
+            hedge_time = time.time() + self.hedge_delay(backend)
+
+        try:
+            start_next()
+            while pending:
+                now = time.time()
+                if now >= deadline:
+                    for backend in pending.values():
+                        get_backend_stats(backend).record_failure()
+                    raise concurrent.futures.TimeoutError()
+                wait_time = deadline - now
+                if next_backend < len(backends):
+                    wait_time = max(0.0, min(wait_time, hedge_time - now))
+                done, _ = concurrent.futures.wait(
+                    pending, timeout=wait_time,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    backend = pending.pop(future)
+                    try:
+                        response, latency = future.result()
+                    except Exception as err:
+                        print(f"... {backend} failed: {err}")
+                        get_backend_stats(backend).record_failure()
+                        if is_rate_limit_error(err):
+                            self.rate_limit_wait_time(backend, err, 0)
+                        # invoke waits on the rate limiter of this backend.
+                        err.backend = backend
+                        last_error = err
+                    else:
+                        # only the winner is counted and recorded, as the
+                        # agent never sees the other responses.
+                        get_backend_stats(backend).record_success(latency)
+                        if RECORD:
+                            record_response(
+                                RECORD, backend, format_messages(backend, largs[0]),
+                                content_to_text(response.content))
+                        return response
+                if next_backend < len(backends) and (
+                        not pending or time.time() >= hedge_time):
+                    # either everybody failed (failover) or the request
+                    # is taking longer than p95 (hedging).
+                    start_next()
+        finally:
+            # do not wait for the slower backends.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        raise last_error
+
+    def stream(self, messages, should_stop=None):
+        '''
+            Streams the response of the first available backend, and stops
+            reading it as soon as should_stop returns True. If streaming
+            fails, we fall back to invoke (with retries and failover).
+
+            :param messages: list of messages.
+            :param should_stop: function(text received so far) -> bool.
+
+            :return: AIMessage with the text received.
+        '''
+        backend = self.available_backends()[0]
+        rate_limiter = get_rate_limiter(backend)
+        if rate_limiter:
+            estimated_tokens = (
+                num_tokens_from_messages(messages) + OUTPUT_TOKENS_ESTIMATE)
+            rate_limiter.acquire(estimated_tokens)
+
+        chunks = queue.Queue()
+        stop = threading.Event()
+        model = self.get_backend_model(backend)
+        backend_messages = format_messages(backend, messages)
+        # providers split token usage among chunks (input tokens in the
+        # first one, output tokens in the last one).
+        usage = {'total_tokens': 0, 'finished': False}
+
+        def consume():
+            try:
+                iterator = model.stream(backend_messages)
+                try:
+                    for chunk in iterator:
+                        usage_metadata = getattr(chunk, 'usage_metadata', None)
+                        if usage_metadata:
+                            usage['total_tokens'] += usage_metadata.get('total_tokens', 0)
+                        chunks.put(content_to_text(chunk.content))
+                        if stop.is_set():
+                            break
+                finally:
+                    # closing the generator closes the connection.
+                    iterator.close()
+            except Exception as err:
+                chunks.put(err)
+            chunks.put(None)
+
+        start_time = time.time()
+        threading.Thread(target=consume, daemon=True).start()
+
+        text = ''
+        try:
+            while True:
+                remaining = start_time + self.timeout - time.time()
+                try:
+                    chunk = chunks.get(timeout=max(0.0, remaining))
+                except queue.Empty:
+                    raise concurrent.futures.TimeoutError()
+                if chunk is None:
+                    usage['finished'] = True
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                text += chunk
+                if should_stop and should_stop(text):
+                    print(f"... stopped streaming from {backend} after {len(text)} characters")
+                    break
+        except Exception as err:
+            stop.set()
+            print(f"... streaming from {backend} failed: {err}")
+            get_backend_stats(backend).record_failure()
+            if is_rate_limit_error(err):
+                self.rate_limit_wait_time(backend, err, 0)
+            return self.invoke(messages)
+
+        stop.set()
+        get_backend_stats(backend).record_success(time.time() - start_time)
+        if RECORD:
+            record_response(RECORD, backend, backend_messages, text)
+        if rate_limiter:
+            if usage['finished'] and usage['total_tokens']:
+                actual_tokens = usage['total_tokens']
+            else:
+                # we stopped before the provider reported usage.
+                actual_tokens = (
+                    num_tokens_from_messages(messages) + num_tokens_from_chars(text))
+            rate_limiter.record_usage(estimated_tokens, actual_tokens)
+        return AIMessage(content=text)
 
     def invoke(self, *largs, **kwargs):
         try:
             start_time = time.time()
             retries = 0
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(self.model.invoke, *largs, **kwargs)
-                while retries < self.max_retries:
-                    try:
-                        return future.result(timeout=self.timeout)
-                    except concurrent.futures.TimeoutError:
-                        elapsed_time = time.time() - start_time
-                        if elapsed_time > self.timeout:
-                            print("Timeout reached. Stopping retries.")
-                            fatal_error(self.model_name)
-                        retries += 1
-                        wait_time = self.backoff_factor ** retries
-                        print(f"Timeout error: retrying in {wait_time} seconds...")
-                        time.sleep(wait_time)
-                    except anthropic.RateLimitError:
-                        retries += 1
-                        wait_time = self.backoff_factor ** retries
-                        elapsed_time = time.time() - start_time
-                        if elapsed_time + wait_time > self.timeout:
-                            print("Timeout reached. Stopping retries.")
-                            fatal_error('exception in model')
-                        print(f"Rate limit error: retrying in {wait_time} seconds...")
-                        time.sleep(wait_time)
-                    except HTTPError as http_err:
-                        if http_err.response.status_code in [429, 529]:  # Rate limit error, internal error
-                            retries += 1
-                            wait_time = self.backoff_factor ** retries
-                            elapsed_time = time.time() - start_time
-                            if elapsed_time + wait_time > self.timeout:
-                                print("Timeout reached. Stopping retries.")
-                                fatal_error('exception in model')
-                            print(f"Rate limit error: retrying in {wait_time} seconds...")
-                            time.sleep(wait_time)
-                        else:
-                            print(f"HTTP error occurred: {http_err}")
-                            fatal_error('exception in model')
-                    except Exception as err:
+            while retries < self.max_retries:
+                try:
+                    return self.hedged_invoke(*largs, **kwargs)
+                except concurrent.futures.TimeoutError:
+                    elapsed_time = time.time() - start_time
+                    if elapsed_time > self.timeout:
+                        print("Timeout reached. Stopping retries.")
+                        fatal_error(self.model_name)
+                    retries += 1
+                    wait_time = self.backoff_factor ** retries
+                    print(f"Timeout error: retrying in {wait_time} seconds...")
+                    time.sleep(wait_time)
+                except Exception as err:
+                    if not is_rate_limit_error(err):
                         print(f"An error occurred: {err}")
                         fatal_error('exception in model')
+                    retries += 1
+                    # hedged_invoke already told the rate limiter of the
+                    # backend that failed.
+                    retry_after = get_retry_after(err)
+                    if get_rate_limiter(getattr(err, 'backend', self.backends[0])):
+                        # acquire() blocks until the bucket reopens.
+                        wait_time = 0
+                    elif retry_after is not None:
+                        wait_time = retry_after
+                    else:
+                        wait_time = self.backoff_factor ** retries
+                    elapsed_time = time.time() - start_time
+                    if elapsed_time + wait_time > self.timeout:
+                        print("Timeout reached. Stopping retries.")
+                        fatal_error('exception in model')
+                    print(f"Rate limit error: retrying in {wait_time:.1f} seconds...")
+                    time.sleep(wait_time)
         except Exception as err:
             fatal_error(err)
 
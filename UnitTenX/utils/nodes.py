@@ -6,21 +6,34 @@ import re
 import yaml
 from conda.plan import execute_plan
 
+from .batch import get_custom_id, write_request
+from .blobs import get_blob, put_blob, put_messages
 from .cpp_flatten import cpp_flatten
 from .estimate_tokens import num_tokens_from_string
 from .get_coverage import get_coverage_python
 from .get_coverage_cc import get_coverage_cc
-from .implied_graph import get_implied_graph_cc
+from .implied_graph import get_implied_graph_cc, get_mockup_db
 from .implied_graph import get_implied_graph_python
 from .symbolic import get_symbolic_test, parse_cex, has_symbolic_failed, get_extern_interface
+from .symbolic import ESBMC_TARGETED, get_targeted_symbolic_test, get_uncovered_lines
 from .interfaces import language_interfaces, is_c_cxx, is_python, is_c, is_cxx
-from .model import GetModel
+from .model import content_to_text
+from .prompt_assembler import assemble_source, get_token_budget
 from .prompts_anthropic import *
+from .reviews import compact_reviews
+from .routing import get_node_model, get_node_route
+from .slicer import slice_source
 #from .prompts import *
 from .utils import *
 
 DEBUG = int(os.getenv('DEBUG', 0))
 
+# stream unit-test responses and stop once the test code is complete.
+STREAMING = int(os.getenv('UNITTENX_STREAMING', 1))
+
+# number of characters of <explanation> we accept before stopping the stream.
+MAX_EXPLANATION = int(os.getenv('UNITTENX_MAX_EXPLANATION', 0))
+
 def get_extern_definition(text):
     '''
     Extracts dictionary from the following structure generated by the LLM.
@@ -129,6 +142,56 @@ def get_unit_test(text):
     }
 
 
+class StreamingTestCode:
+    '''
+        Incremental parser for streamed unit-test responses. The test code
+        within <test-code> is written to filename as it arrives, and we
+        tell the model to stop once </test-code> is closed, or once the
+        <explanation> goes past max_explanation characters.
+
+        The file is only a preview, as coverage will write the final test.
+    '''
+
+    s_test_code = '<test-code>'
+    e_test_code = '</test-code>'
+
+    def __init__(self, filename, max_explanation=MAX_EXPLANATION):
+        self.filename = filename
+        self.max_explanation = max_explanation
+        self.written = 0
+        with open(self.filename, 'w') as fp:
+            pass
+
+    def __call__(self, text):
+        '''
+            :param text: text received so far.
+
+            :return: True if we should stop streaming.
+        '''
+        le = text.find(self.s_test_code)
+        if le == -1:
+            return False
+        le += len(self.s_test_code)
+
+        ri = text.find(self.e_test_code, le)
+        if ri == -1:
+            # do not write what could be the beginning of </test-code>.
+            end = max(le, len(text) - len(self.e_test_code))
+        else:
+            end = ri
+
+        if le + self.written < end:
+            with open(self.filename, 'a') as fp:
+                fp.write(text[le + self.written:end])
+            self.written = end - le
+
+        if ri == -1:
+            return False
+
+        explanation = text[ri + len(self.e_test_code):]
+        return len(explanation) >= self.max_explanation
+
+
 def extract_core(text, is_json=False):
 
     '''
@@ -177,6 +240,27 @@ def extract_core(text, is_json=False):
     return text
 
 
+def cached_prompt(*sections):
+    '''
+        Builds the content of a user message from prompt sections, ordered
+        from the most stable to the least stable one. Each section but the
+        last one ends with a cache breakpoint, so that across iterations we
+        only pay full price for the sections that changed.
+
+        :param sections: formatted prompt sections.
+
+        :return: list of content blocks.
+    '''
+
+    content = []
+    for i, section in enumerate(sections):
+        block = {'type': 'text', 'text': section}
+        if i < len(sections) - 1:
+            block['cache_control'] = {'type': 'ephemeral'}
+        content.append(block)
+    return content
+
+
 # Define the function that determines whether to continue or not
 def should_continue(state):
     '''
@@ -187,7 +271,7 @@ def should_continue(state):
         :return: 'continue' or 'end'.
     '''
 
-    coverage_log = state.get("coverage_output", "")
+    coverage_log = get_blob(state.get("coverage_output", ""))
     number_of_iterations = state["number_of_iterations"]
     max_number_of_iterations = state["max_number_of_iterations"]
     if (
@@ -285,8 +369,7 @@ def implied_functions(state, config):
 
     declaration_lines = []
 
-    model_name = config.get('configurable', {}).get("model_name", "gpt-4o")
-    model = GetModel(model_name)
+    model = get_node_model(config, "implied_functions", state)
 
     if True:
         function_names = None
@@ -319,6 +402,13 @@ def implied_functions(state, config):
             f"Could not detect {name} in {','.join(source_files)} or we got " +
             "a compilation error.")
 
+    # source code goes into every prompt, so it has to fit in the
+    # smallest model used by the nodes after us.
+    budget = min(
+        get_token_budget(get_node_route(config, node, state, verbose=False)['model_name'])
+        for node in ["symbolic", "unit_test", "reflection"]
+    ) // max(1, len(source_files))
+
     # now read the files
     source_code = []
     for filename in source_files:
@@ -328,6 +418,14 @@ def implied_functions(state, config):
             elif is_c_cxx(language):
                 try:
                     source = cpp_flatten(filename, cflags, includes)
+                    # functions that are not in the closure of the target
+                    # only need their prototypes.
+                    mockup_db = None
+                    if os.path.isfile(os.path.join(project, "db.yaml")) and len(source_files) == 1:
+                        mockup_db = get_mockup_db(filename, cflags)
+                    if mockup_db and filename in mockup_db['files']:
+                        source = slice_source(
+                            source, filename, mockup_db['files'][filename], function_names)
                     if extern_interface["interface"]:
                         messages = [
                             {
@@ -362,6 +460,10 @@ def implied_functions(state, config):
                     source = open(filename, 'r').read()
                 source = '\n'.join([
                     s.rstrip() for s in source.split('\n') if s.strip()])
+                assembled_source = assemble_source(source, name, function_names, budget)
+                if assembled_source != source:
+                    print(f'... source code of {filename} reduced to fit in {budget} tokens')
+                    source = assembled_source
             else:
                 raise ValueError
         except:
@@ -374,7 +476,7 @@ def implied_functions(state, config):
         source_code.append(
             f'- file: {filename}\n```{language}\n{source}\n```\n')
     return {
-        'source_code': '\n'.join(source_code),
+        'source_code': put_blob('\n'.join(source_code)),
         'source_files': source_files,
         'language': language,
         'test_language': test_language,
@@ -399,7 +501,7 @@ def symbolic(state, config):
     '''
 
     language = state["language"]
-    source_code = state["source_code"]
+    source_code = get_blob(state["source_code"])
     source_files = state["source_files"]
     cflags = state.get("cflags", "")
     target_type = state["target_type"]
@@ -462,8 +564,19 @@ def symbolic(state, config):
         num_tokens = num_tokens_from_string(messages[-1]['content'])
         print(f'... number of tokens: {num_tokens}')
 
-        model_name = config.get('configurable', {}).get("model_name", "gpt-4o")
-        model = GetModel(model_name)
+        # in batch mode, the prompt is submitted together with the prompts
+        # of all other targets, and we resume from the batch result.
+        configurable = config.get("configurable", {})
+        if configurable.get("batch", "") == "prepare":
+            filename = write_request(
+                configurable["batch_dir"],
+                get_custom_id(work, name),
+                get_node_route(config, "symbolic", state),
+                messages)
+            print(f'... batch request written to {filename}')
+            return { 'test': '', "messages": put_messages(messages), "symbolic_test_cases": test_cases }
+
+        model = get_node_model(config, "symbolic", state)
         if DEBUG:
             print('-' * 80)
             print(messages[0]['content'])
@@ -483,7 +596,11 @@ def symbolic(state, config):
         test_cases = ""
         print(f'    symbolic engine not available to {language}')
 
-    return { 'test': output, "messages": messages, "symbolic_test_cases": test_cases }
+    return {
+        'test': put_blob(output),
+        "messages": put_messages(messages),
+        "symbolic_test_cases": test_cases
+    }
 
 
 # Define the function that generates unit test
@@ -505,7 +622,7 @@ def unit_test(state, config):
     print()
     print('entering unit-test generation')
 
-    source_code = state["source_code"]
+    source_code = get_blob(state["source_code"])
     source_files = state["source_files"]
     language = state["language"]
     test_language = state["test_language"]
@@ -515,17 +632,17 @@ def unit_test(state, config):
     name = state["name"]
     function_names = state["function_names"]
     missing_coverage = state["missing_coverage"]
-    coverage_output = state["coverage_output"]
+    coverage_output = get_blob(state["coverage_output"])
     messages = state["messages"]
-    unit_test = state.get("test", "")
+    unit_test = get_blob(state.get("test", ""))
     with_messages = state["with_messages"]
     symbolic_test_cases = state["symbolic_test_cases"]
     extern_interface = state["extern_interface"]
+    work = state["work"]
 
-    if reviews:
-        reviews = yaml.safe_dump(list(reversed(reviews)))
-    else:
-        reviews = ''
+    # only the last reviews go verbatim, so that the prompt does not grow
+    # with the number of iterations.
+    reviews = compact_reviews(reviews, missing_coverage)
 
     if is_python(language):
         test_packages = []
@@ -739,44 +856,54 @@ def unit_test(state, config):
             "- You SHOULD NEVER test input and output messages.\n"
         )
 
-    #messages = messages + [ 
-    messages = [ 
-            { 
-                'role': 'user', 
-                'content': unit_test_prompt.format(
-                    target_type=target_type,
-                    name=name,
-                    test_language=test_language,
-                    language=language,
-                    test_interface=test_interface,
-                    source_code=source_code,
-                    missing_coverage=missing_coverage,
-                    coverage_output=coverage_output,
-                    additional_requirements=additional_requirements,
-                    with_messages=with_messages,
-                    unit_test=unit_test,
-                    function_names=yaml.safe_dump(list(function_names.keys())),
-                    review=reviews,
-                    test_cases=symbolic_test_cases)
+    prompt_args = dict(
+        target_type=target_type,
+        name=name,
+        test_language=test_language,
+        language=language,
+        test_interface=test_interface,
+        source_code=source_code,
+        missing_coverage=missing_coverage,
+        coverage_output=coverage_output,
+        additional_requirements=additional_requirements,
+        with_messages=with_messages,
+        unit_test=unit_test,
+        function_names=yaml.safe_dump(list(function_names.keys())),
+        review=reviews,
+        test_cases=symbolic_test_cases,
+        targeted_test_cases=state.get("targeted_test_cases", "") or "none")
+
+    # stable sections first, so that the provider can cache the prefix.
+    messages = [
+            {
+                'role': 'user',
+                'content': cached_prompt(
+                    unit_test_source_prompt.format(**prompt_args),
+                    unit_test_instructions_prompt.format(**prompt_args),
+                    unit_test_iteration_prompt.format(**prompt_args))
             }]
 
     # print(messages[-1]['content'])
     # input('wait:')
 
-    num_tokens = num_tokens_from_string(messages[-1]['content'])
+    num_tokens = num_tokens_from_string(content_to_text(messages[-1]['content']))
     print()
     print(f'... number of tokens: {num_tokens}')
 
     #print(messages[-1]['content'])
     #input('wait:')
 
-    model_name = config.get('configurable', {}).get("model_name", "gpt-4o")
-    model = GetModel(model_name)
+    model = get_node_model(config, "unit_test", state)
     if DEBUG:
         print('-' * 80)
-        print(messages[0]['content'])
+        print(content_to_text(messages[0]['content']))
         if DEBUG >= 2: input('<unit-test-prompt> continue:')
-    response = model.invoke(messages)
+    if STREAMING:
+        extension = "py" if is_python(language) else "cc"
+        test_stream = StreamingTestCode(f'{work}/test_{name}.{extension}')
+        response = model.stream(messages, should_stop=test_stream)
+    else:
+        response = model.invoke(messages)
 
     js = get_unit_test(response.content)
 
@@ -802,7 +929,7 @@ def unit_test(state, config):
         print('-' * 80)
         if DEBUG >= 2: input('<unit-test-result> continue:')
 
-    return { "test": output, "messages": messages + [response] }
+    return { "test": put_blob(output), "messages": put_messages(messages + [response]) }
 
 
 # Define the function that calls the model
@@ -823,44 +950,46 @@ def reflection(state, config):
     number_of_iterations = state["number_of_iterations"]
     target_type = state["target_type"]
     name = state["name"]
-    source_code = state["source_code"]
-    coverage_output = state["coverage_output"]
-    unit_test = state["test"]
+    source_code = get_blob(state["source_code"])
+    coverage_output = get_blob(state["coverage_output"])
+    unit_test = get_blob(state["test"])
     reviews = state["review"]
     function_names = state["function_names"]
     messages = state["messages"]
     test_language = state["test_language"]
+    missing_coverage = state["missing_coverage"]
 
-    if reviews:
-        reviews = yaml.safe_dump(list(reversed(reviews)))
-    else:
-        reviews = ''
+    reviews = compact_reviews(reviews, missing_coverage)
+
+    prompt_args = dict(
+        test_language=test_language,
+        target_type=target_type,
+        name=name,
+        source_code=source_code,
+        coverage_output=coverage_output,
+        function_names=yaml.safe_dump(list(function_names.keys())),
+        unit_test=unit_test,
+        reviews=reviews)
 
-    #messages = messages + [
+    # stable sections first, so that the provider can cache the prefix.
     messages = [
-            { 
-                'role': 'user', 
-                'content': reflection_prompt.format(
-                    test_language=test_language,
-                    target_type=target_type,
-                    name=name,
-                    source_code=source_code,
-                    coverage_output=coverage_output,
-                    function_names=yaml.safe_dump(list(function_names.keys())),
-                    unit_test=unit_test,
-                    reviews=reviews)
+            {
+                'role': 'user',
+                'content': cached_prompt(
+                    reflection_source_prompt.format(**prompt_args),
+                    reflection_instructions_prompt.format(**prompt_args),
+                    reflection_iteration_prompt.format(**prompt_args))
             }]
 
-    num_tokens = num_tokens_from_string(messages[-1]['content'])
+    num_tokens = num_tokens_from_string(content_to_text(messages[-1]['content']))
     print(f'... number of tokens: {num_tokens}')
     print()
 
     if DEBUG:
         print('-' * 80)
-        print(messages[-1]['content'])
+        print(content_to_text(messages[-1]['content']))
         if DEBUG >= 2: input('<reflection-prompt> continue:')
-    model_name = config.get('configurable', {}).get("model_name", "gpt-4o")
-    model = GetModel(model_name)
+    model = get_node_model(config, "reflection", state)
     response = model.invoke(messages)
     # OpenAI extracts the JSON file, other models do not.
 
@@ -889,7 +1018,7 @@ def reflection(state, config):
     return {
             "number_of_iterations": number_of_iterations + 1, 
             "review": reviews,
-            "messages": messages + [response]
+            "messages": put_messages(messages + [response])
            }
 
 
@@ -908,7 +1037,7 @@ def coverage(state, config):
     print('entering coverage hole extraction')
     print()
 
-    test = state["test"]
+    test = get_blob(state["test"])
     # reviews = state["review"]
     name = state["name"]
     src_dir = state["project"]
@@ -920,6 +1049,7 @@ def coverage(state, config):
     work = state["work"]
     ssh = state.get("ssh", "")
     max_number_of_iterations = state["max_number_of_iterations"]
+    failed_compilations = state.get("failed_compilations", 0)
     declaration_lines = state["declaration_lines"]
 
     if is_python(language):
@@ -977,6 +1107,7 @@ def coverage(state, config):
             message = 'YOU MUST FIX THIS CORE DUMP TO PROCEED AT LEAST COMMENTING OUT THE FAILING TEST.'
         else:
             message = 'YOU MUST FIX THIS ERROR FROM THIS LOG'
+            failed_compilations += 1
         coverage_log = message + ':\n\n' + coverage_log
         # if there is a critical test error that does not enable us to computer coverage,
         # disregard this iteration by increasing the number of maximum iterations.
@@ -994,8 +1125,74 @@ def coverage(state, config):
         missing_coverage = ''
 
     return {
-            "test": test,
-            "coverage_output": coverage_log,
+            "test": put_blob(test),
+            "coverage_output": put_blob(coverage_log),
             "missing_coverage": missing_coverage,
-            "max_number_of_iterations": max_number_of_iterations
+            "max_number_of_iterations": max_number_of_iterations,
+            "failed_compilations": failed_compilations
            }
+
+
+# Define the function that sends the coverage holes back to the symbolic engine
+def targeted_symbolic(state, config):
+    '''
+        Asks the symbolic engine for inputs reaching the lines that are still
+        not covered, so that the next iteration does not need to guess them.
+
+        :param state: state of the agent.
+        :param config: configuration of agent.
+
+        :return: new state.
+    '''
+
+    language = state["language"]
+    source_files = state["source_files"]
+    cflags = state.get("cflags", "")
+    name = state["name"]
+    work = state["work"]
+    function_names = state["function_names"]
+    missing_coverage = state["missing_coverage"]
+    targeted_lines = state.get("targeted_lines", [])
+
+    if not ESBMC_TARGETED or not is_c(language):
+        return {}
+
+    filename = function_names.get(name, source_files[0])
+    lines = get_uncovered_lines(missing_coverage, filename)
+    if not lines:
+        return {"targeted_test_cases": ""}
+
+    # lines that esbmc already tried keep their test cases.
+    new_lines = [line for line in lines if line not in targeted_lines]
+    if not new_lines:
+        return {}
+
+    print('=' * 80)
+    print()
+    print(f'entering targeted symbolic engine for lines {",".join(map(str, lines))}')
+    print()
+
+    cex_list, logs, _ = get_targeted_symbolic_test(
+        filename=filename,
+        cflags=cflags,
+        target=name,
+        lines=lines,
+        work=work
+    )
+
+    logs = "\n\n".join(logs)
+    targeted_lines = targeted_lines + new_lines
+
+    if not cex_list or has_symbolic_failed(logs):
+        print("  ... could not reach uncovered lines symbolically.")
+        if logs: print(logs)
+        return {"targeted_lines": targeted_lines, "targeted_test_cases": ""}
+
+    test_cases = parse_cex(cex_list).replace("'", '')
+
+    print(test_cases)
+
+    return {
+        "targeted_lines": targeted_lines,
+        "targeted_test_cases": test_cases
+    }
@@ -0,0 +1,342 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import os
+import re
+
+try:
+    from .estimate_tokens import num_tokens_from_chars
+    from .model import DEFAULT_MODELS
+    from .rate_limiter import get_provider
+except:
+    from estimate_tokens import num_tokens_from_chars
+    from model import DEFAULT_MODELS
+    from rate_limiter import get_provider
+
+# number of tokens of source code we put in the prompts for each model.
+# the rest of the context is left for instructions, test code and output.
+MODEL_TOKEN_BUDGET = {
+    'claude-3-5-sonnet-20241022': 100000,
+    'claude-3-5-haiku-20241022': 100000,
+    'claude-3-opus-20240229': 100000,
+    'gpt-4o': 60000,
+    'gpt-4o-mini': 60000,
+    'gpt-4-turbo': 60000,
+    'gpt-4': 4000,
+    'gpt-3.5-turbo': 8000,
+    'llama3': 4000,
+    'llama3.1': 60000,
+}
+
+# budget of models not listed in MODEL_TOKEN_BUDGET, by provider.
+SOURCE_TOKEN_BUDGET = {
+    'anthropic': 100000,
+    'openai': 60000,
+    'azure': 60000,
+    'ollama': 12000,
+    'replay': 100000,
+}
+
+# overrides SOURCE_TOKEN_BUDGET for all models.
+SOURCE_TOKENS = int(os.getenv('UNITTENX_SOURCE_TOKENS', 0))
+
+C_KEYWORDS = set([
+    'auto', 'char', 'const', 'double', 'float', 'int', 'long', 'register',
+    'short', 'signed', 'static', 'unsigned', 'void', 'volatile', 'struct',
+    'union', 'enum', 'extern', 'inline', 'sizeof', 'return', 'if', 'while',
+    'for', 'switch', 'do', '_Bool', 'bool'
+])
+
+TYPE_KEYWORDS = ['typedef', 'struct', 'union', 'enum', 'class', 'namespace', 'template']
+
+# identifier followed by (, skipping keywords and attributes.
+CALL_RE = re.compile(r'\b([A-Za-z_]\w*)\s*\(')
+
+# name ( a, b, c ) <parameter declarations>
+KNR_RE = re.compile(
+    r'^[\w\s\*]*?\b([A-Za-z_]\w*)\s*\(\s*([A-Za-z_]\w*(?:\s*,\s*[A-Za-z_]\w*)*)\s*\)\s*(\w.*)$',
+    re.S)
+
+
+def resolve_model(model_name: str) -> str:
+    '''
+        Returns the model get_model uses for a backend.
+
+        :param model_name: model name (openai, anthropic:<model>, llama3, ...).
+
+        :return: model name without provider.
+    '''
+
+    provider, _, model = model_name.partition(':')
+    if provider == 'replay':
+        return ''
+    if provider not in DEFAULT_MODELS and provider != 'ollama':
+        # get_model sends anything else to ollama as is.
+        return model_name
+    return model or DEFAULT_MODELS.get(provider, '')
+
+
+def get_token_budget(model_name: str) -> int:
+    '''
+        Returns number of tokens of source code that fit in the prompt.
+        The budget of a model comes from MODEL_TOKEN_BUDGET, or from
+        SOURCE_TOKEN_BUDGET of its provider if the model is not listed.
+
+        :param model_name: model name or comma separated list of backends.
+
+        :return: token budget.
+    '''
+
+    if SOURCE_TOKENS:
+        return SOURCE_TOKENS
+    budgets = []
+    for backend in model_name.split(','):
+        backend = backend.strip()
+        model = resolve_model(backend)
+        if model in MODEL_TOKEN_BUDGET:
+            budgets.append(MODEL_TOKEN_BUDGET[model])
+            continue
+        provider = backend.split(':')[0]
+        if provider not in SOURCE_TOKEN_BUDGET:
+            provider = get_provider(backend)
+        budgets.append(SOURCE_TOKEN_BUDGET[provider])
+    return min(budgets)
+
+
+def strip_code(text: str) -> str:
+    '''
+        Removes line markers and comments from code.
+
+        :param text: code.
+
+        :return: code without line markers and comments.
+    '''
+
+    text = re.sub(r'/\*.*?\*/', ' ', text, flags=re.S)
+    text = re.sub(r'//[^\n]*', ' ', text)
+    return '\n'.join(
+        line for line in text.split('\n') if not line.lstrip().startswith('#'))
+
+
+def is_knr_header(header: str) -> bool:
+    '''
+        Checks if header is an old style (K&R) function header with its
+        parameter declarations, as in "int f(a, b) char *a; int b;".
+
+        :param header: code from the beginning of the chunk.
+
+        :return: True if header is a K&R function header.
+    '''
+
+    header = strip_code(header).strip()
+    match = KNR_RE.match(header)
+    if not match or '=' in header or '{' in header:
+        return False
+    parameters = [p.strip() for p in match.group(2).split(',')]
+    declarations = match.group(3)
+    if any(p in C_KEYWORDS for p in parameters):
+        return False
+    if declarations.startswith(('__attribute__', '__asm', 'asm', 'throw', 'const', 'noexcept')):
+        return False
+    return True
+
+
+def is_function_header(header: str) -> bool:
+    '''
+        Checks if the code before '{' is a function header.
+
+        :param header: code before '{'.
+
+        :return: True if we are entering a function body.
+    '''
+
+    text = strip_code(header).strip()
+    if not text or '=' in text.replace('==', ''):
+        return False
+    if text.endswith(')') or re.search(r'\)\s*(const|noexcept|override)\s*$', text):
+        return True
+    return text.endswith(';') and is_knr_header(text)
+
+
+def split_chunks(source: str) -> list[dict]:
+    '''
+        Splits C/C++ code into top level chunks (function definitions,
+        type definitions and declarations). Line markers and comments stay
+        attached to the chunk that follows them.
+
+        :param source: flattened source code.
+
+        :return: list of chunks {text, kind, name} in original order.
+    '''
+
+    chunks = []
+    start = 0
+    depth = 0
+    is_function = False
+    i = 0
+    n = len(source)
+
+    def add_chunk(end):
+        nonlocal start, is_function
+        text = source[start:end]
+        if text.strip():
+            chunks.append(make_chunk(text, is_function))
+        start = end
+        is_function = False
+
+    while i < n:
+        c = source[i]
+        if c in '"\'':
+            # skip string and character literals.
+            i += 1
+            while i < n and source[i] != c:
+                if source[i] == '\\':
+                    i += 1
+                i += 1
+        elif c == '/' and source[i + 1:i + 2] == '*':
+            end = source.find('*/', i + 2)
+            i = n if end < 0 else end + 1
+        elif c == '/' and source[i + 1:i + 2] == '/':
+            end = source.find('\n', i)
+            i = n if end < 0 else end
+        elif c == '#' and (i == 0 or source[i - 1] == '\n'):
+            end = source.find('\n', i)
+            i = n if end < 0 else end
+        elif c == '{':
+            if depth == 0:
+                is_function = is_function_header(source[start:i])
+            depth += 1
+        elif c == '}':
+            depth = max(0, depth - 1)
+            if depth == 0 and is_function:
+                add_chunk(i + 1)
+        elif c == ';' and depth == 0:
+            if not is_knr_header(source[start:i + 1]):
+                add_chunk(i + 1)
+        i += 1
+
+    if source[start:].strip():
+        chunks.append(make_chunk(source[start:], is_function))
+
+    return chunks
+
+
+def make_chunk(text: str, is_function: bool) -> dict:
+    '''
+        Classifies chunk of code.
+
+        :param text: code of chunk.
+        :param is_function: True if chunk is a function definition.
+
+        :return: chunk dictionary {text, kind, name}.
+    '''
+
+    code = strip_code(text).strip()
+    name = ''
+    if is_function:
+        kind = 'function'
+        header = code[:code.find('{')]
+        for match in CALL_RE.finditer(header):
+            if match.group(1) not in C_KEYWORDS and not match.group(1).startswith('__'):
+                name = match.group(1)
+                break
+    elif re.match(r'^(\w+\s+)*?(' + '|'.join(TYPE_KEYWORDS) + r')\b', code):
+        kind = 'type'
+    else:
+        kind = 'declaration'
+    return {'text': text, 'kind': kind, 'name': name}
+
+
+def get_call_distances(chunks: list[dict], target: str) -> dict:
+    '''
+        Computes call graph distance from target to every function in chunks.
+
+        :param chunks: list of chunks.
+        :param target: target function.
+
+        :return: dictionary function name -> distance.
+    '''
+
+    functions = set(c['name'] for c in chunks if c['kind'] == 'function')
+    callees = {}
+    for chunk in chunks:
+        if chunk['kind'] != 'function':
+            continue
+        body = strip_code(chunk['text'])
+        body = body[body.find('{'):]
+        callees.setdefault(chunk['name'], set()).update(
+            name for name in CALL_RE.findall(body)
+            if name in functions and name != chunk['name'])
+
+    distances = {target: 0}
+    frontier = [target]
+    while frontier:
+        next_frontier = []
+        for u in frontier:
+            for v in sorted(callees.get(u, [])):
+                if v not in distances:
+                    distances[v] = distances[u] + 1
+                    next_frontier.append(v)
+        frontier = next_frontier
+    return distances
+
+
+def assemble_source(source: str, target: str, function_names: dict | None, budget: int) -> str:
+    '''
+        Fits source code in a token budget. Chunks are picked in order of
+        priority (the target function, its callees by call graph distance,
+        then type definitions and declarations, then everything else), and
+        emitted in their original order. Chunks are never cut, and we stop
+        at the first chunk that does not fit, so a smaller chunk of lower
+        priority never takes the place of a larger one of higher priority.
+
+        :param source: flattened source code.
+        :param target: target function.
+        :param function_names: functions in the transitive closure of target.
+        :param budget: maximum number of tokens.
+
+        :return: source code that fits in budget.
+    '''
+
+    if num_tokens_from_chars(source) <= budget:
+        return source
+
+    chunks = split_chunks(source)
+    distances = get_call_distances(chunks, target)
+    max_distance = max(distances.values()) + 1
+    function_names = function_names or {}
+
+    def priority(index):
+        chunk = chunks[index]
+        if chunk['kind'] == 'function':
+            if chunk['name'] in distances:
+                return (0, distances[chunk['name']], index)
+            if chunk['name'] in function_names:
+                return (0, max_distance, index)
+            return (3, 0, index)
+        if chunk['kind'] == 'type':
+            return (1, 0, index)
+        return (2, 0, index)
+
+    selected = set()
+    omitted = []
+    used = 0
+    full = False
+    for index in sorted(range(len(chunks)), key=priority):
+        chunk = chunks[index]
+        tokens = num_tokens_from_chars(chunk['text'])
+        # the target is always included, even if it does not fit.
+        is_target = chunk['kind'] == 'function' and chunk['name'] == target
+        full = full or used + tokens > budget
+        if not full or is_target:
+            selected.add(index)
+            used += tokens
+        elif chunk['name']:
+            omitted.append(chunk['name'])
+
+    result = ''.join(chunks[i]['text'] for i in sorted(selected))
+    if len(selected) < len(chunks):
+        note = f'\n/* {len(chunks) - len(selected)} definitions omitted to fit in the prompt'
+        if omitted:
+            note += ', including functions ' + ', '.join(sorted(omitted))
+        result = result.rstrip() + note + ' */\n'
+    return result
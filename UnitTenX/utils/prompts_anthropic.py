@@ -159,48 +159,22 @@ Now output the test code following the requirements above. Do not include any pr
 """
 
 
-unit_test_prompt = """You are an expert software engineer specializing in cybersecurity, networking, and operating systems. You write automated unit tests for software in these domains to ensure the highest possible rating and reliability.
-
-Here are the current coverage holes:
-<coverage>
-```yaml
-{missing_coverage}
-```
-<coverage>
+unit_test_source_prompt = """You are an expert software engineer specializing in cybersecurity, networking, and operating systems. You write automated unit tests for software in these domains to ensure the highest possible rating and reliability.
 
 Here is the source code for which you need to generate unit tests:
 <code>
 {source_code}
 <code>
 
-Here are the attention functions:
+"""
+
+unit_test_instructions_prompt = """Here are the attention functions:
 <functions>
 ```yaml
 {function_names}
 ```
 </functions>
 
-Here is the current unit test:
-<unit-test>
-```{test_language}
-{unit_test}
-```
-</unit-test>
-
-Here is a code review:
-<review>
-```yaml
-{review}
-```
-</review>
-
-Here is the output from coverage:
-<coverage-log>
-```log
-{coverage_output}
-```
-</coverage-log>
-
 Here are the test directives:
 <test-directives>
 ```yaml
@@ -307,42 +281,66 @@ REMEMBER you MUST output the test program as a string without any preamble or po
     
 Ensure your output includes all required keys and does not include any additional keys. Ensure your output is valid format. The system will not work if the output you produce is invalid. Provide no preamble or postamble.
 
-Now return your response following all the provided instructions."""
+"""
+
+unit_test_iteration_prompt = """Here are the current coverage holes:
+<coverage>
+```yaml
+{missing_coverage}
+```
+<coverage>
 
-reflection_prompt = """You are an expert software engineer specializing in cybersecurity, networking, and operating systems. You review all tests written in `Current Unit Test` in these domains to recommend changes to the tests to increase the quality of the tests. The quality is measure in terms of a rating system.
+Here are inputs found by the symbolic engine that reach the coverage holes:
+<targeted-test-directives>
+```yaml
+{targeted_test_cases}
+```
+</targeted-test-directives>
 
-Here is the current unit test to review:
+Here is the current unit test:
 <unit-test>
 ```{test_language}
 {unit_test}
 ```
 </unit-test>
 
-Here are the attention functions:
-<fuctions>
+Here is a code review:
+<review>
 ```yaml
-{function_names}
+{review}
 ```
-</functions>
+</review>
+
+Here is the output from coverage:
+<coverage-log>
+```log
+{coverage_output}
+```
+</coverage-log>
+
+Now return your response following all the provided instructions."""
+
+unit_test_prompt = (
+    unit_test_source_prompt +
+    unit_test_instructions_prompt +
+    unit_test_iteration_prompt
+)
+
+reflection_source_prompt = """You are an expert software engineer specializing in cybersecurity, networking, and operating systems. You review all tests written in `Current Unit Test` in these domains to recommend changes to the tests to increase the quality of the tests. The quality is measure in terms of a rating system.
 
 Here is the relevant source code:
 <code>
 {source_code}
 </code>
 
-Here is the output from coverage:
-<coverage-output>
-```log
-{coverage_output}
-```
-</coverage-output>
+"""
 
-Here are previous code reviews:
-<reviews>
+reflection_instructions_prompt = """Here are the attention functions:
+<fuctions>
 ```yaml
-{reviews}
+{function_names}
 ```
-</reviews>
+</functions>
 
 {target_type}: {name}
 
@@ -419,4 +417,33 @@ Ensure to recommend coverage lines that the test should address by testing the f
 
 Ensure your output includes all required keys and does not include any additional keys. Ensure your output is valid JSON and be sure to escape characters appropriately. The system will not work if the JSON you produce is invalid. Provide no preamble or postamble.
 
+"""
+
+reflection_iteration_prompt = """Here is the current unit test to review:
+<unit-test>
+```{test_language}
+{unit_test}
+```
+</unit-test>
+
+Here is the output from coverage:
+<coverage-output>
+```log
+{coverage_output}
+```
+</coverage-output>
+
+Here are previous code reviews:
+<reviews>
+```yaml
+{reviews}
+```
+</reviews>
+
 Now output your review for the current unit test following the requirements above in the JSON object described."""
+
+reflection_prompt = (
+    reflection_source_prompt +
+    reflection_instructions_prompt +
+    reflection_iteration_prompt
+)
@@ -0,0 +1,257 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import os
+import sqlite3
+import time
+
+RATE_LIMITER_DB = os.getenv(
+    'UNITTENX_RATE_LIMITER_DB', '/tmp/unittenx/rate_limiter.db')
+
+# (requests per minute, tokens per minute) for each provider. These are
+# conservative defaults, and they can be overriden with UNITTENX_RPM and
+# UNITTENX_TPM.
+DEFAULT_LIMITS = {
+    'anthropic': (50, 40000),
+    'openai': (500, 30000),
+    'azure': (60, 30000),
+    'ollama': (600, 1000000),
+}
+
+# adaptive rate: multiplicative decrease on 429/529, additive increase
+# on every successful request.
+MIN_RATE = 0.05
+RATE_DECREASE = 0.5
+RATE_INCREASE = 0.05
+
+# how long we block the bucket if the provider does not send retry-after.
+DEFAULT_RETRY_AFTER = 10.0
+
+
+def get_provider(model_name: str) -> str:
+    '''
+        Maps model name to the provider whose limits apply.
+
+        :param model_name: model name (openai, anthropic, azure, ollama:<model>, ...).
+
+        :return: provider name.
+    '''
+
+    provider = model_name.split(':')[0]
+    if provider in DEFAULT_LIMITS:
+        return provider
+    # get_model sends anything else to ollama.
+    return 'ollama'
+
+
+def get_retry_after(err) -> float | None:
+    '''
+        Extracts retry-after header (in seconds) from an HTTP error.
+
+        :param err: exception raised by the provider client.
+
+        :return: seconds to wait or None if header is not present.
+    '''
+
+    response = getattr(err, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after', None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class SharedRateLimiter:
+    '''
+        Token bucket shared by all processes in the host through a
+        SQLite database. Each provider has two buckets, one for
+        requests and one for (input + output) tokens, both refilled
+        per minute. The refill rate is scaled by an adaptive factor
+        that shrinks every time the provider returns 429/529.
+    '''
+
+    def __init__(
+            self,
+            provider: str,
+            requests_per_minute: int | None = None,
+            tokens_per_minute: int | None = None,
+            db_path: str = RATE_LIMITER_DB,
+            check_every_n_seconds: float = 0.1):
+        default_rpm, default_tpm = DEFAULT_LIMITS.get(
+            provider, DEFAULT_LIMITS['ollama'])
+        self.provider = provider
+        self.requests_per_minute = float(
+            requests_per_minute or os.getenv('UNITTENX_RPM', default_rpm))
+        self.tokens_per_minute = float(
+            tokens_per_minute or os.getenv('UNITTENX_TPM', default_tpm))
+        self.db_path = db_path
+        self.check_every_n_seconds = check_every_n_seconds
+
+        dirname = os.path.dirname(db_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'provider TEXT PRIMARY KEY, '
+                'requests REAL, '
+                'tokens REAL, '
+                'rate REAL, '
+                'updated REAL, '
+                'blocked_until REAL)')
+
+    def _connect(self):
+        # isolation_level=None lets us issue BEGIN IMMEDIATE ourselves, which
+        # takes the database write lock and serializes all processes.
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def _update(self, update):
+        '''
+            Loads bucket, refills it, applies update and stores it back
+            in a single transaction.
+
+            :param update: function(bucket, now) that changes bucket in place
+                and returns a value.
+
+            :return: value returned by update.
+        '''
+
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            row = db.execute(
+                'SELECT requests, tokens, rate, updated, blocked_until '
+                'FROM buckets WHERE provider = ?', (self.provider,)).fetchone()
+            if row:
+                bucket = dict(zip(
+                    ['requests', 'tokens', 'rate', 'updated', 'blocked_until'],
+                    row))
+            else:
+                bucket = {
+                    'requests': self.requests_per_minute,
+                    'tokens': self.tokens_per_minute,
+                    'rate': 1.0,
+                    'updated': now,
+                    'blocked_until': 0.0
+                }
+
+            elapsed = max(0.0, now - bucket['updated'])
+            bucket['requests'] = min(
+                self.requests_per_minute,
+                bucket['requests'] +
+                elapsed * bucket['rate'] * self.requests_per_minute / 60)
+            bucket['tokens'] = min(
+                self.tokens_per_minute,
+                bucket['tokens'] +
+                elapsed * bucket['rate'] * self.tokens_per_minute / 60)
+            bucket['updated'] = now
+
+            result = update(bucket, now)
+
+            db.execute(
+                'INSERT OR REPLACE INTO buckets '
+                '(provider, requests, tokens, rate, updated, blocked_until) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self.provider, bucket['requests'], bucket['tokens'],
+                 bucket['rate'], bucket['updated'], bucket['blocked_until']))
+            db.execute('COMMIT')
+        except Exception:
+            # BEGIN IMMEDIATE may have failed (e.g. database is locked).
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+
+        return result
+
+    def try_acquire(self, tokens: int = 0) -> float:
+        '''
+            Tries to take one request and 'tokens' tokens from the buckets.
+
+            :param tokens: estimated number of tokens of the request.
+
+            :return: 0 if acquired, otherwise number of seconds to wait.
+        '''
+
+        # a request larger than the bucket would never be served.
+        tokens = min(tokens, self.tokens_per_minute)
+
+        def _acquire(bucket, now):
+            if now < bucket['blocked_until']:
+                return bucket['blocked_until'] - now
+            if bucket['requests'] >= 1 and bucket['tokens'] >= tokens:
+                bucket['requests'] -= 1
+                bucket['tokens'] -= tokens
+                return 0.0
+            requests_per_second = bucket['rate'] * self.requests_per_minute / 60
+            tokens_per_second = bucket['rate'] * self.tokens_per_minute / 60
+            return max(
+                (1 - bucket['requests']) / requests_per_second,
+                (tokens - bucket['tokens']) / tokens_per_second,
+                self.check_every_n_seconds)
+
+        return self._update(_acquire)
+
+    def acquire(self, tokens: int = 0) -> None:
+        '''
+            Blocks until one request and 'tokens' tokens are available.
+
+            :param tokens: estimated number of tokens of the request.
+        '''
+
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if wait_time <= 0:
+                return
+            time.sleep(max(self.check_every_n_seconds, wait_time))
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        '''
+            Corrects the token bucket after the response is received,
+            and slowly recovers the rate after a rate limit.
+
+            :param estimated_tokens: tokens taken at acquire time.
+            :param actual_tokens: tokens reported by the provider.
+        '''
+
+        def _record(bucket, now):
+            # this can leave the bucket negative, making others wait.
+            bucket['tokens'] += estimated_tokens - actual_tokens
+            bucket['rate'] = min(1.0, bucket['rate'] + RATE_INCREASE)
+
+        self._update(_record)
+
+    def on_rate_limit(self, retry_after: float | None = None) -> float:
+        '''
+            Slows down every process using this provider after a 429/529.
+
+            :param retry_after: value of retry-after header if present.
+
+            :return: number of seconds all processes will wait.
+        '''
+
+        if retry_after is None:
+            retry_after = DEFAULT_RETRY_AFTER
+
+        def _rate_limit(bucket, now):
+            bucket['rate'] = max(MIN_RATE, bucket['rate'] * RATE_DECREASE)
+            bucket['requests'] = min(bucket['requests'], 0.0)
+            bucket['blocked_until'] = max(
+                bucket['blocked_until'], now + retry_after)
+            return bucket['blocked_until'] - now
+
+        return self._update(_rate_limit)
+
+    def get_rate(self) -> float:
+        '''
+            Returns current adaptive rate factor (1.0 is the nominal rate).
+        '''
+
+        return self._update(lambda bucket, now: bucket['rate'])
@@ -0,0 +1,125 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# if set, every model response is appended to this session file, so that
+# it can be served later with --model_name=replay:<session file>.
+RECORD = os.getenv('UNITTENX_RECORD', '')
+
+# size of the chunks returned by ReplayModel.stream.
+REPLAY_CHUNK_SIZE = 256
+
+ROLES = {'human': 'user', 'ai': 'assistant'}
+
+lock = threading.Lock()
+
+
+def get_messages_key(messages) -> str:
+    '''
+        Hashes the prompt. Only roles and text matter, so the same prompt
+        has the same key for all backends (content blocks, cache_control
+        and message classes are ignored).
+
+        :param messages: list of messages (dictionaries or LangChain messages).
+
+        :return: sha256 of the prompt.
+    '''
+
+    if isinstance(messages, str):
+        messages = [{'role': 'user', 'content': messages}]
+
+    prompt = []
+    for message in messages:
+        if isinstance(message, dict):
+            role, content = message['role'], message['content']
+        else:
+            role, content = message.type, message.content
+        if isinstance(content, list):
+            content = ''.join(
+                c.get('text', '') if isinstance(c, dict) else str(c)
+                for c in content)
+        prompt.append([ROLES.get(role, role), content])
+
+    return hashlib.sha256(json.dumps(prompt).encode('utf-8')).hexdigest()
+
+
+def record_response(filename: str, model_name: str, messages, response: str) -> None:
+    '''
+        Appends response to session file.
+
+        :param filename: session file name.
+        :param model_name: backend that answered.
+        :param messages: prompt.
+        :param response: text of the response.
+    '''
+
+    entry = json.dumps({
+        'key': get_messages_key(messages),
+        'model_name': model_name,
+        'response': response
+    })
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    # one write per entry, so that agents running in parallel can share
+    # the session file.
+    with lock, open(filename, 'a') as fp:
+        fp.write(entry + '\n')
+
+
+@lru_cache(maxsize=4)
+def load_session(filename: str) -> dict:
+    '''
+        Loads session file.
+
+        :param filename: session file name.
+
+        :return: dictionary key -> list of responses in recorded order.
+    '''
+
+    session = {}
+    with open(filename, 'r') as fp:
+        for line in fp:
+            if line.strip():
+                entry = json.loads(line)
+                session.setdefault(entry['key'], []).append(entry['response'])
+    return session
+
+
+class ReplayModel:
+    '''
+        Serves responses recorded in a session file. If the same prompt
+        was recorded more than once, responses are returned in the order
+        they were recorded, and the last one is repeated afterwards.
+    '''
+
+    # number of times each key was served, shared by all instances.
+    served = {}
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def get_response(self, messages) -> str:
+        key = get_messages_key(messages)
+        responses = load_session(self.filename).get(key, None)
+        if not responses:
+            raise KeyError(
+                f'no recorded response for prompt {key[:16]} in {self.filename}')
+        with lock:
+            index = self.served.get((self.filename, key), 0)
+            self.served[(self.filename, key)] = index + 1
+        return responses[min(index, len(responses) - 1)]
+
+    def invoke(self, messages, *largs, **kwargs):
+        return AIMessage(content=self.get_response(messages))
+
+    def stream(self, messages, *largs, **kwargs):
+        response = self.get_response(messages)
+        for i in range(0, len(response), REPLAY_CHUNK_SIZE):
+            yield AIMessageChunk(content=response[i:i + REPLAY_CHUNK_SIZE])
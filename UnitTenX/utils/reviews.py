@@ -0,0 +1,118 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import os
+import re
+
+import yaml
+
+# number of most recent reviews we send verbatim to the model.
+MAX_REVIEWS = int(os.getenv('UNITTENX_MAX_REVIEWS', 2))
+
+# maximum number of items we keep from the older reviews.
+MAX_OPEN_ITEMS = int(os.getenv('UNITTENX_MAX_OPEN_ITEMS', 20))
+
+MISSING_LINES_RE = re.compile(r'could not reach lines:\s*([\d,\s]+)')
+ITEM_LINES_RE = re.compile(r'\blines?\s+(\d+(?:\s*(?:,|-|and|to|or)\s*\d+)*)', re.I)
+
+
+def get_missing_lines(missing_coverage: str) -> set[int]:
+    '''
+        Extracts line numbers from the missing coverage report.
+
+        :param missing_coverage: missing coverage (one entry per function).
+
+        :return: set of lines not covered.
+    '''
+
+    lines = set()
+    for match in MISSING_LINES_RE.finditer(missing_coverage or ''):
+        lines.update(int(n) for n in re.findall(r'\d+', match.group(1)))
+    return lines
+
+
+def get_item_lines(item: str) -> set[int]:
+    '''
+        Extracts line numbers mentioned in a review item, as in "cover
+        lines 12, 14 and 20" or "line 7".
+
+        :param item: review item.
+
+        :return: set of line numbers.
+    '''
+
+    lines = set()
+    for match in ITEM_LINES_RE.finditer(item):
+        text = match.group(1)
+        for le, ri in re.findall(r'(\d+)\s*(?:-|to)\s*(\d+)', text):
+            lines.update(range(int(le), int(ri) + 1))
+        lines.update(int(n) for n in re.findall(r'\d+', text))
+    return lines
+
+
+def normalize_item(item: str) -> str:
+    '''
+        Normalizes review item for deduplication.
+
+        :param item: review item.
+
+        :return: lower case item with only letters and digits.
+    '''
+
+    return ' '.join(re.findall(r'[a-z0-9_]+', item.lower()))
+
+
+def compact_reviews(
+        reviews: list,
+        missing_coverage: str = '',
+        max_reviews: int = MAX_REVIEWS,
+        max_open_items: int = MAX_OPEN_ITEMS) -> str:
+    '''
+        Bounds the size of the review history in the prompts. The last
+        max_reviews reviews are kept verbatim (most recent first). The items
+        of older reviews are merged into a single deduplicated list, where
+        we drop items that are repeated in the recent reviews and items
+        about lines that are now covered. The result only depends on the
+        inputs, so prompts stay cacheable.
+
+        :param reviews: list of reviews {review, summary, rating}.
+        :param missing_coverage: current missing coverage.
+        :param max_reviews: number of reviews kept verbatim.
+        :param max_open_items: maximum number of items from older reviews.
+
+        :return: yaml dump of reviews or '' if there are no reviews.
+    '''
+
+    if not reviews:
+        return ''
+
+    max_reviews = max(1, max_reviews)
+    recent = list(reversed(reviews[-max_reviews:]))
+    older = list(reversed(reviews[:-max_reviews]))
+
+    seen = set()
+    for review in recent:
+        for item in review.get('review', []):
+            seen.add(normalize_item(item))
+
+    missing_lines = get_missing_lines(missing_coverage)
+
+    open_items = []
+    for review in older:
+        for item in review.get('review', []):
+            key = normalize_item(item)
+            if key in seen:
+                continue
+            seen.add(key)
+            item_lines = get_item_lines(item)
+            if item_lines and not (item_lines & missing_lines):
+                # the lines this item is about were covered.
+                continue
+            open_items.append(item)
+
+    compacted = recent
+    if open_items:
+        compacted = compacted + [{
+            'open items from earlier reviews': open_items[:max_open_items]
+        }]
+
+    return yaml.safe_dump(compacted)
@@ -0,0 +1,136 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import os
+from functools import lru_cache
+
+import yaml
+
+from .model import GetModel
+
+# yaml file with per-node model routing (see load_routing).
+ROUTING = os.getenv('UNITTENX_ROUTING', '')
+
+
+@lru_cache(maxsize=4)
+def load_routing(filename: str) -> dict:
+    '''
+        Loads routing configuration. The configuration maps each graph node
+        to a model, and optionally lists stronger models to escalate to after
+        failed compilations. For example:
+
+            nodes:
+              implied_functions:
+                model_name: anthropic:claude-3-5-haiku-20241022
+                max_tokens: 2048
+              reflection:
+                model_name: openai:gpt-4o-mini
+                max_tokens: 1024
+              unit_test:
+                model_name: anthropic
+            escalation:
+              unit_test:
+                - anthropic:claude-3-7-sonnet-20250219
+                - model_name: openai:o3-mini
+                  max_tokens: 16384
+
+        Nodes not listed use --model_name with default temperature and
+        max_tokens.
+
+        :param filename: yaml file name or '' for no routing.
+
+        :return: routing dictionary.
+    '''
+
+    if not filename:
+        return {}
+
+    with open(filename, 'r') as fp:
+        routing = yaml.safe_load(fp) or {}
+
+    for key in routing:
+        if key not in ['nodes', 'escalation']:
+            raise ValueError(f'Invalid key {key} in routing file {filename}')
+
+    return routing
+
+
+def get_route(routing: dict, node: str, model_name: str, failed_compilations: int = 0) -> dict:
+    '''
+        Computes model name, temperature and max_tokens for node.
+
+        :param routing: routing dictionary from load_routing.
+        :param node: graph node name.
+        :param model_name: default model name.
+        :param failed_compilations: number of failed compilations so far.
+
+        :return: dictionary with model_name, temperature and max_tokens.
+    '''
+
+    route = {
+        'model_name': model_name,
+        'temperature': 0,
+        'max_tokens': None
+    }
+    route.update(routing.get('nodes', {}).get(node, None) or {})
+
+    escalation = routing.get('escalation', {}).get(node, None) or []
+    if failed_compilations and escalation:
+        stronger = escalation[min(failed_compilations, len(escalation)) - 1]
+        if isinstance(stronger, str):
+            stronger = {'model_name': stronger}
+        route.update(stronger)
+
+    return route
+
+
+def get_node_route(config, node: str, state=None, verbose: bool = True) -> dict:
+    '''
+        Returns the route (model name, temperature and max_tokens) of a
+        graph node.
+
+        :param config: configuration of agent.
+        :param node: graph node name.
+        :param state: state of the agent.
+        :param verbose: print model if it is not the default one.
+
+        :return: dictionary with model_name, temperature and max_tokens.
+    '''
+
+    configurable = config.get('configurable', {})
+    model_name = configurable.get("model_name", "gpt-4o")
+    routing = configurable.get("routing", None)
+    if routing is None:
+        routing = load_routing(ROUTING)
+
+    failed_compilations = 0
+    if state:
+        failed_compilations = state.get("failed_compilations", 0)
+
+    route = get_route(routing, node, model_name, failed_compilations)
+
+    if verbose and (route['model_name'] != model_name or route['max_tokens']):
+        message = f'... {node} using {route["model_name"]}'
+        if failed_compilations and routing.get('escalation', {}).get(node, None):
+            message += f' after {failed_compilations} failed compilation(s)'
+        print(message)
+
+    return route
+
+
+def get_node_model(config, node: str, state=None) -> GetModel:
+    '''
+        Returns the model to be used by a graph node.
+
+        :param config: configuration of agent.
+        :param node: graph node name.
+        :param state: state of the agent.
+
+        :return: GetModel.
+    '''
+
+    route = get_node_route(config, node, state)
+
+    return GetModel(
+        route['model_name'],
+        temperature=route['temperature'],
+        max_tokens=route['max_tokens'])
@@ -0,0 +1,557 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import json
+import os
+import shlex
+import shutil
+import signal
+import sqlite3
+import subprocess
+import threading
+import time
+from functools import lru_cache
+
+
+def parse_size(size: str) -> int:
+    '''
+        Converts sizes such as 512M or 4G to bytes.
+
+        :param size: size with optional K, M, G or T suffix.
+
+        :return: number of bytes.
+    '''
+
+    size = str(size).strip().upper().rstrip('B')
+    if not size:
+        return 0
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    if size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+# limits of each external tool (esbmc, make, test binaries). 0 means no
+# limit. The memory limit is the address space of each process, and the
+# number of processes counts all processes of the user (as in ulimit -u).
+SANDBOX_MEMORY = parse_size(os.getenv('UNITTENX_SANDBOX_MEMORY', '0'))
+SANDBOX_CPU_TIME = int(os.getenv('UNITTENX_SANDBOX_CPU_TIME', 0))
+SANDBOX_NPROC = int(os.getenv('UNITTENX_SANDBOX_NPROC', 0))
+
+# wall time in seconds after which the whole process group is killed.
+SANDBOX_TIMEOUT = float(os.getenv('UNITTENX_SANDBOX_TIMEOUT', 0))
+
+# cgroup v2 directory delegated to this user (for example, created with
+# systemd-run --user -p Delegate=yes). If set, each tool runs in its own
+# child cgroup with memory.max, cpu.max (UNITTENX_SANDBOX_CPUS cores) and
+# pids.max, so that the limits cover the tool and all its children.
+SANDBOX_CGROUP = os.getenv('UNITTENX_SANDBOX_CGROUP', '')
+SANDBOX_CPUS = float(os.getenv('UNITTENX_SANDBOX_CPUS', 0))
+
+# if set, the peak memory of every tool is appended to this file.
+SANDBOX_LOG = os.getenv('UNITTENX_SANDBOX_LOG', '')
+
+# memory shared by all tools running in the host at the same time. Tools
+# wait until their estimated peak memory fits (0 disables the scheduler).
+MEMORY_BUDGET = parse_size(os.getenv('UNITTENX_MEMORY_BUDGET', '0'))
+
+SANDBOX_DB = os.getenv('UNITTENX_SANDBOX_DB', '/tmp/unittenx/sandbox.db')
+
+# limits are set by prlimit (util-linux) if available, or by the ulimit
+# builtin of the shell, which cannot limit the number of processes.
+PRLIMIT = shutil.which('prlimit') or ''
+
+# estimate of tools we have not seen yet.
+DEFAULT_ESTIMATE = 512 << 20
+
+# estimates shrink slowly when tools use less memory than before.
+ESTIMATE_DECAY = 0.9
+
+
+class MemoryScheduler:
+    '''
+        Admits tools while the sum of their estimated peak memory fits in
+        the budget. Reservations and estimates are shared by all processes
+        in the host through a SQLite database (as in SharedRateLimiter).
+        The estimate of a kind of tool is the largest peak memory seen for
+        it, slowly decayed.
+    '''
+
+    def __init__(
+            self,
+            budget: int = MEMORY_BUDGET,
+            db_path: str = SANDBOX_DB,
+            default_estimate: int = DEFAULT_ESTIMATE,
+            check_every_n_seconds: float = 0.1):
+        self.budget = budget
+        self.db_path = db_path
+        self.default_estimate = default_estimate
+        self.check_every_n_seconds = check_every_n_seconds
+
+        dirname = os.path.dirname(db_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS reservations ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'pid INTEGER, '
+                'bytes INTEGER)')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS estimates ('
+                'kind TEXT PRIMARY KEY, '
+                'bytes INTEGER)')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def _update(self, update):
+        '''
+            Runs update(db) in a single transaction.
+
+            :param update: function(db) returning a value.
+
+            :return: value returned by update.
+        '''
+
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            result = update(db)
+            db.execute('COMMIT')
+        except Exception:
+            # BEGIN IMMEDIATE may have failed (e.g. database is locked).
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+
+        return result
+
+    def _get_estimate(self, db, kind):
+        row = db.execute(
+            'SELECT bytes FROM estimates WHERE kind = ?', (kind,)).fetchone()
+        return row[0] if row else self.default_estimate
+
+    def get_estimate(self, kind: str) -> int:
+        return self._update(lambda db: self._get_estimate(db, kind))
+
+    def try_acquire(self, kind: str, limit: int = 0) -> int | None:
+        '''
+            Reserves the estimated memory of kind if it fits in the budget.
+
+            :param kind: kind of tool (esbmc, make run, ...).
+            :param limit: memory limit of the tool, if any.
+
+            :return: reservation id, or None if it does not fit.
+        '''
+
+        def _acquire(db):
+            # reservations of processes that died are released.
+            for rid, pid in db.execute('SELECT id, pid FROM reservations').fetchall():
+                if not is_alive(pid):
+                    db.execute('DELETE FROM reservations WHERE id = ?', (rid,))
+
+            estimate = self._get_estimate(db, kind)
+            if limit:
+                estimate = min(estimate, limit)
+            used, count = db.execute(
+                'SELECT COALESCE(SUM(bytes), 0), COUNT(*) FROM reservations').fetchone()
+            # a tool larger than the budget runs alone.
+            if count and used + estimate > self.budget:
+                return None
+            cursor = db.execute(
+                'INSERT INTO reservations (pid, bytes) VALUES (?, ?)',
+                (os.getpid(), estimate))
+            return cursor.lastrowid
+
+        return self._update(_acquire)
+
+    def acquire(self, kind: str, limit: int = 0) -> int:
+        '''
+            Blocks until the estimated memory of kind fits in the budget.
+
+            :param kind: kind of tool.
+            :param limit: memory limit of the tool, if any.
+
+            :return: reservation id.
+        '''
+
+        while True:
+            rid = self.try_acquire(kind, limit)
+            if rid is not None:
+                return rid
+            time.sleep(self.check_every_n_seconds)
+
+    def release(self, rid: int, kind: str, peak_rss: int = 0) -> None:
+        '''
+            Releases reservation and learns the peak memory of kind.
+
+            :param rid: reservation id.
+            :param kind: kind of tool.
+            :param peak_rss: peak memory of the tool (0 if unknown).
+        '''
+
+        def _release(db):
+            db.execute('DELETE FROM reservations WHERE id = ?', (rid,))
+            if not peak_rss:
+                return
+            row = db.execute(
+                'SELECT bytes FROM estimates WHERE kind = ?', (kind,)).fetchone()
+            estimate = max(peak_rss, int(row[0] * ESTIMATE_DECAY)) if row else peak_rss
+            db.execute(
+                'INSERT OR REPLACE INTO estimates (kind, bytes) VALUES (?, ?)',
+                (kind, estimate))
+
+        self._update(_release)
+
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> MemoryScheduler | None:
+    if not MEMORY_BUDGET:
+        return None
+    return MemoryScheduler(MEMORY_BUDGET)
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def kill_group(pid: int) -> None:
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def get_sandbox_command(
+        cmd: str, memory: int = 0, cpu_time: int = 0, nproc: int = 0, cgroup: str = '') -> str:
+    '''
+        Wraps a shell command so that it sets its own limits and joins its
+        cgroup before running, as nothing can run in the child between fork
+        and exec when we have threads.
+
+        :param cmd: shell command.
+        :param memory: address space limit in bytes (0 is no limit).
+        :param cpu_time: cpu time limit in seconds (0 is no limit).
+        :param nproc: limit on the number of processes (0 is no limit).
+        :param cgroup: cgroup directory the command joins ('' is none).
+
+        :return: shell command.
+    '''
+
+    if cgroup:
+        procs = shlex.quote(os.path.join(cgroup, 'cgroup.procs'))
+        cmd = f'echo $$ > {procs} || exit 126; {cmd}'
+
+    if PRLIMIT:
+        options = []
+        if memory:
+            options.append(f'--as={memory}')
+        if cpu_time:
+            options.append(f'--cpu={cpu_time}')
+        if nproc:
+            options.append(f'--nproc={nproc}')
+        if options:
+            cmd = f'exec {PRLIMIT} {" ".join(options)} -- /bin/sh -c {shlex.quote(cmd)}'
+    else:
+        limits = []
+        if memory:
+            limits.append(f'ulimit -v {max(1, memory >> 10)}')
+        if cpu_time:
+            limits.append(f'ulimit -t {cpu_time}')
+        if limits:
+            cmd = ' && '.join(limits) + f' || exit 126; {cmd}'
+
+    return cmd
+
+
+class Sandbox:
+    '''
+        Runs a shell command in its own process group with resource limits.
+        The whole group is killed on timeout and when the command returns,
+        so that background processes (or fork bombs) do not survive it, and
+        the peak memory of the command is measured with wait4.
+    '''
+
+    def __init__(
+            self,
+            cmd: str,
+            kind: str = '',
+            cwd: str | None = None,
+            timeout: float = SANDBOX_TIMEOUT,
+            memory: int = SANDBOX_MEMORY,
+            cpu_time: int = SANDBOX_CPU_TIME,
+            nproc: int = SANDBOX_NPROC,
+            cgroup: str = SANDBOX_CGROUP,
+            **kwargs):
+        '''
+            Starts cmd.
+
+            :param cmd: shell command.
+            :param kind: kind of tool used by the memory scheduler and logs.
+            :param cwd: directory where cmd runs.
+            :param timeout: wall time in seconds (0 is no limit).
+            :param memory: address space limit in bytes (0 is no limit).
+            :param cpu_time: cpu time limit in seconds (0 is no limit).
+            :param nproc: limit on the number of processes (0 is no limit).
+            :param cgroup: delegated cgroup v2 directory ('' does not use it).
+            :param kwargs: arguments of subprocess.Popen (stdout, stderr, text, ...).
+        '''
+
+        self.cmd = cmd
+        self.kind = kind or cmd.split(' ')[0]
+        self.timeout = timeout
+        self.memory = memory
+        self.peak_rss = 0
+        self.timed_out = False
+        self.timer = None
+        self.rid = None
+        self.cgroup = ''
+        # the process group is only killed before its leader is reaped, as
+        # its id may be reused afterwards.
+        self.lock = threading.Lock()
+        self.reaped = False
+
+        self.scheduler = get_scheduler()
+        if self.scheduler:
+            self.rid = self.scheduler.acquire(self.kind, memory)
+
+        try:
+            if cgroup:
+                self.cgroup = create_cgroup(cgroup, memory, nproc)
+
+            self.start_time = time.time()
+            self.process = subprocess.Popen(
+                get_sandbox_command(cmd, memory, cpu_time, nproc, self.cgroup),
+                shell=True, cwd=cwd, start_new_session=True, **kwargs)
+        except:
+            self.release()
+            raise
+
+        if timeout:
+            self.timer = threading.Timer(timeout, self.expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def expire(self):
+        with self.lock:
+            if not self.reaped:
+                self.timed_out = True
+                kill_group(self.process.pid)
+
+    def kill(self):
+        with self.lock:
+            if not self.reaped:
+                kill_group(self.process.pid)
+
+    def wait(self) -> int:
+        '''
+            Waits for the command, kills what is left of its process group,
+            and releases its resources.
+
+            :return: return code.
+        '''
+
+        if self.process.returncode is not None:
+            return self.process.returncode
+
+        try:
+            # waits for the command to exit, but leaves it as a zombie, so
+            # that its process group id is not reused while we kill it.
+            os.waitid(os.P_PID, self.process.pid, os.WEXITED | os.WNOWAIT)
+            if self.timer:
+                self.timer.cancel()
+            with self.lock:
+                kill_group(self.process.pid)
+                self.reaped = True
+                # we reap the process ourselves, as Popen.wait does not return
+                # resource usage. maxrss covers the children the shell waited for.
+                _, status, rusage = os.wait4(self.process.pid, 0)
+            self.process.returncode = os.waitstatus_to_exitcode(status)
+            self.peak_rss = rusage.ru_maxrss * 1024
+        except ChildProcessError:
+            # someone else reaped it, so its group may be gone already.
+            with self.lock:
+                self.reaped = True
+            self.process.wait()
+        finally:
+            if self.timer:
+                self.timer.cancel()
+            self.kill()
+            if self.cgroup:
+                self.peak_rss = max(self.peak_rss, remove_cgroup(self.cgroup))
+            self.release()
+
+        if SANDBOX_LOG:
+            with open(SANDBOX_LOG, 'a') as fp:
+                fp.write(json.dumps({
+                    'kind': self.kind,
+                    'cmd': self.cmd,
+                    'returncode': self.process.returncode,
+                    'timed_out': self.timed_out,
+                    'peak_rss': self.peak_rss,
+                    'seconds': time.time() - self.start_time
+                }) + '\n')
+
+        return self.process.returncode
+
+    def release(self):
+        if self.rid is not None:
+            self.scheduler.release(self.rid, self.kind, self.peak_rss)
+            self.rid = None
+
+    def communicate(self, input: str | None = None) -> tuple:
+        '''
+            Reads stdout and stderr until the command finishes, as
+            Popen.communicate does, and waits for it.
+
+            :param input: data sent to stdin.
+
+            :return: stdout and stderr.
+        '''
+
+        output = {}
+
+        def read(name, stream):
+            output[name] = stream.read()
+            stream.close()
+
+        threads = []
+        for name in ['stdout', 'stderr']:
+            stream = getattr(self.process, name)
+            if stream:
+                threads.append(threading.Thread(target=read, args=(name, stream)))
+                threads[-1].start()
+
+        if self.process.stdin:
+            if input:
+                try:
+                    self.process.stdin.write(input)
+                except BrokenPipeError:
+                    pass
+            self.process.stdin.close()
+
+        for thread in threads:
+            thread.join()
+
+        self.wait()
+
+        return output.get('stdout', None), output.get('stderr', None)
+
+
+def create_cgroup(parent: str, memory: int, nproc: int) -> str:
+    '''
+        Creates a child cgroup of parent with the limits of a tool.
+
+        :param parent: delegated cgroup v2 directory.
+        :param memory: memory.max in bytes (0 is no limit).
+        :param nproc: pids.max (0 is no limit).
+
+        :return: cgroup directory, or '' if it could not be created.
+    '''
+
+    cgroup = os.path.join(
+        parent, f'unittenx-{os.getpid()}-{threading.get_ident()}-{time.time_ns()}')
+    settings = {
+        'memory.max': str(memory) if memory else 'max',
+        'memory.swap.max': '0' if memory else 'max',
+        'pids.max': str(nproc) if nproc else 'max',
+        'cpu.max': f'{int(SANDBOX_CPUS * 100000)} 100000' if SANDBOX_CPUS else 'max'
+    }
+
+    try:
+        os.mkdir(cgroup)
+    except OSError as e:
+        print(f'... could not create cgroup {cgroup}: {e}')
+        return ''
+
+    for name, value in settings.items():
+        try:
+            with open(os.path.join(cgroup, name), 'w') as fp:
+                fp.write(value)
+        except OSError:
+            # the controller is not enabled in parent.
+            pass
+
+    return cgroup
+
+
+def remove_cgroup(cgroup: str) -> int:
+    '''
+        Kills processes left in cgroup and removes it.
+
+        :param cgroup: cgroup directory.
+
+        :return: peak memory of cgroup (0 if the kernel does not report it).
+    '''
+
+    peak = 0
+    try:
+        with open(os.path.join(cgroup, 'memory.peak'), 'r') as fp:
+            peak = int(fp.read())
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open(os.path.join(cgroup, 'cgroup.kill'), 'w') as fp:
+            fp.write('1')
+    except OSError:
+        pass
+
+    # the cgroup can only be removed once the kernel reaps its processes.
+    for _ in range(50):
+        try:
+            os.rmdir(cgroup)
+            break
+        except FileNotFoundError:
+            break
+        except OSError:
+            time.sleep(0.01)
+
+    return peak
+
+
+def run_sandboxed(cmd: str, kind: str = '', cwd: str | None = None, input: str | None = None, **kwargs):
+    '''
+        Replaces subprocess.run(cmd, shell=True, capture_output=True, ...)
+        for external tools.
+
+        :param cmd: shell command.
+        :param kind: kind of tool used by the memory scheduler and logs.
+        :param cwd: directory where cmd runs.
+        :param input: data sent to stdin.
+        :param kwargs: limits of Sandbox and arguments of subprocess.Popen.
+
+        :return: completed process, with peak_rss (bytes) and timed_out.
+    '''
+
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+    sandbox = Sandbox(
+        cmd, kind=kind, cwd=cwd,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+    stdout, stderr = sandbox.communicate(input)
+
+    if sandbox.timed_out:
+        message = f'\nerror: {cmd} killed after {sandbox.timeout}s timeout\n'
+        if isinstance(stderr, bytes):
+            stderr += message.encode('utf-8')
+        else:
+            stderr = (stderr or '') + message
+
+    data = subprocess.CompletedProcess(cmd, sandbox.process.returncode, stdout, stderr)
+    data.peak_rss = sandbox.peak_rss
+    data.timed_out = sandbox.timed_out
+    return data
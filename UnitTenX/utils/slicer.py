@@ -0,0 +1,131 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import os
+import re
+
+# line marker emitted by the preprocessor: # <line> "<file>" <flags>
+MARKER_RE = re.compile(r'^#\s*(\d+)\s+"([^"]*)"')
+
+
+def is_same_file(f1: str, f2: str) -> bool:
+    '''
+        Checks if file names refer to the same file.
+
+        :param f1: file name.
+        :param f2: file name.
+
+        :return: True if they are the same file.
+    '''
+
+    if not f1 or not f2:
+        return False
+    return os.path.abspath(f1) == os.path.abspath(f2)
+
+
+def knr_to_prototype(header: str) -> str:
+    '''
+        Converts old style (K&R) function header to a prototype, as in
+        "int f(a, b) char *a; int b;" -> "int f(char *a, int b)".
+
+        :param header: function header without the body.
+
+        :return: header with typed parameters, or header if it is not K&R.
+    '''
+
+    le = header.find('(')
+    ri = header.find(')', le)
+    if le < 0 or ri < 0:
+        return header
+    declarations = header[ri + 1:].strip()
+    if not declarations.endswith(';'):
+        return header
+
+    parameters = [p.strip() for p in header[le + 1:ri].split(',') if p.strip()]
+    types = {}
+    for declaration in declarations.split(';'):
+        declaration = re.sub(r'\bregister\b', '', declaration).strip()
+        if not declaration:
+            continue
+        # "char *a, b[2]" -> base type "char", declarators "*a" and "b[2]"
+        declarators = declaration.split(',')
+        first = declarators[0]
+        words = re.findall(r'[A-Za-z_]\w*', re.sub(r'\[[^\]]*\]', '', first))
+        if len(words) < 2:
+            continue
+        le_declarator = min(
+            [first.find(c) for c in '*(' if first.find(c) >= 0] +
+            [first.rfind(words[-1])])
+        base = first[:le_declarator].strip()
+        declarators[0] = first[le_declarator:]
+        for declarator in declarators:
+            names = re.findall(r'[A-Za-z_]\w*', declarator)
+            if names:
+                types[names[0]] = f'{base} {declarator.strip()}'
+
+    typed = [types.get(p, f'int {p}') for p in parameters]
+    return header[:le + 1] + ', '.join(typed) + ')'
+
+
+def slice_source(source: str, filename: str, file_db: dict, keep) -> str:
+    '''
+        Replaces the body of functions defined in filename that are not in
+        keep by their prototypes. A line marker is added after each
+        prototype, so the lines that follow keep their original line
+        numbers.
+
+        :param source: preprocessed source code (with line markers).
+        :param filename: file whose functions we slice.
+        :param file_db: functions of filename from the project db
+            (function -> {coord: [first line, last line], ...}).
+        :param keep: function names whose bodies are kept.
+
+        :return: sliced source code.
+    '''
+
+    ranges = {}
+    for function, entry in file_db.items():
+        if function.endswith('__globals') or function in keep:
+            continue
+        first_line, last_line = entry['coord']
+        ranges[first_line] = (last_line, function)
+
+    if not ranges:
+        return source
+
+    lines = source.split('\n')
+    result = []
+    current_file = None
+    current_line = 0
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        match = MARKER_RE.match(line)
+        if match:
+            current_line = int(match.group(1))
+            current_file = match.group(2)
+            result.append(line)
+            i += 1
+            continue
+
+        if current_line in ranges and is_same_file(current_file, filename):
+            last_line, function = ranges[current_line]
+            body = lines[i:i + last_line - current_line + 1]
+            text = '\n'.join(body)
+            le = text.find('{')
+            if (
+                    len(body) == last_line - current_line + 1 and
+                    not any(MARKER_RE.match(b) for b in body) and
+                    le >= 0 and function in text[:le]
+            ):
+                header = ' '.join(text[:le].split())
+                result.append(knr_to_prototype(header) + ';')
+                result.append(f'# {last_line + 1} "{current_file}"')
+                i += len(body)
+                current_line = last_line + 1
+                continue
+
+        result.append(line)
+        current_line += 1
+        i += 1
+
+    return '\n'.join(result)
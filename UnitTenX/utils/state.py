@@ -13,6 +13,10 @@ class AgentState(TypedDict):
     # max number of iterations
     max_number_of_iterations: int
 
+    # number of iterations whose test failed to compile (used to escalate
+    # to stronger models)
+    failed_compilations: int
+
     # target_type for the unit test generation (test function or class)
     target_type: str
 
@@ -77,6 +81,10 @@ class AgentState(TypedDict):
     # symbolic test cases
     symbolic_test_cases: str
 
+    # test cases reaching lines still uncovered, and lines esbmc already tried
+    targeted_test_cases: str
+    targeted_lines: List[int]
+
     # external interface to assist LLM
     extern_interface: Dict[str, str | List[str]]
 
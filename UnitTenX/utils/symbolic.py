@@ -1,5 +1,9 @@
 # Copyright 2025 Claudionor N. Coelho Jr
 
+import concurrent.futures
+from copy import deepcopy
+import hashlib
+import json
 import os
 from argparse import ArgumentParser
 
@@ -7,6 +11,7 @@ from pycparser import parse_file, c_ast
 import pycparser_fake_libc
 import re
 import subprocess
+import threading
 import yaml
 
 try:
@@ -19,9 +24,63 @@ try:
 except:
     from cpp_flatten import cpp_flatten
 
+try:
+    from .ast_cache import parse
+except:
+    from ast_cache import parse
+
+try:
+    from .sandbox import Sandbox
+except:
+    from sandbox import Sandbox
+
 
 DEBUG = int(os.getenv('DEBUG', 0))
 
+# number of ESBMC passes of a target that run at the same time.
+ESBMC_JOBS = max(1, int(os.getenv('ESBMC_JOBS', 2)))
+
+# stops an esbmc pass after this many distinct counter-examples, or after
+# this many bytes of output (0 means no limit).
+ESBMC_MAX_CEX = int(os.getenv('ESBMC_MAX_CEX', 0))
+ESBMC_MAX_OUTPUT = int(os.getenv('ESBMC_MAX_OUTPUT', 64 * 1024 * 1024))
+
+# if set, the --multi-property pass is split in one esbmc job per property
+# class, each one with timeout ESBMC_PROPERTY_TIMEOUT (default ESBMC_TIMEOUT).
+ESBMC_SPLIT_PROPERTIES = int(os.getenv('ESBMC_SPLIT_PROPERTIES', 0))
+
+# default checks of esbmc (bounds, pointers, division by zero) only run in
+# the 'default' job.
+NO_DEFAULT_CHECKS = '--no-bounds-check --no-pointer-check --no-div-by-zero-check'
+
+ESBMC_PROPERTY_CHECKS = {
+    'default': '',
+    'overflow': f'{NO_DEFAULT_CHECKS} --overflow-check',
+    'memory-leak': f'{NO_DEFAULT_CHECKS} --memory-leak-check',
+    'struct-fields': f'{NO_DEFAULT_CHECKS} --struct-fields-check',
+    'ub-shift': f'{NO_DEFAULT_CHECKS} --ub-shift-check',
+    'unsigned-overflow': f'{NO_DEFAULT_CHECKS} --unsigned-overflow-check',
+}
+
+# comma separated list of configurations (see get_portfolio_configs) that
+# run at the same time for each esbmc pass. The first one to find
+# counter-examples wins, and it is tried first next time.
+ESBMC_PORTFOLIO = [
+    c.strip() for c in os.getenv('ESBMC_PORTFOLIO', '').split(',') if c.strip()]
+
+# if set, lines still uncovered after an iteration are turned into
+# reachability assertions, and esbmc looks for inputs reaching them.
+ESBMC_TARGETED = int(os.getenv('ESBMC_TARGETED', 1))
+
+# caches esbmc results in $UNIT_TENX_CACHE/esbmc (ESBMC_CACHE=0 disables it).
+ESBMC_CACHE = int(os.getenv('ESBMC_CACHE', 1))
+ESBMC_CACHE_VERSION = 1
+
+ESBMC_VERSION = None
+
+# (filename, cflags) -> (ast, interfaces of all functions in the ast)
+FILE_INTERFACES = {}
+
 def find_file_to_include(pattern, string_list, group=0):
     '''
         Finds first file included when pattern is found.
@@ -193,16 +252,17 @@ class ConstEval(c_ast.NodeVisitor):
         return self.visit(node)
 
 
-def get_function_interface(filename, target, cflags=""):
+def get_file_interfaces(filename, cflags=""):
 
     '''
-        Extract function parameters and local variables.
+        Extract parameters and local variables of all functions in a file
+        with a single walk of the AST.
 
         :param filename: Source file.
-        :param work: Work directory.
         :param cflags: Flags for compilation including -I and -D.
 
-        :return: module created.
+        :return: dictionary function -> interface (see get_interface), and
+                 '__globals' for the global variables used outside functions.
     '''
 
     from pycparser import c_parser, c_ast
@@ -276,64 +336,73 @@ def get_function_interface(filename, target, cflags=""):
         return 'unknown'
 
 
-    # Define a visitor class to extract function parameters and variable names
-    class FuncParamVisitor(c_ast.NodeVisitor):
-        _return_type = ''
-        _return_type_name = ''
-        _enable_visit = False
-        _global_vars = set()
-        _local_params = []
-        _func_params = []
-        _type_params = []
-        _decl_lines = []
-        _target = "main"
+    def empty_interface():
+        return {
+            'params': [],
+            'types': [],
+            'type_names': [],
+            'locals': [],
+            'global_vars': set(),
+            'return_type': '',
+            'return_type_name': '',
+            'decl_lines': [],
+            'error': None
+        }
+
+    # Define a visitor class that extracts parameters and variable names of
+    # all functions in a single walk of the AST
+    class FileInterfaceVisitor(c_ast.NodeVisitor):
 
         def __init__(self, all_global_vars):
-            self.enable_visit = False
             self.all_global_vars = all_global_vars
+            self.interfaces = {}
+            self.file_global_vars = set()
+            self.current = None
 
         def visit_FuncDef(self, node):
-            if self._target == node.decl.name:
-                self._return_type = get_type_name(node.decl.type.type)
-                self._return_type_name = get_only_type_name(node.decl.type.type)
-                if node.decl.type.args:
-                    for decl in node.decl.type.args.params:
-                        self._func_params.append(decl.name)
-                        try:
-                            self._type_params.append(
-                                (
-                                    get_type_name(decl.type),
-                                    get_only_type_name(decl.type)
-                                )
-                            )
-                        except:
-                            if isinstance(decl, c_ast.ID):
-                                self._type_params.append(
-                                    ( decl.name, decl.name )
-                                )
-                            else:
-                                print('--- ERROR ---')
-                                print(decl)
-                                fatal_error(self._target)
-                                # import pdb; pdb.set_trace()
-                if node.body.block_items:
-                    for item in node.body.block_items:
-                        self._local_params += self.get_local_vars("", item)
-                self.enable_visit = True
-                self.generic_visit(node)
-                self.enable_visit = False
+            name = node.decl.name
+            interface = self.interfaces.setdefault(name, empty_interface())
+            interface['return_type'] = get_type_name(node.decl.type.type)
+            interface['return_type_name'] = get_only_type_name(node.decl.type.type)
+            if node.decl.type.args:
+                for decl in node.decl.type.args.params:
+                    interface['params'].append(decl.name)
+                    try:
+                        type_param = (
+                            get_type_name(decl.type),
+                            get_only_type_name(decl.type)
+                        )
+                    except:
+                        if isinstance(decl, c_ast.ID):
+                            type_param = ( decl.name, decl.name )
+                        else:
+                            # only fatal if someone asks for this function.
+                            interface['error'] = decl
+                            continue
+                    interface['types'].append(type_param[0])
+                    interface['type_names'].append(type_param[1])
+            if node.body.block_items:
+                for item in node.body.block_items:
+                    interface['locals'] += self.get_local_vars("", item)
+            self.current = interface
+            self.generic_visit(node)
+            self.current = None
 
         def visit_Decl(self, node):
-            if self.enable_visit:
-                if node.coord.line not in self._decl_lines:
-                    self._decl_lines.append(node.coord.line)
+            if self.current is not None:
+                if node.coord.line not in self.current['decl_lines']:
+                    self.current['decl_lines'].append(node.coord.line)
             self.generic_visit(node)
 
         def visit_ID(self, node):
             try:
                 var_name = node.name
-                if var_name in self.all_global_vars and var_name not in self._global_vars:
-                    self._global_vars.add(var_name)
+                if var_name in self.all_global_vars:
+                    if self.current is not None:
+                        self.current['global_vars'].add(var_name)
+                    else:
+                        # used outside functions (initializers, sizes).
+                        self.file_global_vars.add(var_name)
             except:
                 pass
 
@@ -356,38 +425,14 @@ def get_function_interface(filename, target, cflags=""):
             else:
                 return []
 
-        def set_target(self, target):
-            self._target = target
-
-        def get_func_params(self):
-            return self._func_params
-
-        def get_type_params(self):
-            return [t[0] for t in self._type_params]
-
-        def get_type_names_params(self):
-            return [t[1] for t in self._type_params]
-
-        def get_local_params(self):
-            return self._local_params
-
-        def get_return_type(self):
-            return self._return_type
-
-        def get_return_type_name(self):
-            return self._return_type_name
-
-        def get_decl_lines(self):
-            return self._decl_lines
-
     cpp_args = create_cpp_args(cflags) + ['-E'] + ['-I' + pycparser_fake_libc.directory]
 
-    # Parse the C file
-    ast = parse_file(
-        filename, 
-        use_cpp=True,
-        cpp_path='clang',
-        cpp_args=cpp_args)
+    # Parse the C file (the AST is shared with other callers)
+    ast = parse(filename, cpp_args)
+
+    cached_ast, interfaces = FILE_INTERFACES.get((filename, cflags), (None, None))
+    if cached_ast is ast:
+        return interfaces
 
     def get_global_vars(ast):
         global_vars = set()
@@ -410,34 +455,66 @@ def get_function_interface(filename, target, cflags=""):
     global_vars, global_var_types = get_global_vars(ast)
 
     # Create a visitor instance and visit the AST
-    visitor = FuncParamVisitor(global_vars)
-    visitor.set_target(target)
+    visitor = FileInterfaceVisitor(global_vars)
     visitor.visit(ast)
 
-    func_params = visitor.get_func_params()
-    type_params = visitor.get_type_params()
-    type_names_params = visitor.get_type_names_params()
-    local_params = visitor.get_local_params()
-    return_type = visitor.get_return_type()
-    return_type_name = visitor.get_return_type_name()
-    decl_lines = visitor.get_decl_lines()
+    interfaces = visitor.interfaces
+    interfaces['__globals'] = empty_interface()
 
-    global_vars = list(visitor._global_vars)
-    function_global_var_types = [ global_var_types[n][0] for n in global_vars ]
-    function_global_var_type_names = [ global_var_types[n][1] for n in global_vars ]
+    for interface in interfaces.values():
+        function_global_vars = list(interface['global_vars'] | visitor.file_global_vars)
+        interface['global_vars'] = function_global_vars
+        interface['global_var_types'] = [
+            global_var_types[n][0] for n in function_global_vars ]
+        interface['global_var_type_names'] = [
+            global_var_types[n][1] for n in function_global_vars ]
+
+    FILE_INTERFACES[(filename, cflags)] = (ast, interfaces)
+
+    return interfaces
+
+
+def get_function_interface(filename, target, cflags=""):
+
+    '''
+        Extract function parameters and local variables.
+
+        :param filename: Source file.
+        :param target: Target function name.
+        :param cflags: Flags for compilation including -I and -D.
+
+        :return: interface of target.
+    '''
+
+    interfaces = get_file_interfaces(filename=filename, cflags=cflags)
+    return get_interface(interfaces, target)
+
+
+def get_interface(interfaces, target):
+    '''
+        Gets interface of a function from get_file_interfaces.
+
+        :param interfaces: interfaces of all functions in file.
+        :param target: Target function name.
+
+        :return: dictionary with params, types, type_names, locals,
+                 global_vars, global_var_types, global_var_type_names,
+                 return_type, return_type_name and decl_lines. If target is
+                 not defined in the file, only global variables used outside
+                 functions are returned.
+    '''
+
+    interface = interfaces.get(target, interfaces['__globals'])
+
+    if interface['error'] is not None:
+        print('--- ERROR ---')
+        print(interface['error'])
+        fatal_error(target)
+
+    interface = deepcopy(interface)
+    del interface['error']
+    return interface
 
-    return {
-        'params': func_params,
-        'types': type_params,
-        'type_names': type_names_params,
-        'locals': local_params,
-        'global_vars': global_vars,
-        'global_var_types': function_global_var_types,
-        'global_var_type_names': function_global_var_type_names,
-        'return_type': return_type,
-        'return_type_name': return_type_name,
-        'decl_lines': decl_lines
-    }
 
 def find_all_functions_using_static_globals(file_class, function, dont_use_static_functions=False):
     '''
@@ -497,13 +574,12 @@ def get_extern_interface(file_class, filename, target, cflags, includes):
 
     all_functions = find_all_functions_using_static_globals(file_class, target)
 
+    interfaces = get_file_interfaces(filename=filename, cflags=cflags)
+
     declaration_lines = set()
     functions_interface = []
     for f in all_functions + [target]:
-        params = get_function_interface(
-            filename=filename,
-            cflags=cflags,
-            target=f)
+        params = get_interface(interfaces, f)
 
         return_type = params["return_type"]
 
@@ -549,57 +625,113 @@ def get_extern_interface(file_class, filename, target, cflags, includes):
     return interface, list(declaration_lines), files_to_include
 
 
-def parse_examples(examples, params, cex_list=[], debug=0):
-
+def get_obj_key(obj):
     '''
-        Parse example file.
+        Computes hashable key of object, such that objects have the same
+        key if and only if is_same returns True.
 
-        :param examples: examples' file.
-        :param params: parameters to function (including locals).
-        :param cex_list: list of counter-examples.
-        :param debug: if > 0, print debug messages..
+        :param obj: object (dictionaries, lists and scalars).
 
-        :return: test values.
+        :return: hashable key.
     '''
 
-    drop_vars = ["goto_symex::guard"]
+    if isinstance(obj, dict):
+        return (dict, frozenset((k, get_obj_key(v)) for k, v in obj.items()))
+    elif isinstance(obj, list):
+        return (list, tuple(get_obj_key(v) for v in obj))
+    return (type(obj), obj)
 
-    if debug >= 3 or DEBUG >= 3:
-        print('=' * 80)
-        print(examples)
-        print('=' * 80)
-        if debug == 4 or DEBUG == 4: input('continue: ')
 
-    func_params = set(params['params'])
-    local_params = set(params['locals'])
+class CexParser:
+    '''
+        Parses esbmc counter-examples line by line (while esbmc is still
+        running), dropping repeated counter-examples.
+    '''
 
     cex_token = '[Counterexample]'
-    le = examples.find(cex_token)
 
-    if le != -1:
-        le = le + len(cex_token) + 1
+    drop_vars = ["goto_symex::guard"]
+
+    def __init__(self, params, cex_list=None, debug=0):
+        '''
+            :param params: parameters to function (including locals).
+            :param cex_list: list of counter-examples we append to.
+            :param debug: if > 0, print debug messages.
+        '''
+
+        self.func_params = set(params['params'])
+        self.local_params = set(params['locals'])
+        self.cex_list = [] if cex_list is None else cex_list
+        self.keys = set(get_obj_key(cex) for cex in self.cex_list)
+        self.debug = debug
+        # lines of current counter-example (None before the first one).
+        self.lines = None
+
+    def feed(self, line):
+        '''
+            Parses one line of esbmc output.
+
+            :param line: line (with or without end of line).
+        '''
+
+        line = line.rstrip('\n')
+        segments = line.split(self.cex_token)
+        if self.lines is not None:
+            self.lines.append(segments[0])
+        for segment in segments[1:]:
+            self.add_block()
+            # the character after the token is skipped (when the token
+            # ends the line, it is the end of line).
+            self.lines = [segment[1:]] if segment else []
+
+    def feed_text(self, text):
+        for line in text.split('\n'):
+            self.feed(line)
+
+    def close(self):
+        '''
+            Parses last counter-example.
+
+            :return: list of counter-examples.
+        '''
+
+        self.add_block()
+        self.lines = None
+        return self.cex_list
+
+    def add(self, cex):
+        '''
+            Adds counter-example to list if it is new.
+
+            :param cex: counter-example.
+
+            :return: True if counter-example was added.
+        '''
+
+        key = get_obj_key(cex)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        self.cex_list.append(cex)
+        return True
+
+    def add_block(self):
+        if self.lines is None:
+            return
+
+        debug = self.debug
 
-    while le != -1:
         has_value = False
         input_map = {}
-        param_map = { v: None for v in func_params }
-        local_map = { v: None for v in local_params }
-        examples = examples[le:]
-        ri = examples.find(cex_token)
-        if ri == -1:
-            cex = examples
-            le = ri
-        else:
-            cex = examples[:ri]
-            le = ri + len(cex_token) + 1
+        param_map = { v: None for v in self.func_params }
+        local_map = { v: None for v in self.local_params }
 
         if debug >= 3 or DEBUG >= 3:
             print('#' * 80)
-            print(cex)
+            print('\n'.join(self.lines))
             print('#' * 80)
 
-        lines = cex.split('\n')
-        for line in lines:
+        for line in self.lines:
             if line.find(' = ') != -1:
                 has_value = True
                 if debug >= 3 or DEBUG >= 3:
@@ -628,7 +760,7 @@ def parse_examples(examples, params, cex_list=[], debug=0):
                 elif var in local_map:
                     if isinstance(local_map[var], type(None)):
                         local_map[var] = value
-                elif var not in drop_vars:
+                elif var not in self.drop_vars:
                     if var in input_map:
                         input_map[var].append(value)
                     else:
@@ -640,15 +772,35 @@ def parse_examples(examples, params, cex_list=[], debug=0):
             'locals': local_map
         }
 
-        if has_value and not in_obj_list(cex, cex_list):
-            cex_list.append(cex)
-
+        if has_value and self.add(cex):
             if debug >= 3 or DEBUG >= 3:
-                print(len(cex_list), '-' * 60)
-                print(cex_list[-1])
+                print(len(self.cex_list), '-' * 60)
+                print(self.cex_list[-1])
                 if debug == 4 or DEBUG == 4: input('continue: ')
 
-    return cex_list
+
+def parse_examples(examples, params, cex_list=None, debug=0):
+
+    '''
+        Parse example file.
+
+        :param examples: examples' file.
+        :param params: parameters to function (including locals).
+        :param cex_list: list of counter-examples.
+        :param debug: if > 0, print debug messages..
+
+        :return: test values.
+    '''
+
+    if debug >= 3 or DEBUG >= 3:
+        print('=' * 80)
+        print(examples)
+        print('=' * 80)
+        if debug == 4 or DEBUG == 4: input('continue: ')
+
+    parser = CexParser(params, cex_list, debug=debug)
+    parser.feed_text(examples)
+    return parser.close()
 
 
 def has_symbolic_failed(logs):
@@ -719,6 +871,335 @@ def parse_cex(cex_list):
     return yaml.safe_dump(test_cases, default_style=None)
 
 
+def get_esbmc_version():
+    '''
+        Returns esbmc version.
+
+        :return: version string, or '' if esbmc is not available.
+    '''
+
+    global ESBMC_VERSION
+
+    if ESBMC_VERSION is None:
+        data = subprocess.run('esbmc --version', capture_output=True, shell=True, text=True)
+        ESBMC_VERSION = data.stdout.strip() if data.returncode == 0 else ''
+    return ESBMC_VERSION
+
+
+def get_timeout_seconds(timeout):
+    '''
+        Converts esbmc timeout to seconds.
+
+        :param timeout: timeout as <time>[s|m|h].
+
+        :return: number of seconds.
+    '''
+
+    timeout = timeout.strip()
+    scale = { 's': 1, 'm': 60, 'h': 3600 }
+    if timeout and timeout[-1] in scale:
+        return float(timeout[:-1]) * scale[timeout[-1]]
+    return float(timeout)
+
+
+def get_esbmc_cache_key(
+        filename, target, cflags, unwind, flags, limits=(0, 0), portfolio=(),
+        split_properties=''):
+    '''
+        Computes cache key of an esbmc run. The timeout is not part of the
+        key, as it is checked by load_esbmc_cache.
+
+        :param filename: mockup file.
+        :param target: target function.
+        :param cflags: flags passed to esbmc.
+        :param unwind: unwind parameter.
+        :param flags: additional esbmc flags.
+        :param limits: maximum number of cex and output bytes of each pass.
+        :param portfolio: configurations of ESBMC_PORTFOLIO.
+        :param split_properties: timeout of property jobs, if they are split.
+
+        :return: cache key, or '' if esbmc is not available.
+    '''
+
+    version = get_esbmc_version()
+    if not version:
+        return ''
+
+    with open(filename, 'rb') as fp:
+        source_hash = hashlib.sha256(fp.read()).hexdigest()
+
+    key = json.dumps([
+        ESBMC_CACHE_VERSION, source_hash, target, cflags, unwind, flags,
+        list(limits), list(portfolio), split_properties, version])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def get_esbmc_cache_filename(key):
+    cache_dir = os.environ.get('UNIT_TENX_CACHE', '.cache')
+    return os.path.join(cache_dir, 'esbmc', key + '.json')
+
+
+def load_esbmc_cache(key, timeout):
+    '''
+        Loads esbmc results from cache. Results that timed out are only
+        used if timeout is not larger than the one they ran with.
+
+        :param key: cache key.
+        :param timeout: current timeout in seconds.
+
+        :return: cache entry {timeout, timed_out, cex_list, logs} or None.
+    '''
+
+    if not key:
+        return None
+
+    try:
+        with open(get_esbmc_cache_filename(key), 'r') as fp:
+            entry = json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+    if entry['timed_out'] and timeout > entry['timeout']:
+        # give esbmc a chance to finish with the bigger budget.
+        return None
+
+    return entry
+
+
+def save_esbmc_cache(key, entry):
+    '''
+        Saves esbmc results to cache.
+
+        :param key: cache key.
+        :param entry: cache entry {timeout, timed_out, cex_list, logs}.
+    '''
+
+    if not key:
+        return
+
+    filename = get_esbmc_cache_filename(key)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    # targets sharing a mockup may run at the same time.
+    tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}'
+    with open(tmp_filename, 'w') as fp:
+        json.dump(entry, fp)
+    os.replace(tmp_filename, filename)
+
+
+class ProcessGroup:
+    '''
+        Esbmc sandboxes that are stopped together. Sandbox.kill does
+        nothing once the sandbox was reaped, so stopping the group never
+        kills a reused process group.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sandboxes = []
+        self.stopped = False
+
+    def add(self, sandbox):
+        with self.lock:
+            self.sandboxes.append(sandbox)
+            if self.stopped:
+                sandbox.kill()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            for sandbox in self.sandboxes:
+                sandbox.kill()
+
+
+def run_esbmc(cmd, work, parser=None, max_cex=0, max_output=0, group=None):
+    '''
+        Runs esbmc, parsing counter-examples while esbmc runs.
+
+        :param cmd: esbmc command line.
+        :param work: directory where esbmc runs.
+        :param parser: CexParser fed with each line of stderr.
+        :param max_cex: stops esbmc once parser has max_cex counter-examples.
+        :param max_output: stops esbmc after max_output bytes of stderr.
+        :param group: ProcessGroup that may stop esbmc from another thread.
+
+        :return: completed process (stdout is not kept) with peak_rss.
+    '''
+
+    # esbmc runs in its own process group, so that we can stop it (and
+    # not only the shell).
+    sandbox = Sandbox(
+        cmd, kind='esbmc', cwd=work, text=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    process = sandbox.process
+
+    if group:
+        group.add(sandbox)
+
+    stderr = []
+    output_size = 0
+    reason = ''
+    for line in process.stderr:
+        stderr.append(line)
+        output_size += len(line)
+        if parser:
+            parser.feed(line)
+        if max_cex and parser and len(parser.cex_list) >= max_cex:
+            reason = f'{len(parser.cex_list)} counter-examples'
+        elif max_output and output_size >= max_output:
+            reason = f'{output_size} bytes of output'
+        if reason:
+            print(f'... stopping esbmc after {reason}')
+            sandbox.kill()
+            break
+    process.stderr.close()
+    sandbox.wait()
+
+    if sandbox.timed_out:
+        # same message as esbmc --timeout, so that it is not seen as a failure.
+        stderr.append('ERROR: Timed out\n')
+
+    if parser:
+        if reason:
+            # the last counter-example may be incomplete.
+            parser.lines = None
+        parser.close()
+
+    data = subprocess.CompletedProcess(cmd, process.returncode, '', ''.join(stderr))
+    data.peak_rss = sandbox.peak_rss
+    return data
+
+
+def get_portfolio_configs(unwind):
+    '''
+        Returns esbmc configurations that can be used in ESBMC_PORTFOLIO.
+
+        :param unwind: default unwind (ESBMC_UNWIND).
+
+        :return: dictionary configuration -> esbmc flags.
+    '''
+
+    return {
+        'default': f'--unwind {unwind}',
+        'low-unwind': f'--unwind {max(1, unwind // 5)}',
+        'high-unwind': f'--unwind {unwind * 5}',
+        'k-induction': '--k-induction',
+        'incremental-bmc': '--incremental-bmc',
+    }
+
+
+def get_portfolio_filename(name):
+    cache_dir = os.environ.get('UNIT_TENX_CACHE', '.cache')
+    key = hashlib.sha256(name.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'esbmc', 'portfolio', key)
+
+
+def load_portfolio_winner(name):
+    '''
+        Loads configuration that won the portfolio before.
+
+        :param name: name of function and pass.
+
+        :return: configuration or ''.
+    '''
+
+    try:
+        with open(get_portfolio_filename(name), 'r') as fp:
+            return fp.read().strip()
+    except OSError:
+        return ''
+
+
+def save_portfolio_winner(name, config):
+    '''
+        Remembers configuration that won the portfolio.
+
+        :param name: name of function and pass.
+        :param config: configuration.
+    '''
+
+    filename = get_portfolio_filename(name)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}'
+    with open(tmp_filename, 'w') as fp:
+        fp.write(config)
+    os.replace(tmp_filename, filename)
+
+
+def is_useful(data, parser):
+    return bool(parser.cex_list) and not has_symbolic_failed(data.stderr)
+
+
+def run_portfolio(cmds, work, params, name, debug=0):
+    '''
+        Runs esbmc configurations at the same time. The first one that
+        finds counter-examples wins, and the others are stopped. The winner
+        is remembered, and next time it runs alone (the whole portfolio
+        runs again if it does not find counter-examples).
+
+        :param cmds: dictionary configuration -> esbmc command line.
+        :param work: directory where esbmc runs.
+        :param params: parameters to function (including locals).
+        :param name: name of function and pass, to remember the winner.
+        :param debug: if > 0, print debug messages.
+
+        :return: configuration, completed process and parser of winner.
+    '''
+
+    def run(config, group=None):
+        parser = CexParser(params, debug=debug)
+        data = run_esbmc(
+            cmds[config], work, parser, ESBMC_MAX_CEX, ESBMC_MAX_OUTPUT, group)
+        return config, data, parser
+
+    winner = load_portfolio_winner(name)
+    if winner in cmds:
+        result = run(winner)
+        if is_useful(result[1], result[2]):
+            return result
+        print(f'... {winner} did not find counter-examples, running portfolio')
+
+    # we use the cores left by the other passes.
+    workers = max(1, min(len(cmds), (os.cpu_count() or 1) // ESBMC_JOBS))
+    group = ProcessGroup()
+    results = []
+    winner = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run, config, group) for config in cmds]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if winner is None and is_useful(result[1], result[2]):
+                winner = result
+                print(f'... {result[0]} won the portfolio')
+                group.stop()
+
+    if winner is None:
+        # keep the configuration with more counter-examples.
+        order = list(cmds)
+        return max(results, key=lambda r: (len(r[2].cex_list), -order.index(r[0])))
+
+    save_portfolio_winner(name, winner[0])
+    return winner
+
+
+def get_esbmc_cflags(cflags):
+    '''
+        Translates compiler flags to esbmc flags.
+
+        :param cflags: flags used to compile program.
+
+        :return: esbmc flags.
+    '''
+
+    cflags_list = cflags.split(' ')
+    for i in range(len(cflags_list)):
+        if '-std=' in cflags_list[i] or '-ansi' in cflags_list[i]:
+            cflags_list[i] = ''
+        elif cflags_list[i] == '-include':
+            cflags_list[i] = '--include-file'
+    return ' '.join(cflags_list)
+
+
 def get_symbolic_test(
         filename,
         cflags,
@@ -739,104 +1220,349 @@ def get_symbolic_test(
 
         :return: test program
     '''
+    UNWIND = int(os.getenv('ESBMC_UNWIND', 20))
+    UNWIND_STR = f'--unwind {UNWIND}'
+
+    TIMEOUT = os.getenv('ESBMC_TIMEOUT', '10s')
+    TIMEOUT_STR = '--timeout ' + TIMEOUT
+
+    PROPERTY_TIMEOUT = os.getenv('ESBMC_PROPERTY_TIMEOUT', TIMEOUT)
+    PROPERTY_TIMEOUT_STR = '--timeout ' + PROPERTY_TIMEOUT
+
+    ESBMC_FLAGS = os.getenv('ESBMC_FLAGS', '')
+
+    esbmc_cflags = get_esbmc_cflags(cflags)
+
+    def get_cmds(unwind_str, suffix=''):
+        cmd_list = [
+            f'esbmc {filename}',
+            esbmc_cflags,
+            TIMEOUT_STR,
+            unwind_str,
+            ESBMC_FLAGS,
+            f'--function {target}',
+            '--condition-coverage',
+            #'--compact-trace', #'--no-slice',
+            #'--generate-testcase',
+            f'--cex-output {target}{suffix}'
+        ]
+
+        coverage_cmd = ' '.join(cmd_list)
+
+        # check other errors
+
+        cmd_list = [
+            f'esbmc {filename}',
+            esbmc_cflags,
+            TIMEOUT_STR,
+            unwind_str,
+            ESBMC_FLAGS,
+            f'--function {target}',
+            '--multi-property',
+            #'--compact-trace',
+            '--overflow-check',
+            '--force-malloc-success',
+            '--memory-leak-check',
+            '--struct-fields-check',
+            '--ub-shift-check',
+            '--unsigned-overflow-check',
+            #'--generate-testcase',
+            # both passes run at the same time, so they cannot share the file.
+            f'--cex-output {target}{suffix}.properties'
+        ]
+
+        property_cmd = ' '.join(cmd_list)
+
+        if not ESBMC_SPLIT_PROPERTIES:
+            return [coverage_cmd, property_cmd]
+
+        # one job per property class, so that a slow check does not stop
+        # the others from reporting counter-examples.
+        property_cmds = []
+        for name, checks in ESBMC_PROPERTY_CHECKS.items():
+            cmd_list = [
+                f'esbmc {filename}',
+                esbmc_cflags,
+                PROPERTY_TIMEOUT_STR,
+                unwind_str,
+                ESBMC_FLAGS,
+                f'--function {target}',
+                '--multi-property',
+                '--force-malloc-success',
+                checks,
+                f'--cex-output {target}{suffix}.{name}'
+            ]
+            property_cmds.append(' '.join(cmd_list))
+
+        return [coverage_cmd] + property_cmds
+
+    cmds = get_cmds(UNWIND_STR)
+    if ESBMC_SPLIT_PROPERTIES:
+        pass_names = ['coverage'] + [
+            f'properties.{name}' for name in ESBMC_PROPERTY_CHECKS]
+    else:
+        pass_names = ['coverage', 'properties']
+
+    portfolio_cmds = {}
+    if ESBMC_PORTFOLIO:
+        configs = get_portfolio_configs(UNWIND)
+        for config in ESBMC_PORTFOLIO:
+            if config in configs:
+                portfolio_cmds[config] = get_cmds(configs[config], '.' + config)
+            else:
+                print(f'... unknown esbmc configuration {config} in ESBMC_PORTFOLIO')
+
+    for cmd in cmds:
+        if (debug): print(cmd)
+        print(cmd)
+        print()
+
+    if debug == 4 or DEBUG == 4: input('continue: ')
+
+    if ESBMC_CACHE:
+        key = get_esbmc_cache_key(
+            filename, target, esbmc_cflags, UNWIND, ESBMC_FLAGS,
+            (ESBMC_MAX_CEX, ESBMC_MAX_OUTPUT), list(portfolio_cmds),
+            PROPERTY_TIMEOUT if ESBMC_SPLIT_PROPERTIES else '')
+        entry = load_esbmc_cache(key, get_timeout_seconds(TIMEOUT))
+        if entry:
+            print('... using cached esbmc results')
+            print()
+            return entry['cex_list'], entry['logs']
+
     # get function interface parameters
     params = get_function_interface(
         filename=filename,
         cflags=cflags,
         target=target)
 
-    current_path = os.getcwd()
-    os.chdir(work)
+    logs = []
+    timed_out = False
+
+    def run_pass(i):
+        if not portfolio_cmds:
+            parser = CexParser(params, debug=debug)
+            data = run_esbmc(cmds[i], work, parser, ESBMC_MAX_CEX, ESBMC_MAX_OUTPUT)
+            return cmds[i], data, parser
+
+        config, data, parser = run_portfolio(
+            { config: portfolio_cmds[config][i] for config in portfolio_cmds },
+            work, params, f'{os.path.basename(filename)}:{target}:{pass_names[i]}',
+            debug=debug)
+        return portfolio_cmds[config][i], data, parser
+
+    jobs = ESBMC_JOBS
+    if ESBMC_SPLIT_PROPERTIES:
+        jobs = max(jobs, min(len(cmds), os.cpu_count() or 1))
+
+    # the passes are independent, so we run them at the same time, and
+    # merge them in order, so that the cex list is the same as running
+    # them one after the other.
+    result = CexParser(params, debug=debug)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_pass, i) for i in range(len(cmds))]
+        for future in futures:
+            cmd, data, parser = future.result()
 
-    UNWIND = int(os.getenv('ESBMC_UNWIND', 20))
-    UNWIND_STR = f'--unwind {UNWIND}'
+            if debug >= 3 or DEBUG >= 3:
+                print(data.stderr)
 
-    TIMEOUT = os.getenv('ESBMC_TIMEOUT', '10s')
-    TIMEOUT_STR = '--timeout ' + TIMEOUT
+            logs.append(cmd)
+            if "ERROR:" in data.stderr:
+                logs.append(data.stderr)
+            if "Timed out" in data.stderr:
+                timed_out = True
 
-    ESBMC_FLAGS = os.getenv('ESBMC_FLAGS', '')
+            for cex in parser.cex_list:
+                result.add(cex)
 
-    cflags_list = cflags.split(' ')
-    for i in range(len(cflags_list)):
-        if '-std=' in cflags_list[i] or '-ansi' in cflags_list[i]:
-            cflags_list[i] = ''
-        elif cflags_list[i] == '-include':
-            cflags_list[i] = '--include-file'
-    cflags = ' '.join(cflags_list)
+    cex_list = result.cex_list
 
-    cmd_list = [
-		f'esbmc {filename}',
-        cflags,
-        TIMEOUT_STR,
-        UNWIND_STR,
-        ESBMC_FLAGS,
-		f'--function {target}',
-		'--condition-coverage',
-        #'--compact-trace', #'--no-slice',
-		#'--generate-testcase',
-		f'--cex-output {target}'
-    ]
+    # errors other than time outs are not cached, as they usually come from
+    # the environment (missing esbmc, headers, etc).
+    if ESBMC_CACHE and not has_symbolic_failed('\n\n'.join(logs)):
+        save_esbmc_cache(key, {
+            'timeout': get_timeout_seconds(TIMEOUT),
+            'timed_out': timed_out,
+            'cex_list': cex_list,
+            'logs': logs
+        })
 
-    cmd = ' '.join(cmd_list)
+    return cex_list, logs
 
-    if (debug): print(cmd)
 
-    if debug == 4 or DEBUG == 4: input('continue: ')
+# matches an entry of the missing coverage report:
+# <file>:<function>: could not reach lines: 1,2,3
+UNCOVERED_RE = re.compile(r'^(.*):([^:]*): could not reach lines:\s*([\d,\s]*)$')
 
-    logs = [cmd]
+# lines that do not start a statement, so we cannot add an assertion to them.
+NOT_A_STATEMENT = ('#', '{', '}', 'else', 'case', 'default', '//', '/*', '*')
 
-    print(cmd)
-    print()
 
-    data = subprocess.run(cmd, capture_output=True, shell=True, text=True)
+def get_uncovered_lines(missing_coverage, filename):
+    '''
+        Extracts lines of filename that were not reached by the unit tests.
 
-    if "ERROR:" in data.stderr:
-        logs.append(data.stderr)
+        :param missing_coverage: missing coverage report (yaml list).
+        :param filename: source file.
 
-    cex_list = parse_examples(data.stderr, params, debug=debug)
+        :return: sorted list of lines.
+    '''
 
-    # check other errors
+    if not missing_coverage:
+        return []
+    if isinstance(missing_coverage, str):
+        missing_coverage = yaml.safe_load(missing_coverage) or []
 
-    cmd_list = [
-		f'esbmc {filename}',
+    lines = set()
+    for entry in missing_coverage:
+        match = UNCOVERED_RE.match(str(entry).strip())
+        if not match:
+            continue
+        f, _, numbers = match.groups()
+        if os.path.abspath(f) != os.path.abspath(filename):
+            continue
+        lines.update(int(n) for n in re.findall(r'\d+', numbers))
+    return sorted(lines)
+
+
+def add_reachability_asserts(source, lines):
+    '''
+        Adds a failing assertion in front of each line, so that esbmc
+        reports an input reaching it. The assertion is added to the same
+        line, so that line numbers do not change.
+
+        :param source: source code.
+        :param lines: lines to be reached.
+
+        :return: instrumented source and lines that received assertions.
+    '''
+
+    source_lines = source.split('\n')
+    instrumented = []
+    for line in sorted(set(lines)):
+        if line < 1 or line > len(source_lines):
+            continue
+        text = source_lines[line - 1]
+        stripped = text.lstrip()
+        if not stripped or stripped.startswith(NOT_A_STATEMENT):
+            continue
+
+        # the previous line must end a statement or open a block, otherwise
+        # we would change the body of an if/while or split an expression.
+        previous = ''
+        for i in range(line - 2, -1, -1):
+            previous = source_lines[i].split('//')[0].strip()
+            if previous:
+                break
+        if previous and (
+                previous[-1] not in ';{}:' or
+                previous.endswith('\\') or
+                previous.replace(' ', '').endswith('={')):
+            continue
+
+        indent = text[:len(text) - len(stripped)]
+        source_lines[line - 1] = (
+            f'{indent}__ESBMC_assert(0, "unittenx: reach line {line}"); {stripped}')
+        instrumented.append(line)
+
+    return '\n'.join(source_lines), instrumented
+
+
+def get_targeted_symbolic_test(
+        filename,
         cflags,
-        TIMEOUT_STR,
-		UNWIND_STR,
+        target,
+        lines,
+        work,
+        debug=False):
+
+    '''
+        Run esbmc to get inputs that reach lines not covered by the unit
+        tests.
+
+        :param filename: mockup file.
+        :param cflags: flags used to compile program.
+        :param target: function name of target.
+        :param lines: lines of filename to be reached.
+        :param work: directory where the instrumented file is written.
+        :param debug: if True, print debugging messages..
+
+        :return: cex list, logs and lines that received assertions.
+    '''
+
+    UNWIND = int(os.getenv('ESBMC_UNWIND', 20))
+    TIMEOUT = os.getenv('ESBMC_TIMEOUT', '10s')
+    ESBMC_FLAGS = os.getenv('ESBMC_FLAGS', '')
+
+    with open(filename, 'r') as fp:
+        source, instrumented = add_reachability_asserts(fp.read(), lines)
+
+    if not instrumented:
+        return [], [], []
+
+    # the instrumented copy lives in work, so relative includes of the
+    # mockup are searched in its original directory.
+    name, ext = os.path.splitext(os.path.basename(filename))
+    targeted_filename = os.path.join(os.path.abspath(work), f'{name}.targeted{ext}')
+    with open(targeted_filename, 'w') as fp:
+        fp.write(source)
+
+    esbmc_cflags = get_esbmc_cflags(cflags) + f' -I{os.path.dirname(os.path.abspath(filename))}'
+
+    cmd_list = [
+        f'esbmc {targeted_filename}',
+        esbmc_cflags,
+        f'--timeout {TIMEOUT}',
+        f'--unwind {UNWIND}',
         ESBMC_FLAGS,
-		f'--function {target}',
+        f'--function {target}',
         '--multi-property',
-		#'--compact-trace',
-		'--overflow-check',
+        '--no-unwinding-assertions',
         '--force-malloc-success',
-		'--memory-leak-check',
-		'--struct-fields-check',
-		'--ub-shift-check',
-		'--unsigned-overflow-check',
-		#'--generate-testcase',
-		f'--cex-output {target}'
+        NO_DEFAULT_CHECKS,
+        f'--cex-output {target}.targeted'
     ]
-
     cmd = ' '.join(cmd_list)
 
     if (debug): print(cmd)
-
-    if debug == 4 or DEBUG == 4: input('continue: ')
-
-    logs.append(cmd)
-
     print(cmd)
     print()
 
-    data = subprocess.run(cmd, capture_output=True, shell=True, text=True)
+    if ESBMC_CACHE:
+        key = get_esbmc_cache_key(
+            targeted_filename, target, esbmc_cflags, UNWIND, ESBMC_FLAGS,
+            (ESBMC_MAX_CEX, ESBMC_MAX_OUTPUT), ['targeted'])
+        entry = load_esbmc_cache(key, get_timeout_seconds(TIMEOUT))
+        if entry:
+            print('... using cached esbmc results')
+            print()
+            return entry['cex_list'], entry['logs'], instrumented
 
-    cex_list = parse_examples(data.stderr, params, cex_list, debug=debug)
+    params = get_function_interface(
+        filename=filename,
+        cflags=cflags,
+        target=target)
+
+    parser = CexParser(params, debug=debug)
+    data = run_esbmc(cmd, work, parser, ESBMC_MAX_CEX, ESBMC_MAX_OUTPUT)
 
+    if debug >= 3 or DEBUG >= 3:
+        print(data.stderr)
+
+    logs = [cmd]
     if "ERROR:" in data.stderr:
         logs.append(data.stderr)
 
-    os.chdir(current_path)
+    if ESBMC_CACHE and not has_symbolic_failed('\n\n'.join(logs)):
+        save_esbmc_cache(key, {
+            'timeout': get_timeout_seconds(TIMEOUT),
+            'timed_out': "Timed out" in data.stderr,
+            'cex_list': parser.cex_list,
+            'logs': logs
+        })
 
-    return cex_list, logs
+    return parser.cex_list, logs, instrumented
 
 
 def parse_args(arg_list: list[str] | None):
@@ -0,0 +1,70 @@
+# Copyright 2025 Claudionor N. Coelho Jr
+
+import json
+import os
+import time
+
+# if set, the wall time of every graph node is appended to this file.
+TIMING = os.getenv('UNITTENX_TIMING', '')
+
+
+def timed(name: str, node):
+    '''
+        Wraps a graph node to measure its wall time.
+
+        :param name: node name.
+        :param node: node function(state, config).
+
+        :return: wrapped node.
+    '''
+
+    def timed_node(state, config):
+        start_time = time.time()
+        try:
+            return node(state, config)
+        finally:
+            elapsed_time = time.time() - start_time
+            print(f'... {name} took {elapsed_time:.2f}s')
+            if TIMING:
+                with open(TIMING, 'a') as fp:
+                    fp.write(json.dumps({
+                        'target': state.get('name', ''),
+                        'node': name,
+                        'seconds': elapsed_time
+                    }) + '\n')
+
+    return timed_node
+
+
+def load_timings(filename: str) -> list[dict]:
+    '''
+        Reads node timings written by timed.
+
+        :param filename: timing file name.
+
+        :return: list of timing entries.
+    '''
+
+    with open(filename, 'r') as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def summarize_timings(timings: list[dict]) -> dict:
+    '''
+        Aggregates wall time per node.
+
+        :param timings: list of timing entries.
+
+        :return: dictionary node -> {calls, total, mean, max}.
+    '''
+
+    summary = {}
+    for entry in timings:
+        node = summary.setdefault(
+            entry['node'], {'calls': 0, 'total': 0.0, 'max': 0.0})
+        node['calls'] += 1
+        node['total'] += entry['seconds']
+        node['max'] = max(node['max'], entry['seconds'])
+    for node in summary.values():
+        node['mean'] = node['total'] / node['calls']
+    return summary